@@ -0,0 +1,31 @@
+from app.configs import APP_SETTINGS
+
+from .module.base import AsyncRedisCache, BaseAsyncRedisCache, BaseRedisCache, RedisCache
+from .module.codec import CacheSerializer
+from .module.memory import MEMORY_STORE, AsyncMemoryCache, MemoryCache
+
+
+def memory_backend() -> bool:
+    return APP_SETTINGS.CACHE_BACKEND == "memory"
+
+
+def create_cache(redis_conn, prefix: str = "", expiration: int = 60 * 60 * 12,
+                 serializer: CacheSerializer = None) -> BaseRedisCache:
+    """
+    Create a sync cache of the configured backend (CACHE_BACKEND),
+    redis_conn is unused by the memory backend.
+    """
+    if memory_backend():
+        return MemoryCache(MEMORY_STORE, prefix, expiration, serializer)
+    return RedisCache(redis_conn, prefix, expiration, serializer)
+
+
+def create_async_cache(redis_conn, prefix: str = "", expiration: int = 60 * 60 * 12,
+                       serializer: CacheSerializer = None) -> BaseAsyncRedisCache:
+    """
+    Create an async cache of the configured backend (CACHE_BACKEND),
+    redis_conn is unused by the memory backend.
+    """
+    if memory_backend():
+        return AsyncMemoryCache(MEMORY_STORE, prefix, expiration, serializer)
+    return AsyncRedisCache(redis_conn, prefix, expiration, serializer)
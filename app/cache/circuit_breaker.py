@@ -0,0 +1,326 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from queue import Empty, LifoQueue
+from typing import Deque, Optional, Tuple
+
+import redis
+import redis.asyncio as aioredis
+
+from app.cache.metrics import REDIS_CIRCUIT_BREAKER_REJECTED_CALLS, REDIS_CIRCUIT_BREAKER_STATE
+from app.configs import APP_SETTINGS
+from app.log import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# errors of redis itself, the replies of failed commands (e.g. WRONGTYPE) do not count
+FAILURES = (redis.ConnectionError, redis.TimeoutError)
+
+
+class CircuitOpenError(redis.ConnectionError):
+    """
+    Raised instead of calling redis while the circuit is open, a ConnectionError so the callers
+    handling redis being down handle it the same way.
+    """
+
+
+class PoolExhaustedError(redis.ConnectionError):
+    """
+    Raised by the blocking pools when no connection is freed within their timeout. The pool of this
+    process is saturated, redis was not called: the breaker records no outcome for it.
+    """
+
+
+class _Checkout:
+    """
+    The time a call let through by the breaker waited for pooled connections,
+    not counted in its duration.
+    """
+
+    def __init__(self):
+        self.wait = 0.0
+        self.started: Optional[float] = None
+
+
+_CHECKOUT: contextvars.ContextVar[Optional[_Checkout]] = contextvars.ContextVar("redis_checkout",
+                                                                               default=None)
+
+
+class _CheckoutQueue(LifoQueue):
+    """
+    The queue of the connections of BlockingConnectionPool, timing the wait for a free one.
+    """
+
+    def get(self, block=True, timeout=None):
+        start = time.monotonic()
+        try:
+            return super().get(block, timeout)
+        finally:
+            checkout = _CHECKOUT.get()
+            if checkout is not None:
+                checkout.wait += time.monotonic() - start
+
+
+class BlockingConnectionPool(redis.BlockingConnectionPool):
+    """
+    Blocking pool whose checkout wait and timeout are not counted by the circuit breaker.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("queue_class", _CheckoutQueue)
+        super().__init__(*args, **kwargs)
+
+    def get_connection(self, command_name, *keys, **options):
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError as e:
+            if isinstance(e.__context__, Empty):
+                raise PoolExhaustedError(str(e)) from e
+            raise
+
+
+class AsyncBlockingConnectionPool(aioredis.BlockingConnectionPool):
+    """
+    Async blocking pool whose checkout wait and timeout are not counted by the circuit breaker.
+    """
+
+    async def get_connection(self, command_name, *keys, **options):
+        checkout = _CHECKOUT.get()
+        if checkout is not None:
+            checkout.started = time.monotonic()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError as e:
+            if isinstance(e.__cause__, asyncio.TimeoutError):
+                raise PoolExhaustedError(str(e)) from e
+            raise
+
+    async def ensure_connection(self, connection):
+        # called once the connection is checked out, before connecting it
+        checkout = _CHECKOUT.get()
+        if checkout is not None and checkout.started is not None:
+            checkout.wait += time.monotonic() - checkout.started
+            checkout.started = None
+        await super().ensure_connection(connection)
+
+
+class CircuitBreaker:
+    """
+    Fail fast while redis is down or slow, instead of holding every call for the socket timeout.
+
+    The outcomes of the last `window_size` calls are kept, once there are at least `min_calls` of them
+    the circuit opens if the rate of failures or of calls slower than `slow_call_duration` seconds
+    reaches its threshold. While open, calls raise CircuitOpenError without reaching redis.
+    After `open_duration` seconds the circuit is half open: `half_open_calls` trial calls are let through,
+    it closes if they all succeed in time and opens again on the first one that does not.
+    """
+
+    def __init__(self,
+                 name: str,
+                 window_size: int = 50,
+                 min_calls: int = 10,
+                 failure_rate_threshold: float = 0.5,
+                 slow_call_duration: float = 0.5,
+                 slow_call_rate_threshold: float = 0.5,
+                 open_duration: float = 10,
+                 half_open_calls: int = 3):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)  # (failed, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._trial_successes = 0
+        self._lock = threading.Lock()  # the sync client is also used from the executor threads
+        self._state_gauge = REDIS_CIRCUIT_BREAKER_STATE.labels(breaker=name)
+        self._rejected = REDIS_CIRCUIT_BREAKER_REJECTED_CALLS.labels(breaker=name)
+        self._state_gauge.set(_STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+                return HALF_OPEN
+            return self._state
+
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        logger.warning(f"Redis circuit breaker {self.name} is {state.replace('_', ' ')}")
+        self._state = state
+        self._state_gauge.set(_STATE_VALUES[state])
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._trials = 0
+            self._trial_successes = 0
+        else:
+            self._outcomes.clear()
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if the call is not allowed.
+        """
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_duration:
+                    self._rejected.inc()
+                    raise CircuitOpenError(f"Redis circuit breaker {self.name} is open")
+                self._transition(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    self._rejected.inc()
+                    raise CircuitOpenError(f"Redis circuit breaker {self.name} is half open")
+                self._trials += 1
+
+    def record(self, duration: float, failed: Optional[bool]):
+        """
+        Record the outcome of a call let through by before_call, `failed` None if it did not complete
+        (e.g. cancelled): its trial is released without an outcome.
+        """
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            if failed is None:
+                if self._state == HALF_OPEN:
+                    self._trials -= 1
+                return
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN)
+                else:
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.half_open_calls:
+                        self._transition(CLOSED)
+                return
+            if self._state == OPEN:
+                return  # a call started before the circuit opened
+
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            slow_calls = sum(1 for _, slow in self._outcomes if slow)
+            if (failures / calls >= self.failure_rate_threshold
+                    or slow_calls / calls >= self.slow_call_rate_threshold):
+                self._transition(OPEN)
+
+    def call(self, fn, *args, **kwargs):
+        self.before_call()
+        checkout = _Checkout()
+        token = _CHECKOUT.set(checkout)
+        start = time.monotonic()
+        failed = None
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        except PoolExhaustedError:
+            raise  # no outcome, redis was not called
+        except FAILURES:
+            failed = True
+            raise
+        except redis.RedisError:
+            failed = False  # an error reply, redis answered
+            raise
+        finally:
+            _CHECKOUT.reset(token)
+            self.record(time.monotonic() - start - checkout.wait, failed)
+
+    async def call_async(self, fn, *args, **kwargs):
+        self.before_call()
+        checkout = _Checkout()
+        token = _CHECKOUT.set(checkout)
+        start = time.monotonic()
+        failed = None
+        try:
+            result = await fn(*args, **kwargs)
+            failed = False
+            return result
+        except PoolExhaustedError:
+            raise  # no outcome, redis was not called
+        except FAILURES:
+            failed = True
+            raise
+        except redis.RedisError:
+            failed = False  # an error reply, redis answered
+            raise
+        finally:
+            _CHECKOUT.reset(token)
+            self.record(time.monotonic() - start - checkout.wait, failed)
+
+
+def create_circuit_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(name,
+                          window_size=APP_SETTINGS.REDIS_CIRCUIT_BREAKER_WINDOW_SIZE,
+                          min_calls=APP_SETTINGS.REDIS_CIRCUIT_BREAKER_MIN_CALLS,
+                          failure_rate_threshold=APP_SETTINGS.REDIS_CIRCUIT_BREAKER_FAILURE_RATE,
+                          slow_call_duration=APP_SETTINGS.REDIS_CIRCUIT_BREAKER_SLOW_CALL_DURATION,
+                          slow_call_rate_threshold=APP_SETTINGS.REDIS_CIRCUIT_BREAKER_SLOW_CALL_RATE,
+                          open_duration=APP_SETTINGS.REDIS_CIRCUIT_BREAKER_OPEN_DURATION,
+                          half_open_calls=APP_SETTINGS.REDIS_CIRCUIT_BREAKER_HALF_OPEN_CALLS)
+
+
+class _CircuitBreakerMixin:
+    """
+    Send the commands and pipelines of a sync redis client through its circuit breaker, if it has one.
+    """
+    circuit_breaker: CircuitBreaker = None
+
+    def execute_command(self, *args, **kwargs):
+        if self.circuit_breaker is None:
+            return super().execute_command(*args, **kwargs)
+        return self.circuit_breaker.call(super().execute_command, *args, **kwargs)
+
+    def pipeline(self, *args, **kwargs):
+        pipe = super().pipeline(*args, **kwargs)
+        if self.circuit_breaker is not None:
+            execute, breaker = pipe.execute, self.circuit_breaker
+            pipe.execute = lambda *a, **kw: breaker.call(execute, *a, **kw)
+        return pipe
+
+
+class _AsyncCircuitBreakerMixin:
+    """
+    Send the commands and pipelines of an async redis client through its circuit breaker, if it has one.
+    """
+    circuit_breaker: CircuitBreaker = None
+
+    async def execute_command(self, *args, **kwargs):
+        if self.circuit_breaker is None:
+            return await super().execute_command(*args, **kwargs)
+        return await self.circuit_breaker.call_async(super().execute_command, *args, **kwargs)
+
+    def pipeline(self, *args, **kwargs):
+        pipe = super().pipeline(*args, **kwargs)
+        if self.circuit_breaker is not None:
+            execute, breaker = pipe.execute, self.circuit_breaker
+            pipe.execute = lambda *a, **kw: breaker.call_async(execute, *a, **kw)
+        return pipe
+
+
+class CircuitBreakerRedis(_CircuitBreakerMixin, redis.Redis):
+    pass
+
+
+class CircuitBreakerRedisCluster(_CircuitBreakerMixin, redis.RedisCluster):
+    pass
+
+
+class AsyncCircuitBreakerRedis(_AsyncCircuitBreakerMixin, aioredis.Redis):
+    pass
+
+
+class AsyncCircuitBreakerRedisCluster(_AsyncCircuitBreakerMixin, aioredis.RedisCluster):
+    pass
@@ -0,0 +1,238 @@
+import contextlib
+import functools
+import inspect
+import math
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+import redis
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.configs import APP_SETTINGS
+from app.database.postgres.session import ASYNC_SESSION
+from app.log import logger
+from app.utils.singleflight import SingleFlight
+
+from .backend import create_async_cache
+from .module.base import AsyncRedisCache, BaseAsyncRedisCache
+from .module.memory import MEMORY_STORE, AsyncMemoryCache
+from .module.tiered import CacheInvalidationBus, TieredAsyncRedisCache
+from .module.tracking import ClientTracking, TrackedAsyncRedisCache
+
+KeyBuilder = Union[str, Callable[..., str]]
+TagsBuilder = Union[Iterable[str], Callable[..., Iterable[str]]]
+
+
+class ServiceCache:
+    """
+    Caches of the functions decorated with @cached_async, one AsyncRedisCache per prefix.
+    It is configured with the process wide redis client in lifespan, or None with the memory backend
+    (then the results are kept in MEMORY_STORE). Until then (e.g. in tests without lifespan)
+    the decorated functions are called directly and tag invalidations are no-op.
+
+    Every tag is a redis set of the cache keys stored with it,
+    invalidate_tags() deletes the keys and the set.
+    """
+
+    def __init__(self, tag_prefix: str = "cache_tag:"):
+        self.tag_prefix = tag_prefix
+        self.redis = None
+        self.configured = False
+        self.invalidation_bus: Optional[CacheInvalidationBus] = None
+        self.client_tracking: Optional[ClientTracking] = None
+        self._caches: Dict[str, BaseAsyncRedisCache] = {}
+        # the tags of the memory backend, lists of the cache keys
+        self._memory_tags = AsyncMemoryCache(MEMORY_STORE, tag_prefix)
+        self.single_flight = SingleFlight()
+
+    @property
+    def enabled(self) -> bool:
+        return self.configured and APP_SETTINGS.SERVICE_CACHE_ENABLED
+
+    def configure(self, redis_conn, invalidation_bus: CacheInvalidationBus = None,
+                  client_tracking: ClientTracking = None):
+        self.redis = redis_conn
+        self.configured = True
+        self.invalidation_bus = invalidation_bus
+        self.client_tracking = client_tracking
+        self._caches.clear()
+
+    def reset(self):
+        self.configure(None)
+        self.configured = False
+
+    def cache(self, prefix: str, ttl: int, local_ttl: int,
+              client_tracking: bool = False) -> BaseAsyncRedisCache:
+        cache = self._caches.get(prefix)
+        if cache is None:
+            if self.redis is None:
+                cache = AsyncMemoryCache(MEMORY_STORE, prefix, ttl)
+            elif client_tracking and self.client_tracking is not None:
+                cache = TrackedAsyncRedisCache(self.redis, self.client_tracking, prefix, ttl)
+            elif local_ttl:
+                # served stale while redis is down, rather than loading every call from the database
+                cache = TieredAsyncRedisCache(self.redis, prefix, ttl, local_ttl=local_ttl,
+                                              invalidation_bus=self.invalidation_bus,
+                                              stale_ttl=APP_SETTINGS.SERVICE_CACHE_STALE_TTL)
+            else:
+                cache = AsyncRedisCache(self.redis, prefix, ttl)
+            self._caches[prefix] = cache
+        return cache
+
+    async def tag(self, tags: Iterable[str], cache: BaseAsyncRedisCache, key: str):
+        member = f"{cache.prefix}\x00{key}"
+        if self.redis is None:
+            for tag in tags:
+                members = await self._memory_tags.get(tag) or []
+                if member not in members:
+                    await self._memory_tags.set(tag, members + [member])
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                # the set lives as long as the latest key stored with the tag
+                pipe.sadd(f"{self.tag_prefix}{tag}", member)
+                pipe.expire(f"{self.tag_prefix}{tag}", cache.expiration)
+            await pipe.execute()
+
+    async def invalidate_tags(self, *tags: str):
+        """
+        Delete the cached results stored with any of the tags,
+        called by the service functions changing them.
+        """
+        if not self.enabled:
+            return
+        try:
+            for tag in tags:
+                tag_key = f"{self.tag_prefix}{tag}"
+                if self.redis is None:
+                    members = await self._memory_tags.get(tag) or []
+                else:
+                    members = await self.redis.smembers(tag_key)
+                keys_by_prefix: Dict[str, list] = {}
+                for member in members:
+                    member = member.decode() if isinstance(member, bytes) else member
+                    prefix, key = member.split("\x00", 1)
+                    keys_by_prefix.setdefault(prefix, []).append(key)
+                for prefix, keys in keys_by_prefix.items():
+                    cache = self._caches.get(prefix) or create_async_cache(self.redis, prefix)
+                    await cache.delete_many(keys)
+                if self.redis is None:
+                    await self._memory_tags.delete(tag)
+                else:
+                    await self.redis.delete(tag_key)
+        except redis.RedisError as e:
+            logger.error(f"Failed to invalidate cache tags {tags}: {e}")
+
+
+SERVICE_CACHE = ServiceCache()
+
+
+async def invalidate_tags(*tags: str):
+    await SERVICE_CACHE.invalidate_tags(*tags)
+
+
+def _build(builder, bound: inspect.BoundArguments):
+    if callable(builder):
+        return builder(*bound.args, **bound.kwargs)
+    if isinstance(builder, str):
+        return builder.format(**bound.arguments)
+    return [tag.format(**bound.arguments) for tag in builder]
+
+
+def cached_async(prefix: str,
+                 key: KeyBuilder,
+                 model: Any = Any,
+                 ttl: int = 60,
+                 tags: TagsBuilder = (),
+                 local_ttl: int = 0,
+                 client_tracking: bool = False,
+                 beta: float = 1.0):
+    """
+    Cache-aside for async functions, the results are cached in redis under `prefix` + key.
+
+    :param prefix: Prefix of the cache keys, one cache per prefix.
+    :param key: Format string of the function arguments (e.g. "{role_id}") or a callable taking
+                the same arguments.
+    :param model: Type of the result, used to dump it to json and validate it back
+                  (pydantic TypeAdapter).
+    :param ttl: Expiration of the cached results in seconds.
+    :param tags: Format strings or a callable of the function arguments, see invalidate_tags().
+    :param local_ttl: Keep the results in process for this many seconds too,
+                      see TieredAsyncRedisCache.
+    :param client_tracking: Keep the results in process until redis invalidates them,
+                            see TrackedAsyncRedisCache. For read-mostly results which must reflect
+                            changes at once, local_ttl is ignored.
+    :param beta: Early refresh factor, the result of a slow load is recomputed earlier before it
+                 expires (probabilistic early expiration), 0 disables it.
+
+    Concurrent misses of a key in the process share one call. None results are not cached.
+    The shared call outlives the request which started it, so it opens its own database sessions
+    instead of the request-scoped AsyncSession arguments.
+    """
+    adapter = TypeAdapter(model)
+
+    def decorator(f):
+        signature = inspect.signature(f)
+
+        async def load(cache: BaseAsyncRedisCache, cache_key: str, bound: inspect.BoundArguments):
+            start = time.monotonic()
+            async with contextlib.AsyncExitStack() as stack:
+                arguments = dict(bound.arguments)
+                for name, value in arguments.items():
+                    if isinstance(value, AsyncSession):
+                        arguments[name] = await stack.enter_async_context(ASYNC_SESSION())
+                shared = inspect.BoundArguments(signature, arguments)
+                result = await f(*shared.args, **shared.kwargs)
+            delta = time.monotonic() - start
+            if result is None:
+                return result
+            try:
+                await cache.set(cache_key, {"value": adapter.dump_python(result, mode="json"),
+                                            "delta": delta,
+                                            "expires_at": time.time() + ttl})
+                cache_tags = _build(tags, bound)
+                if cache_tags:
+                    await SERVICE_CACHE.tag(cache_tags, cache, cache_key)
+            except redis.RedisError as e:
+                logger.error(f"Failed to cache {f.__name__} result: {e}")
+            return result
+
+        @functools.wraps(f)
+        async def wrapper(*args, **kwargs):
+            if not SERVICE_CACHE.enabled:
+                return await f(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            cache_key = _build(key, bound)
+            cache = SERVICE_CACHE.cache(prefix, ttl, local_ttl, client_tracking)
+            try:
+                cached = await cache.get(cache_key)
+            except redis.RedisError as e:
+                logger.error(f"Failed to get cached {f.__name__} result: {e}")
+                return await f(*args, **kwargs)
+
+            if cached is not None:
+                # recompute before expiration, more likely as the expiration gets closer
+                early = cached["delta"] * beta * math.log(1 - random.random())
+                if time.time() - early < cached["expires_at"]:
+                    try:
+                        return adapter.validate_python(cached["value"])
+                    except ValidationError as e:
+                        # e.g. cached before a deploy changing the model, loaded again as a miss
+                        logger.error(f"Invalid cached {f.__name__} result, dropped: {e}")
+                        try:
+                            await cache.delete(cache_key)
+                        except redis.RedisError as e:
+                            logger.error(f"Failed to delete cached {f.__name__} result: {e}")
+
+            return await SERVICE_CACHE.single_flight.do(f"{prefix}{cache_key}",
+                                                        lambda: load(cache, cache_key, bound))
+
+        wrapper.cache_prefix = prefix
+        return wrapper
+
+    return decorator
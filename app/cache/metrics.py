@@ -0,0 +1,180 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+import redis
+import redis.asyncio as aioredis
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+
+def _sync_pool_usage(pool: redis.ConnectionPool) -> Tuple[int, int]:
+    """
+    (in use, idle) connections of a sync connection pool.
+    """
+    if isinstance(pool, redis.BlockingConnectionPool):
+        # the queue holds the idle connections, and None in place of the ones not created yet
+        idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+        return len(pool._connections) - idle, idle
+    return len(pool._in_use_connections), len(pool._available_connections)
+
+
+def _pool_usage(redis_conn) -> Iterator[Tuple[str, int, int, int]]:
+    """
+    Yield (node, in use, idle, max connections) of every connection pool of the client.
+    """
+    if isinstance(redis_conn, aioredis.RedisCluster):
+        for node in redis_conn.get_nodes():
+            idle = len(node._free)
+            yield node.name, len(node._connections) - idle, idle, node.max_connections
+    elif isinstance(redis_conn, redis.RedisCluster):
+        for node in redis_conn.get_nodes():
+            if node.redis_connection is not None:
+                pool = node.redis_connection.connection_pool
+                yield node.name, *_sync_pool_usage(pool), pool.max_connections
+    elif isinstance(redis_conn, redis.Redis):
+        pool = redis_conn.connection_pool
+        node = f'{pool.connection_kwargs.get("host")}:{pool.connection_kwargs.get("port")}'
+        yield node, *_sync_pool_usage(pool), pool.max_connections
+    else:
+        pool = redis_conn.connection_pool
+        node = f'{pool.connection_kwargs.get("host")}:{pool.connection_kwargs.get("port")}'
+        yield node, len(pool._in_use_connections), len(pool._available_connections), pool.max_connections
+
+
+class RedisPoolCollector(Collector):
+    """
+    Report the connection pool usage of the process wide redis clients when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, object] = {}
+
+    def track(self, client: str, redis_conn):
+        self._clients[client] = redis_conn
+
+    def untrack(self, client: str):
+        self._clients.pop(client, None)
+
+    def collect(self):
+        labels = ["client", "node"]
+        in_use = GaugeMetricFamily("portal_backend_backend_redis_pool_connections_in_use",
+                                   "Redis connections checked out of the pool", labels=labels)
+        idle = GaugeMetricFamily("portal_backend_backend_redis_pool_connections_idle",
+                                 "Redis connections idle in the pool", labels=labels)
+        max_connections = GaugeMetricFamily("portal_backend_backend_redis_pool_max_connections",
+                                            "Max connections of the redis pool", labels=labels)
+        for client, redis_conn in list(self._clients.items()):
+            for node, node_in_use, node_idle, node_max in _pool_usage(redis_conn):
+                in_use.add_metric([client, node], node_in_use)
+                idle.add_metric([client, node], node_idle)
+                max_connections.add_metric([client, node], node_max)
+        yield in_use
+        yield idle
+        yield max_connections
+
+
+REDIS_POOL_COLLECTOR = RedisPoolCollector()
+REGISTRY.register(REDIS_POOL_COLLECTOR)
+
+
+TIERED_CACHE_HITS = Counter("tiered_cache_hits",
+                            "Tiered cache reads served by the in-process (l1) or redis (l2) tier",
+                            ["prefix", "tier"], namespace="portal_backend", subsystem="backend")
+TIERED_CACHE_MISSES = Counter("tiered_cache_misses",
+                              "Tiered cache reads found in neither tier",
+                              ["prefix"], namespace="portal_backend", subsystem="backend")
+TIERED_CACHE_EVICTIONS = Counter("tiered_cache_evictions",
+                                 "Entries evicted from the in-process tier because it is full",
+                                 ["prefix"], namespace="portal_backend", subsystem="backend")
+
+REDIS_CIRCUIT_BREAKER_STATE = Gauge("redis_circuit_breaker_state",
+                                    "State of the redis circuit breaker: 0 closed, 1 half open, 2 open",
+                                    ["breaker"], namespace="portal_backend", subsystem="backend")
+REDIS_CIRCUIT_BREAKER_REJECTED_CALLS = Counter("redis_circuit_breaker_rejected_calls",
+                                               "Redis calls failed fast because the circuit breaker is open",
+                                               ["breaker"], namespace="portal_backend", subsystem="backend")
+
+MEMORY_CACHE_BYTES = Gauge("memory_cache_bytes",
+                           "Size of the keys and values of the memory cache backend",
+                           namespace="portal_backend", subsystem="backend")
+MEMORY_CACHE_EVICTIONS = Counter("memory_cache_evictions",
+                                 "LRU entries evicted from the memory cache backend because it is full",
+                                 namespace="portal_backend", subsystem="backend")
+
+CACHE_HITS = Counter("cache_hits",
+                     "Cache reads of keys found",
+                     ["prefix", "operation"], namespace="portal_backend", subsystem="backend")
+CACHE_MISSES = Counter("cache_misses",
+                       "Cache reads of keys not found",
+                       ["prefix", "operation"], namespace="portal_backend", subsystem="backend")
+CACHE_ERRORS = Counter("cache_errors",
+                       "Cache operations failed, e.g. redis unavailable",
+                       ["prefix", "operation"], namespace="portal_backend", subsystem="backend")
+CACHE_OPERATION_SECONDS = Histogram("cache_operation_seconds",
+                                    "Duration of the cache operations",
+                                    ["prefix", "operation"], namespace="portal_backend", subsystem="backend",
+                                    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                                             2.5, 5, 10))
+CACHE_PAYLOAD_BYTES = Histogram("cache_payload_bytes",
+                                "Size of the serialized values written and read",
+                                ["prefix", "operation"], namespace="portal_backend", subsystem="backend",
+                                buckets=(64, 256, 1024, 4096, 16384, 65536, 262144, 1048576))
+
+
+class CacheMetrics:
+    """
+    Metrics of the operations of one cache, labelled by its prefix and the operation (get, set, get_many...).
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._children: Dict[Tuple[str, str], object] = {}
+
+    def _child(self, metric, operation: str):
+        child = self._children.get((metric._name, operation))
+        if child is None:
+            child = metric.labels(prefix=self.prefix, operation=operation)
+            self._children[(metric._name, operation)] = child
+        return child
+
+    @contextmanager
+    def measure(self, operation: str):
+        """
+        Observe the duration of the operation in the with block, and count it as an error if it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self._child(CACHE_ERRORS, operation).inc()
+            raise
+        finally:
+            self._child(CACHE_OPERATION_SECONDS, operation).observe(time.perf_counter() - start)
+
+    def hits(self, operation: str, count: int = 1):
+        if count:
+            self._child(CACHE_HITS, operation).inc(count)
+
+    def misses(self, operation: str, count: int = 1):
+        if count:
+            self._child(CACHE_MISSES, operation).inc(count)
+
+    def read(self, operation: str, requested: int, values):
+        """
+        Count the hits and misses of a read of `requested` keys, `values` are the serialized values found.
+        """
+        found = 0
+        for value in values:
+            found += 1
+            self.payload(operation, value)
+        self.hits(operation, found)
+        self.misses(operation, requested - found)
+
+    def payload(self, operation: str, value):
+        """
+        Observe the size of a serialized value, in characters for str values.
+        """
+        if value:
+            self._child(CACHE_PAYLOAD_BYTES, operation).observe(len(value))
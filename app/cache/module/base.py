@@ -1,10 +1,29 @@
-import json
+import asyncio
 from abc import abstractmethod, ABC
-from typing import Optional, Any
+from itertools import chain
+from typing import Optional, Any, Union, Dict, Iterable, List
 
 import redis
+import redis.asyncio as aioredis
+from redis.crc import key_slot
 
+from app.cache.metrics import CacheMetrics
 from app.log import logger
+from .codec import CACHE_SERIALIZER, CacheSerializer
+
+
+def group_by_slot(redis_conn, full_keys: Iterable[str]) -> List[List[str]]:
+    """
+    Group keys by cluster hash slot, so every group can be sent as one multi-key command or pipeline.
+    A standalone redis has a single group.
+    """
+    full_keys = list(dict.fromkeys(full_keys))
+    if not isinstance(redis_conn, (redis.RedisCluster, aioredis.RedisCluster)):
+        return [full_keys] if full_keys else []
+    groups: Dict[int, List[str]] = {}
+    for full_key in full_keys:
+        groups.setdefault(key_slot(full_key.encode()), []).append(full_key)
+    return list(groups.values())
 
 
 class BaseRedisCache(ABC):
@@ -36,6 +55,21 @@ class BaseRedisCache(ABC):
         """
         raise NotImplementedError()
 
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Getting keys from Redis, only the keys found are returned"""
+        values = {key: self.get(key) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def set_many(self, mapping: Dict[str, Any]):
+        """Setting keys to Redis"""
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete_many(self, keys: Iterable[str]):
+        """Deleting keys from Redis"""
+        for key in keys:
+            self.delete(key)
+
 
 class BaseAsyncRedisCache(ABC):
 
@@ -66,42 +100,79 @@ class BaseAsyncRedisCache(ABC):
         """
         raise NotImplementedError()
 
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Getting keys from Redis, only the keys found are returned"""
+        keys = list(keys)
+        values = await asyncio.gather(*(self.get(key) for key in keys))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def set_many(self, mapping: Dict[str, Any]):
+        """Setting keys to Redis"""
+        await asyncio.gather(*(self.set(key, value) for key, value in mapping.items()))
+
+    async def delete_many(self, keys: Iterable[str]):
+        """Deleting keys from Redis"""
+        await asyncio.gather(*(self.delete(key) for key in keys))
+
 
 class RedisCache(BaseRedisCache):
-    def __init__(self, redis_conn: redis.Redis, prefix: str = "", expiration: int = 60 * 60 * 12):
+    def __init__(self, redis_conn: redis.Redis, prefix: str = "", expiration: int = 60 * 60 * 12,
+                 serializer: CacheSerializer = None, hash_tag: bool = False):
         """
         Initialize the cache with a Redis connection, an optional key prefix, and a default expiration time.
 
         :param redis_conn: The Redis connection instance.
         :param prefix: Optional prefix to prepend to all keys.
         :param expiration: Default expiration time in seconds.
+        :param serializer: Optional serializer of the values, CACHE_SERIALIZER by default.
+        :param hash_tag: Wrap the prefix in a hash tag, so all keys of the cache are in one cluster slot.
         """
         self.redis = redis_conn
         self.prefix = prefix
         self.expiration = expiration
+        self.serializer = serializer or CACHE_SERIALIZER
+        self.hash_tag = hash_tag
+        self.metrics = CacheMetrics(prefix)
+
+    def _full_key(self, key: str) -> str:
+        if self.hash_tag and self.prefix:
+            return f"{{{self.prefix}}}{key}"
+        return f"{self.prefix}{key}"
+
+    def _serialize(self, value: Any) -> Union[str, bytes]:
+        return self.serializer.dumps(value)
+
+    def _deserialize(self, value) -> Optional[Any]:
+        return self.serializer.loads(value) if value else None
 
     def set(self, key: str, value: Any):
         """
-        Save a value to Redis, automatically serializing to JSON.
+        Save a value to Redis, automatically serialized by the cache serializer.
 
         :param key: The key under which to store the value.
         :param value: The value to store.
         """
-        full_key = f"{self.prefix}{key}"
+        full_key = self._full_key(key)
         logger.debug(f"Saving key {full_key}")
-        self.redis.set(full_key, json.dumps(value), self.expiration)
+        with self.metrics.measure("set"):
+            serialized = self._serialize(value)
+            self.redis.set(full_key, serialized, self.expiration)
+        self.metrics.payload("set", serialized)
 
     def get(self, key: str) -> Optional[Any]:
         """
-        Retrieve a value from Redis by key, automatically deserializing from JSON.
+        Retrieve a value from Redis by key, automatically deserialized by the cache serializer.
 
         :param key: The key of the value to retrieve.
         :return: The deserialized value if key exists, otherwise None.
         """
-        full_key = f"{self.prefix}{key}"
+        full_key = self._full_key(key)
         logger.debug(f"Getting key {full_key}")
-        value = self.redis.get(full_key)
-        return json.loads(value) if value else None
+        with self.metrics.measure("get"):
+            value = self.redis.get(full_key)
+            result = self._deserialize(value)
+        self.metrics.read("get", 1, [value] if value else [])
+        return result
 
     def delete(self, key: str):
         """
@@ -109,45 +180,125 @@ class RedisCache(BaseRedisCache):
 
         :param key: The key of the value to delete.
         """
-        full_key = f"{self.prefix}{key}"
-        self.redis.delete(full_key)
+        full_key = self._full_key(key)
+        with self.metrics.measure("delete"):
+            self.redis.delete(full_key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Retrieve the values of many keys with one MGET per cluster slot, all sent in one pipeline
+        (a cluster pipeline sends the commands of every node at once, then reads the replies).
+
+        :param keys: The keys of the values to retrieve.
+        :return: The deserialized values of the keys found.
+        """
+        full_keys = {self._full_key(key): key for key in keys}
+        found = []
+        result = {}
+        with self.metrics.measure("get_many"):
+            groups = group_by_slot(self.redis, full_keys)
+            values = []
+            if groups:
+                with self.redis.pipeline(transaction=False) as pipe:
+                    for group in groups:
+                        pipe.mget(group)
+                    values = pipe.execute()
+            for full_key, value in zip(chain.from_iterable(groups), chain.from_iterable(values)):
+                if value:
+                    found.append(value)
+                    result[full_keys[full_key]] = self._deserialize(value)
+        self.metrics.read("get_many", len(full_keys), found)
+        return result
+
+    def set_many(self, mapping: Dict[str, Any]):
+        """
+        Save many values with one pipeline, of the nodes of all the keys in a cluster.
+
+        :param mapping: The values to store by key.
+        """
+        with self.metrics.measure("set_many"):
+            serialized = {self._full_key(key): self._serialize(value) for key, value in mapping.items()}
+            if serialized:
+                with self.redis.pipeline(transaction=False) as pipe:
+                    for full_key, value in serialized.items():
+                        pipe.set(full_key, value, self.expiration)
+                    pipe.execute()
+        for value in serialized.values():
+            self.metrics.payload("set_many", value)
+
+    def delete_many(self, keys: Iterable[str]):
+        """
+        Delete many keys with one DEL per cluster slot, all sent in one pipeline.
+
+        :param keys: The keys of the values to delete.
+        """
+        with self.metrics.measure("delete_many"):
+            groups = group_by_slot(self.redis, (self._full_key(key) for key in keys))
+            if groups:
+                with self.redis.pipeline(transaction=False) as pipe:
+                    for group in groups:
+                        pipe.delete(*group)
+                    pipe.execute()
 
 
 class AsyncRedisCache(BaseAsyncRedisCache):
-    def __init__(self, redis_conn: redis.Redis, prefix: str = "", expiration: int = 60 * 60 * 12):
+    def __init__(self, redis_conn: redis.Redis, prefix: str = "", expiration: int = 60 * 60 * 12,
+                 serializer: CacheSerializer = None, hash_tag: bool = False):
         """
         Initialize the cache with a Redis connection, an optional key prefix, and a default expiration time.
 
         :param redis_conn: The Redis connection instance.
         :param prefix: Optional prefix to prepend to all keys.
         :param expiration: Default expiration time in seconds.
+        :param serializer: Optional serializer of the values, CACHE_SERIALIZER by default.
+        :param hash_tag: Wrap the prefix in a hash tag, so all keys of the cache are in one cluster slot.
         """
         self.redis = redis_conn
         self.prefix = prefix
         self.expiration = expiration
+        self.serializer = serializer or CACHE_SERIALIZER
+        self.hash_tag = hash_tag
+        self.metrics = CacheMetrics(prefix)
+
+    def _full_key(self, key: str) -> str:
+        if self.hash_tag and self.prefix:
+            return f"{{{self.prefix}}}{key}"
+        return f"{self.prefix}{key}"
+
+    def _serialize(self, value: Any) -> Union[str, bytes]:
+        return self.serializer.dumps(value)
+
+    def _deserialize(self, value) -> Optional[Any]:
+        return self.serializer.loads(value) if value else None
 
     async def set(self, key: str, value: Any):
         """
-        Save a value to Redis, automatically serializing to JSON.
+        Save a value to Redis, automatically serialized by the cache serializer.
 
         :param key: The key under which to store the value.
         :param value: The value to store.
         """
-        full_key = f"{self.prefix}{key}"
+        full_key = self._full_key(key)
         logger.debug(f"Saving key {full_key}")
-        await self.redis.set(full_key, json.dumps(value), self.expiration)
+        with self.metrics.measure("set"):
+            serialized = self._serialize(value)
+            await self.redis.set(full_key, serialized, self.expiration)
+        self.metrics.payload("set", serialized)
 
     async def get(self, key: str) -> Optional[Any]:
         """
-        Retrieve a value from Redis by key, automatically deserializing from JSON.
+        Retrieve a value from Redis by key, automatically deserialized by the cache serializer.
 
         :param key: The key of the value to retrieve.
         :return: The deserialized value if key exists, otherwise None.
         """
-        full_key = f"{self.prefix}{key}"
+        full_key = self._full_key(key)
         logger.debug(f"Getting key {full_key}")
-        value = await self.redis.get(full_key)
-        return json.loads(value) if value else None
+        with self.metrics.measure("get"):
+            value = await self.redis.get(full_key)
+            result = self._deserialize(value)
+        self.metrics.read("get", 1, [value] if value else [])
+        return result
 
     async def delete(self, key: str):
         """
@@ -155,5 +306,60 @@ class AsyncRedisCache(BaseAsyncRedisCache):
 
         :param key: The key of the value to delete.
         """
-        full_key = f"{self.prefix}{key}"
-        await self.redis.delete(full_key)
+        full_key = self._full_key(key)
+        with self.metrics.measure("delete"):
+            await self.redis.delete(full_key)
+
+    async def _mget(self, full_keys: Iterable[str]) -> Dict[str, Union[str, bytes]]:
+        groups = group_by_slot(self.redis, full_keys)
+        values = await asyncio.gather(*(self.redis.mget(group) for group in groups))
+        return {full_key: value
+                for full_key, value in zip(chain.from_iterable(groups), chain.from_iterable(values)) if value}
+
+    async def _mset(self, serialized: Dict[str, Union[str, bytes]]):
+        async def set_group(group: List[str]):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for full_key in group:
+                    pipe.set(full_key, serialized[full_key], self.expiration)
+                await pipe.execute()
+
+        await asyncio.gather(*(set_group(group) for group in group_by_slot(self.redis, serialized)))
+
+    async def _mdelete(self, full_keys: Iterable[str]):
+        groups = group_by_slot(self.redis, full_keys)
+        await asyncio.gather(*(self.redis.delete(*group) for group in groups))
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Retrieve the values of many keys with one MGET per cluster slot, the slots are fetched concurrently.
+
+        :param keys: The keys of the values to retrieve.
+        :return: The deserialized values of the keys found.
+        """
+        full_keys = {self._full_key(key): key for key in keys}
+        with self.metrics.measure("get_many"):
+            values = await self._mget(full_keys)
+            result = {full_keys[full_key]: self._deserialize(value) for full_key, value in values.items()}
+        self.metrics.read("get_many", len(full_keys), values.values())
+        return result
+
+    async def set_many(self, mapping: Dict[str, Any]):
+        """
+        Save many values with one pipeline per cluster slot, the slots are written concurrently.
+
+        :param mapping: The values to store by key.
+        """
+        with self.metrics.measure("set_many"):
+            serialized = {self._full_key(key): self._serialize(value) for key, value in mapping.items()}
+            await self._mset(serialized)
+        for value in serialized.values():
+            self.metrics.payload("set_many", value)
+
+    async def delete_many(self, keys: Iterable[str]):
+        """
+        Delete many keys with one DEL per cluster slot, the slots are deleted concurrently.
+
+        :param keys: The keys of the values to delete.
+        """
+        with self.metrics.measure("delete_many"):
+            await self._mdelete([self._full_key(key) for key in keys])
@@ -0,0 +1,181 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Union
+
+import lz4.frame
+import msgpack
+import orjson
+import zstd
+
+from app.configs import APP_SETTINGS
+
+# First byte of an encoded value with a header, it never starts a json document,
+# so values written as plain json (without header) are still readable.
+HEADER_MAGIC = 0x00
+HEADER_SIZE = 2
+
+
+class Codec(ABC):
+    id: int
+    name: str
+
+    @abstractmethod
+    def encode(self, value: Any) -> bytes:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError()
+
+
+class JSONCodec(Codec):
+    id = 1
+    name = "json"
+
+    def encode(self, value: Any) -> bytes:
+        return json.dumps(value).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class ORJSONCodec(Codec):
+    id = 2
+    name = "orjson"
+
+    def encode(self, value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    def decode(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    id = 3
+    name = "msgpack"
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+class Compressor(ABC):
+    id: int
+    name: str
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+
+class ZstdCompressor(Compressor):
+    id = 1
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zstd.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zstd.decompress(data)
+
+
+class LZ4Compressor(Compressor):
+    id = 2
+    name = "lz4"
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4.frame.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.frame.decompress(data)
+
+
+CODECS: Dict[str, Codec] = {codec.name: codec for codec in (JSONCodec(), ORJSONCodec(), MsgpackCodec())}
+COMPRESSORS: Dict[str, Compressor] = {compressor.name: compressor
+                                      for compressor in (ZstdCompressor(), LZ4Compressor())}
+_CODECS_BY_ID: Dict[int, Codec] = {codec.id: codec for codec in CODECS.values()}
+_COMPRESSORS_BY_ID: Dict[int, Compressor] = {compressor.id: compressor for compressor in COMPRESSORS.values()}
+
+
+class CacheSerializer:
+    """
+    Serialize cache values with a pluggable codec, compressing the ones larger than `compression_threshold` bytes.
+
+    Encoded values start with a 2 bytes header: HEADER_MAGIC, then the codec id (high 4 bits)
+    and the compressor id (low 4 bits, 0 for none).
+    Values without the header are plain json, as written by the previous versions. The default
+    json codec without compression still writes plain json, so workers running the previous version
+    can read the values during a rolling deploy, switch the codec once every worker runs this version.
+    Values with the header are binary, the redis client must not decode responses.
+    """
+
+    def __init__(self, codec: str = "json", compression: Optional[str] = None, compression_threshold: int = 1024):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown cache codec {codec}, expected one of {list(CODECS)}")
+        if compression and compression not in COMPRESSORS:
+            raise ValueError(f"Unknown cache compression {compression}, expected one of {list(COMPRESSORS)}")
+        self.codec = CODECS[codec]
+        self.compressor = COMPRESSORS[compression] if compression else None
+        self.compression_threshold = compression_threshold
+
+    @property
+    def plain_json(self) -> bool:
+        return self.codec.name == "json" and self.compressor is None
+
+    def dumps(self, value: Any) -> Union[str, bytes]:
+        if self.plain_json:
+            return json.dumps(value)
+
+        data = self.codec.encode(value)
+        compressor_id = 0
+        if self.compressor is not None and len(data) > self.compression_threshold:
+            data = self.compressor.compress(data)
+            compressor_id = self.compressor.id
+        return bytes((HEADER_MAGIC, self.codec.id << 4 | compressor_id)) + data
+
+    @staticmethod
+    def loads(data: Union[str, bytes]) -> Any:
+        """
+        Decode a value written by any codec, the codec and compressor are read from the header.
+        """
+        if isinstance(data, str) or data[0] != HEADER_MAGIC:
+            return json.loads(data)
+
+        flags = data[1]
+        codec = _CODECS_BY_ID[flags >> 4]
+        payload = data[HEADER_SIZE:]
+        compressor_id = flags & 0x0F
+        if compressor_id:
+            payload = _COMPRESSORS_BY_ID[compressor_id].decompress(payload)
+        return codec.decode(payload)
+
+
+CACHE_SERIALIZER = CacheSerializer(codec=APP_SETTINGS.CACHE_CODEC,
+                                   compression=APP_SETTINGS.CACHE_COMPRESSION,
+                                   compression_threshold=APP_SETTINGS.CACHE_COMPRESSION_THRESHOLD)
+
+
+class RawSerializer:
+    """
+    Store the values as they are, for callers writing bytes of their own format (e.g. encrypted).
+    """
+
+    @staticmethod
+    def dumps(value: Union[str, bytes]) -> Union[str, bytes]:
+        return value
+
+    @staticmethod
+    def loads(data: Union[str, bytes]) -> Union[str, bytes]:
+        return data
+
+
+RAW_SERIALIZER = RawSerializer()
@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from app.cache.metrics import MEMORY_CACHE_BYTES, MEMORY_CACHE_EVICTIONS, CacheMetrics
+from app.configs import APP_SETTINGS
+from app.log import logger
+
+from .base import BaseAsyncRedisCache, BaseRedisCache
+from .codec import CACHE_SERIALIZER, CacheSerializer
+
+
+class MemoryStore:
+    """
+    In-process key value store of the memory cache backend, shared by all caches of the process.
+    Every entry expires after its ttl, the least recently used entries are evicted once the keys
+    and values take more than `max_bytes`.
+    Thread safe, the sync caches are also used from executor threads.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[Union[str, bytes], float]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _entry_size(key: str, value: Union[str, bytes]) -> int:
+        return len(key) + len(value)
+
+    def _pop(self, key: str):
+        value, _ = self._data.pop(key)
+        self._size -= self._entry_size(key, value)
+
+    def get(self, key: str) -> Optional[Union[str, bytes]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._pop(key)
+                MEMORY_CACHE_BYTES.set(self._size)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Union[str, bytes], ex: float):
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            logger.warning(f"Not caching {key} in memory, {size} bytes is more than the max size")
+            self.delete(key)
+            return
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, time.monotonic() + ex)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._pop(next(iter(self._data)))
+                MEMORY_CACHE_EVICTIONS.inc()
+            MEMORY_CACHE_BYTES.set(self._size)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._pop(key)
+            MEMORY_CACHE_BYTES.set(self._size)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+            MEMORY_CACHE_BYTES.set(0)
+
+
+MEMORY_STORE = MemoryStore(APP_SETTINGS.CACHE_MEMORY_MAX_BYTES)
+
+
+class MemoryCache(BaseRedisCache):
+    """
+    RedisCache of the memory backend (CACHE_BACKEND=memory), for single node deployments and tests.
+    Values are serialized like in redis, every get returns a new object.
+    """
+
+    def __init__(self, store: MemoryStore = None, prefix: str = "", expiration: int = 60 * 60 * 12,
+                 serializer: CacheSerializer = None):
+        self.store = store or MEMORY_STORE
+        self.prefix = prefix
+        self.expiration = expiration
+        self.serializer = serializer or CACHE_SERIALIZER
+        self.metrics = CacheMetrics(prefix)
+
+    def _full_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _deserialize(self, value) -> Optional[Any]:
+        return self.serializer.loads(value) if value else None
+
+    def _set(self, operation: str, key: str, value: Any):
+        serialized = self.serializer.dumps(value)
+        self.store.set(self._full_key(key), serialized, self.expiration)
+        self.metrics.payload(operation, serialized)
+
+    def _get_many(self, operation: str, keys: Iterable[str]) -> Dict[str, Any]:
+        values = {key: self.store.get(self._full_key(key)) for key in keys}
+        found = {key: value for key, value in values.items() if value}
+        self.metrics.read(operation, len(values), found.values())
+        return {key: self._deserialize(value) for key, value in found.items()}
+
+    def set(self, key: str, value: Any):
+        with self.metrics.measure("set"):
+            self._set("set", key, value)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.metrics.measure("get"):
+            return self._get_many("get", [key]).get(key)
+
+    def delete(self, key: str):
+        with self.metrics.measure("delete"):
+            self.store.delete(self._full_key(key))
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        with self.metrics.measure("get_many"):
+            return self._get_many("get_many", keys)
+
+    def set_many(self, mapping: Dict[str, Any]):
+        with self.metrics.measure("set_many"):
+            for key, value in mapping.items():
+                self._set("set_many", key, value)
+
+    def delete_many(self, keys: Iterable[str]):
+        with self.metrics.measure("delete_many"):
+            self.store.delete(*(self._full_key(key) for key in keys))
+
+
+class AsyncMemoryCache(BaseAsyncRedisCache):
+    """
+    AsyncRedisCache of the memory backend (CACHE_BACKEND=memory), on top of a sync MemoryCache,
+    the store is in process so no operation ever waits.
+    """
+
+    def __init__(self, store: MemoryStore = None, prefix: str = "", expiration: int = 60 * 60 * 12,
+                 serializer: CacheSerializer = None):
+        self.cache = MemoryCache(store, prefix, expiration, serializer)
+        self.prefix = prefix
+        self.expiration = expiration
+        self.metrics = self.cache.metrics
+
+    async def set(self, key: str, value: Any):
+        self.cache.set(key, value)
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self.cache.get(key)
+
+    async def delete(self, key: str):
+        self.cache.delete(key)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        return self.cache.get_many(keys)
+
+    async def set_many(self, mapping: Dict[str, Any]):
+        self.cache.set_many(mapping)
+
+    async def delete_many(self, keys: Iterable[str]):
+        self.cache.delete_many(keys)
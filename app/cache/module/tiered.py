@@ -0,0 +1,306 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import redis
+import redis.asyncio as aioredis
+from cachetools import TLRUCache
+
+from app.cache.circuit_breaker import FAILURES
+from app.cache.metrics import TIERED_CACHE_EVICTIONS, TIERED_CACHE_HITS, TIERED_CACHE_MISSES
+from app.log import logger
+
+from .base import AsyncRedisCache
+from .codec import CacheSerializer
+
+
+class LocalCache(TLRUCache):
+    """
+    Bounded in-process LRU cache with a ttl for each entry,
+    counting the evictions of its cache prefix.
+    """
+
+    def __init__(self, prefix: str, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttu=lambda key, value, now: now + ttl,
+                         timer=time.monotonic)
+        self._evictions = TIERED_CACHE_EVICTIONS.labels(prefix=prefix)
+
+    def popitem(self):
+        item = super().popitem()
+        self._evictions.inc()
+        return item
+
+
+class TieredAsyncRedisCache(AsyncRedisCache):
+    """
+    AsyncRedisCache with an in-process tier (l1) in front of redis (l2).
+    Reads are served from l1 while the entry is younger than `local_ttl`, writes go to both tiers
+    and are broadcast by the CacheInvalidationBus, so the other workers drop their l1 copy.
+    l1 keeps the serialized value, every get returns a new object which callers are free to mutate.
+
+    With `stale_ttl`, l1 entries are kept that many seconds longer and served when redis is
+    unavailable (e.g. its circuit breaker is open), only use it for values which are fine to be
+    stale for that long.
+    """
+
+    def __init__(self,
+                 redis_conn: Union[aioredis.Redis, aioredis.RedisCluster],
+                 prefix: str = "",
+                 expiration: int = 60 * 60 * 12,
+                 local_maxsize: int = 1024,
+                 local_ttl: int = 30,
+                 invalidation_bus: "CacheInvalidationBus" = None,
+                 serializer: CacheSerializer = None,
+                 hash_tag: bool = False,
+                 stale_ttl: int = 0):
+        super().__init__(redis_conn, prefix, expiration, serializer, hash_tag)
+        self.local_ttl = min(local_ttl, expiration)
+        self.stale_ttl = stale_ttl
+        # entries are (serialized, fresh until)
+        self.local = LocalCache(prefix, maxsize=local_maxsize, ttl=self.local_ttl + stale_ttl)
+        self.invalidation_bus = invalidation_bus
+        if invalidation_bus is not None:
+            invalidation_bus.register(self)
+        self._l1_hits = TIERED_CACHE_HITS.labels(prefix=prefix, tier="l1")
+        self._l2_hits = TIERED_CACHE_HITS.labels(prefix=prefix, tier="l2")
+        self._stale_hits = TIERED_CACHE_HITS.labels(prefix=prefix, tier="stale")
+        self._misses = TIERED_CACHE_MISSES.labels(prefix=prefix)
+
+    def _set_local(self, full_key: str, serialized: Union[str, bytes]):
+        self.local[full_key] = (serialized, time.monotonic() + self.local_ttl)
+
+    def _get_local(self, full_key: str, stale: bool = False) -> Optional[Union[str, bytes]]:
+        entry = self.local.get(full_key)
+        if entry is None:
+            return None
+        serialized, fresh_until = entry
+        if stale or time.monotonic() < fresh_until:
+            return serialized
+        return None
+
+    async def set(self, key: str, value: Any):
+        full_key = self._full_key(key)
+        logger.debug(f"Saving key {full_key}")
+        with self.metrics.measure("set"):
+            serialized = self._serialize(value)
+            await self.redis.set(full_key, serialized, self.expiration)
+            self._set_local(full_key, serialized)
+            await self._publish_invalidation(full_key)
+        self.metrics.payload("set", serialized)
+
+    async def get(self, key: str) -> Optional[Any]:
+        full_key = self._full_key(key)
+        with self.metrics.measure("get"):
+            serialized = await self._get(full_key)
+            result = self._deserialize(serialized)
+        self.metrics.read("get", 1, [serialized] if serialized else [])
+        return result
+
+    async def _get(self, full_key: str) -> Optional[Union[str, bytes]]:
+        serialized = self._get_local(full_key)
+        if serialized is not None:
+            self._l1_hits.inc()
+            return serialized
+
+        logger.debug(f"Getting key {full_key}")
+        try:
+            serialized = await self.redis.get(full_key)
+        except FAILURES:
+            serialized = self._get_local(full_key, stale=True) if self.stale_ttl else None
+            if serialized is None:
+                raise
+            self._stale_hits.inc()
+            return serialized
+        if not serialized:
+            self._misses.inc()
+            return None
+        self._l2_hits.inc()
+        self._set_local(full_key, serialized)
+        return serialized
+
+    async def delete(self, key: str):
+        full_key = self._full_key(key)
+        with self.metrics.measure("delete"):
+            self.local.pop(full_key, None)
+            await self.redis.delete(full_key)
+            await self._publish_invalidation(full_key)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        full_keys = {self._full_key(key): key for key in keys}
+        with self.metrics.measure("get_many"):
+            found = await self._get_many(list(full_keys))
+            result = {full_keys[full_key]: self._deserialize(serialized)
+                      for full_key, serialized in found.items()}
+        self.metrics.read("get_many", len(full_keys), found.values())
+        return result
+
+    async def _get_many(self, full_keys: List[str]) -> Dict[str, Union[str, bytes]]:
+        found = {}
+        for full_key in full_keys:
+            serialized = self._get_local(full_key)
+            if serialized is not None:
+                found[full_key] = serialized
+        self._l1_hits.inc(len(found))
+
+        missing = [full_key for full_key in full_keys if full_key not in found]
+        if missing:
+            try:
+                fetched = await self._mget(missing)
+            except FAILURES:
+                stale = {full_key: self._get_local(full_key, stale=True) for full_key in missing} \
+                    if self.stale_ttl else {}
+                if not stale or None in stale.values():
+                    raise
+                self._stale_hits.inc(len(stale))
+                fetched = stale
+            else:
+                self._l2_hits.inc(len(fetched))
+                self._misses.inc(len(missing) - len(fetched))
+                for full_key, serialized in fetched.items():
+                    self._set_local(full_key, serialized)
+            found.update(fetched)
+        return found
+
+    async def set_many(self, mapping: Dict[str, Any]):
+        with self.metrics.measure("set_many"):
+            serialized = {self._full_key(key): self._serialize(value)
+                          for key, value in mapping.items()}
+            await self._mset(serialized)
+            for full_key, value in serialized.items():
+                self._set_local(full_key, value)
+            await asyncio.gather(*(self._publish_invalidation(full_key) for full_key in serialized))
+        for value in serialized.values():
+            self.metrics.payload("set_many", value)
+
+    async def delete_many(self, keys: Iterable[str]):
+        full_keys = [self._full_key(key) for key in keys]
+        with self.metrics.measure("delete_many"):
+            for full_key in full_keys:
+                self.local.pop(full_key, None)
+            await self._mdelete(full_keys)
+            await asyncio.gather(*(self._publish_invalidation(full_key) for full_key in full_keys))
+
+    def invalidate_local(self, full_key: Optional[str] = None):
+        """
+        Drop the l1 copy of a key, or of all keys if full_key is None.
+        """
+        if full_key is None:
+            self.local.clear()
+        else:
+            self.local.pop(full_key, None)
+
+    async def _publish_invalidation(self, full_key: str):
+        if self.invalidation_bus is not None:
+            await self.invalidation_bus.publish(self.prefix, full_key)
+
+
+class CacheInvalidationBus:
+    """
+    Broadcast l1 invalidations of TieredAsyncRedisCache to all workers and pods through redis
+    pub/sub.
+    One bus per process, started in lifespan. Messages published by this process are ignored.
+    After a reconnect all l1 tiers are cleared, since invalidations may have been missed meanwhile.
+    """
+
+    def __init__(self, redis_conn: Union[aioredis.Redis, aioredis.RedisCluster],
+                 channel: str = "cache_invalidation"):
+        self.redis = redis_conn
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._caches: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    def register(self, cache: Any):
+        """
+        Register a cache with a `prefix` and an `invalidate_local(full_key=None)` method,
+        e.g. TieredAsyncRedisCache or the VerifiedTokenCache of the auth middleware.
+        """
+        self._caches[cache.prefix] = cache
+
+    async def publish(self, prefix: str, full_key: str):
+        message = json.dumps({"origin": self.origin, "prefix": prefix, "key": full_key})
+        try:
+            await self.redis.publish(self.channel, message)
+        except redis.RedisError as e:
+            logger.error(f"Failed to publish cache invalidation of {full_key}: {e}")
+
+    def _handle(self, data: Union[bytes, str]):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            logger.error(f"Invalid cache invalidation message: {data}")
+            return
+        if message.get("origin") == self.origin:
+            return
+        cache = self._caches.get(message.get("prefix"))
+        if cache is not None:
+            cache.invalidate_local(message.get("key"))
+
+    async def _subscriber_client(self, reconnect: bool) -> aioredis.Redis:
+        if isinstance(self.redis, aioredis.RedisCluster):
+            # the async cluster client has no pub/sub, PUBLISH is broadcast to every node of the
+            # cluster, so subscribing on one node is enough
+            if reconnect:
+                # the node may have failed over, subscribe on a primary of the current topology
+                await self.redis.nodes_manager.initialize()
+            node = self.redis.get_default_node()
+            kwargs = dict(node.connection_kwargs)  # address and ssl of the node
+            # the credentials of the shared client, e.g. the IAM auth token provider
+            credential_provider = self.redis.get_connection_kwargs().get("credential_provider")
+            kwargs["credential_provider"] = credential_provider
+            pool = aioredis.ConnectionPool(connection_class=node.connection_class, **kwargs)
+            # a plain client, a long-lived subscription is not a call for the circuit breaker
+            return aioredis.Redis(connection_pool=pool)
+        return self.redis
+
+    async def _listen(self):
+        reconnect = False
+        while True:
+            client = pubsub = None
+            try:
+                client = await self._subscriber_client(reconnect)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                if reconnect:
+                    for cache in self._caches.values():
+                        cache.invalidate_local()
+                self._subscribed.set()
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None and message["type"] == "message":
+                        self._handle(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation subscriber disconnected: {e}")
+                self._subscribed.clear()
+                reconnect = True
+            finally:
+                if pubsub is not None:
+                    await pubsub.aclose()
+                if client is not None and client is not self.redis:
+                    await client.aclose()
+            await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def wait_subscribed(self, timeout: float = 5) -> bool:
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
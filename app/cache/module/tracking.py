@@ -0,0 +1,296 @@
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import redis
+import redis.asyncio as aioredis
+
+from app.cache.metrics import TIERED_CACHE_HITS, TIERED_CACHE_MISSES
+from app.log import logger
+
+from .base import AsyncRedisCache
+from .codec import CacheSerializer
+from .tiered import LocalCache
+
+# redis-py has no public api for the RESP3 push messages of a connection, client tracking uses the
+# parser of the connection, only the versions it was tested with are allowed
+SUPPORTED_REDIS_VERSIONS = [(5, 0)]
+
+
+def _resp3_parser_class() -> type:
+    """
+    The async RESP3 parser of redis-py,
+    raise RuntimeError at startup if its private api is not supported.
+    """
+    version = tuple(int(part) for part in redis.__version__.split(".")[:2] if part.isdigit())
+    try:
+        from redis._parsers import _AsyncRESP3Parser
+    except ImportError:
+        _AsyncRESP3Parser = None
+    if (version not in SUPPORTED_REDIS_VERSIONS or _AsyncRESP3Parser is None
+            or not hasattr(_AsyncRESP3Parser, "set_push_handler")):
+        supported = ", ".join(f"{major}.{minor}.x" for major, minor in SUPPORTED_REDIS_VERSIONS)
+        raise RuntimeError(f"Redis client tracking relies on the private RESP3 parser of redis-py "
+                           f"{supported}, redis-py {redis.__version__} is installed: set "
+                           f"CACHE_CLIENT_TRACKING_ENABLED=false or check ClientTracking with it")
+    return _AsyncRESP3Parser
+
+
+def _set_push_handler(connection: aioredis.Connection, handler):
+    # the parser is created by connect(), an instance of _resp3_parser_class()
+    connection._parser.set_push_handler(handler)
+
+
+class TrackedAsyncRedisCache(AsyncRedisCache):
+    """
+    AsyncRedisCache keeping a local copy of the values, invalidated by redis itself
+    (client side caching). The keys of the cache are tracked by ClientTracking, redis pushes an
+    invalidation as soon as one of them is changed, expired or evicted, so the local copy has no
+    staleness window like the ttl of the tiered l1.
+    While tracking is not active (not started yet, reconnecting) every read goes to redis.
+    Meant for read-mostly keys, every write to the prefix drops the local copy in every process.
+    """
+
+    def __init__(self,
+                 redis_conn: Union[aioredis.Redis, aioredis.RedisCluster],
+                 tracking: "ClientTracking",
+                 prefix: str = "",
+                 expiration: int = 60 * 60 * 12,
+                 local_maxsize: int = 1024,
+                 serializer: CacheSerializer = None,
+                 hash_tag: bool = False):
+        super().__init__(redis_conn, prefix, expiration, serializer, hash_tag)
+        self.tracking = tracking
+        self.key_prefix = self._full_key("")
+        self.local = LocalCache(prefix, maxsize=local_maxsize, ttl=expiration)
+        # bumped on every invalidation, a value read from redis meanwhile may be stale, not kept
+        self._epoch = 0
+        self.tracking_version = 0
+        tracking.register(self)
+        self._local_hits = TIERED_CACHE_HITS.labels(prefix=prefix, tier="tracked")
+        self._redis_hits = TIERED_CACHE_HITS.labels(prefix=prefix, tier="l2")
+        self._misses = TIERED_CACHE_MISSES.labels(prefix=prefix)
+
+    async def set(self, key: str, value: Any):
+        full_key = self._full_key(key)
+        await super().set(key, value)
+        self.local.pop(full_key, None)
+
+    async def get(self, key: str) -> Optional[Any]:
+        full_key = self._full_key(key)
+        with self.metrics.measure("get"):
+            serialized = await self._get(full_key)
+            result = self._deserialize(serialized)
+        self.metrics.read("get", 1, [serialized] if serialized else [])
+        return result
+
+    async def _get(self, full_key: str) -> Optional[Union[str, bytes]]:
+        if self.tracking.tracks(self):
+            serialized = self.local.get(full_key)
+            if serialized is not None:
+                self._local_hits.inc()
+                return serialized
+
+        epoch = self._epoch
+        logger.debug(f"Getting key {full_key}")
+        serialized = await self.redis.get(full_key)
+        if not serialized:
+            self._misses.inc()
+            return None
+        self._redis_hits.inc()
+        self._keep(full_key, serialized, epoch)
+        return serialized
+
+    async def delete(self, key: str):
+        self.local.pop(self._full_key(key), None)
+        await super().delete(key)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        full_keys = {self._full_key(key): key for key in keys}
+        with self.metrics.measure("get_many"):
+            found = await self._get_many(list(full_keys))
+            result = {full_keys[full_key]: self._deserialize(serialized)
+                      for full_key, serialized in found.items()}
+        self.metrics.read("get_many", len(full_keys), found.values())
+        return result
+
+    async def _get_many(self, full_keys: List[str]) -> Dict[str, Union[str, bytes]]:
+        found = {}
+        if self.tracking.tracks(self):
+            for full_key in full_keys:
+                serialized = self.local.get(full_key)
+                if serialized is not None:
+                    found[full_key] = serialized
+            self._local_hits.inc(len(found))
+
+        missing = [full_key for full_key in full_keys if full_key not in found]
+        if missing:
+            epoch = self._epoch
+            fetched = await self._mget(missing)
+            self._redis_hits.inc(len(fetched))
+            self._misses.inc(len(missing) - len(fetched))
+            for full_key, serialized in fetched.items():
+                self._keep(full_key, serialized, epoch)
+            found.update(fetched)
+        return found
+
+    async def set_many(self, mapping: Dict[str, Any]):
+        await super().set_many(mapping)
+        for key in mapping:
+            self.local.pop(self._full_key(key), None)
+
+    async def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        for key in keys:
+            self.local.pop(self._full_key(key), None)
+        await super().delete_many(keys)
+
+    def _keep(self, full_key: str, serialized: Union[str, bytes], epoch: int):
+        if self.tracking.tracks(self) and epoch == self._epoch:
+            self.local[full_key] = serialized
+
+    def invalidate_local(self, full_key: Optional[str] = None):
+        """
+        Drop the local copy of a key, or of all keys if full_key is None.
+        """
+        self._epoch += 1
+        if full_key is None:
+            self.local.clear()
+        else:
+            self.local.pop(full_key, None)
+
+
+class ClientTracking:
+    """
+    Redis client side caching of TrackedAsyncRedisCache, one per process started in lifespan.
+
+    A dedicated RESP3 connection per node (every primary of a cluster) enables
+    `CLIENT TRACKING ON BCAST` for the key prefixes of the registered caches, and receives the
+    invalidation pushes of every change of those keys, whichever client made it. Tracking is only
+    active while all connections are up, the local copies are dropped when a connection is lost,
+    since invalidations may have been missed.
+    """
+
+    def __init__(self, redis_conn: Union[aioredis.Redis, aioredis.RedisCluster],
+                 health_check_interval: float = 30):
+        self.redis = redis_conn
+        self.health_check_interval = health_check_interval
+        self.parser_class = _resp3_parser_class()
+        self._caches: Dict[str, TrackedAsyncRedisCache] = {}
+        # bumped when a cache is registered,
+        # the prefixes tracked by each node connection are of this version
+        self._version = 0
+        self._tracking: Dict[str, Optional[int]] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def tracks(self, cache: TrackedAsyncRedisCache) -> bool:
+        """
+        Whether the keys of the cache are tracked by every node connection.
+        """
+        return bool(self._tracking) and all(
+            version is not None and version >= cache.tracking_version
+            for version in self._tracking.values())
+
+    def register(self, cache: TrackedAsyncRedisCache):
+        self._caches[cache.key_prefix] = cache
+        self._version += 1
+        cache.tracking_version = self._version
+
+    def _invalidate(self, full_key: Optional[str] = None):
+        if full_key is None:
+            for cache in self._caches.values():
+                cache.invalidate_local()
+            return
+        for key_prefix, cache in self._caches.items():
+            if full_key.startswith(key_prefix):
+                cache.invalidate_local(full_key)
+
+    def _handle_push(self, response: list):
+        if not response or response[0] not in (b"invalidate", "invalidate"):
+            return response
+        keys = response[1]
+        if keys is None:  # FLUSHDB / FLUSHALL
+            self._invalidate()
+        else:
+            for key in keys:
+                self._invalidate(key.decode() if isinstance(key, bytes) else key)
+        return response
+
+    def _node_connections(self) -> Dict[str, aioredis.Connection]:
+        if isinstance(self.redis, aioredis.RedisCluster):
+            nodes = {node.name: (node.connection_class, node.connection_kwargs)
+                     for node in self.redis.get_primaries()}
+        else:
+            pool = self.redis.connection_pool
+            kwargs = pool.connection_kwargs
+            nodes = {f'{kwargs.get("host")}:{kwargs.get("port")}': (pool.connection_class, kwargs)}
+        resp3 = {"protocol": 3, "parser_class": self.parser_class}
+        return {name: connection_class(**{**kwargs, **resp3})
+                for name, (connection_class, kwargs) in nodes.items()}
+
+    async def _enable(self, connection: aioredis.Connection, prefixes: List[str]):
+        await connection.send_command("CLIENT", "TRACKING", "OFF")
+        await connection.read_response()
+        args = []
+        for prefix in prefixes:
+            args += ["PREFIX", prefix]
+        await connection.send_command("CLIENT", "TRACKING", "ON", "BCAST", *args)
+        await connection.read_response()
+
+    async def _track(self, name: str, connection: aioredis.Connection):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await connection.connect()
+                _set_push_handler(connection, self._handle_push)
+                next_ping = loop.time() + self.health_check_interval
+                while True:
+                    version = self._version
+                    if self._caches and self._tracking[name] != version:
+                        await self._enable(connection, sorted(self._caches))
+                        # values kept before the prefixes were tracked may have missed invalidations
+                        self._invalidate()
+                        self._tracking[name] = version
+
+                    response = await connection.read_response(timeout=1.0, push_request=True)
+                    if response is None and loop.time() >= next_ping:
+                        await connection.send_command("PING")
+                        await connection.read_response()
+                        next_ping = loop.time() + self.health_check_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis client tracking of {name} disconnected: {e}")
+                if self._tracking[name] is not None:
+                    self._tracking[name] = None
+                    self._invalidate()
+                await connection.disconnect(nowait=True)
+            await asyncio.sleep(1)
+
+    def start(self):
+        if not self._tasks:
+            for name, connection in self._node_connections().items():
+                self._tracking[name] = None
+                self._tasks.append(asyncio.create_task(self._track(name, connection)))
+
+    async def wait_active(self, timeout: float = 5) -> bool:
+        """
+        Wait until the prefixes of all registered caches are tracked by every node.
+        """
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not self._tracking or any(version != self._version
+                                        for version in self._tracking.values()):
+            if asyncio.get_running_loop().time() >= deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._tracking = {}
@@ -1,25 +1,46 @@
-from typing import Tuple, Union
-from urllib.parse import (ParseResult, urlencode, urlunparse)
+import functools
+import threading
+import time
+from typing import Optional, Tuple, Union
+from urllib.parse import ParseResult, urlencode, urlunparse
 
 import botocore.session
 import redis
 import redis.asyncio as aioredis
 from botocore.model import ServiceId
 from botocore.signers import RequestSigner
-from cachetools import TTLCache, cached
+from fastapi import Request
 
 from app.configs import APP_SETTINGS
 from app.log import logging
 
+from .circuit_breaker import (
+    AsyncBlockingConnectionPool,
+    AsyncCircuitBreakerRedis,
+    AsyncCircuitBreakerRedisCluster,
+    BlockingConnectionPool,
+    CircuitBreakerRedis,
+    CircuitBreakerRedisCluster,
+    create_circuit_breaker,
+)
+
 log = logging.getLogger(__name__)
 
 
 class ElastiCacheIAMProvider(redis.CredentialProvider):
+    """
+    Credential provider of ElastiCache IAM authentication, shared by all redis clients of the process
+    (see get_iam_credential_provider).
+    The IAM auth token expires after 15 minutes, it is presigned again by a background thread every
+    `refresh_interval` seconds, so get_credentials() returns the cached token without blocking.
+    """
+    TOKEN_EXPIRES_IN = 900
 
-    def __init__(self, user: str, cluster_name: str, region: str = "us-west-2"):
+    def __init__(self, user: str, cluster_name: str, region: str = "us-west-2", refresh_interval: int = 600):
         self.user = user
         self.cluster_name = cluster_name
         self.region = region
+        self.refresh_interval = refresh_interval
 
         session = botocore.session.get_session()
         self.request_signer = RequestSigner(
@@ -30,10 +51,13 @@ class ElastiCacheIAMProvider(redis.CredentialProvider):
             session.get_credentials(),
             session.get_component("event_emitter"),
         )
+        self._credentials = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refresher = None
 
-    @cached(cache=TTLCache(maxsize=APP_SETTINGS.REDIS_IAM_TOKEN_MAX_SIZE,
-                           ttl=APP_SETTINGS.REDIS_IAM_TOKEN_TTL))
-    def get_credentials(self) -> Union[Tuple[str], Tuple[str, str]]:
+    def _presign(self) -> Tuple[str, str]:
         query_params = {"Action": "connect", "User": self.user}
         url = urlunparse(
             ParseResult(
@@ -53,58 +77,151 @@ class ElastiCacheIAMProvider(redis.CredentialProvider):
                 "context": {}
             },
             operation_name="connect",
-            expires_in=900,
+            expires_in=self.TOKEN_EXPIRES_IN,
             region_name=self.region,
         )
 
         return (self.user, signed_url.removeprefix("https://"))
 
+    def refresh(self):
+        credentials = self._presign()
+        with self._lock:
+            self._credentials = credentials
+            self._expires_at = time.monotonic() + self.TOKEN_EXPIRES_IN
+
+    def _refresh_periodically(self):
+        interval = self.refresh_interval
+        while not self._stopped.wait(interval):
+            try:
+                self.refresh()
+                interval = self.refresh_interval
+            except Exception as e:
+                log.error(f"Failed to refresh ElastiCache IAM auth token: {e}")
+                interval = min(self.refresh_interval, 30)  # retry sooner, the current token is still valid
+
+    def start(self):
+        """
+        Presign the first token and start the background refresh.
+        """
+        self.refresh()
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_periodically,
+                                               name="elasticache-iam-refresher",
+                                               daemon=True)
+            self._refresher.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def get_credentials(self) -> Union[Tuple[str], Tuple[str, str]]:
+        with self._lock:
+            credentials, expires_at = self._credentials, self._expires_at
+        if credentials is None or time.monotonic() >= expires_at:
+            # only if the background refresh has not run or kept failing
+            self.refresh()
+            credentials = self._credentials
+        return credentials
+
+
+_IAM_CREDENTIAL_PROVIDER: Optional[ElastiCacheIAMProvider] = None
+_IAM_CREDENTIAL_PROVIDER_LOCK = threading.Lock()
+
+
+def get_iam_credential_provider() -> ElastiCacheIAMProvider:
+    """
+    Get the process wide ElastiCacheIAMProvider, created and started on first use.
+    """
+    global _IAM_CREDENTIAL_PROVIDER
+    with _IAM_CREDENTIAL_PROVIDER_LOCK:
+        if _IAM_CREDENTIAL_PROVIDER is None:
+            provider = ElastiCacheIAMProvider(user=APP_SETTINGS.REDIS_USERNAME,
+                                              cluster_name=APP_SETTINGS.REDIS_CLUSTER_NAME,
+                                              refresh_interval=APP_SETTINGS.REDIS_IAM_TOKEN_REFRESH_INTERVAL)
+            provider.start()
+            _IAM_CREDENTIAL_PROVIDER = provider
+        return _IAM_CREDENTIAL_PROVIDER
+
+
+def stop_iam_credential_provider():
+    global _IAM_CREDENTIAL_PROVIDER
+    with _IAM_CREDENTIAL_PROVIDER_LOCK:
+        if _IAM_CREDENTIAL_PROVIDER is not None:
+            _IAM_CREDENTIAL_PROVIDER.stop()
+            _IAM_CREDENTIAL_PROVIDER = None
+
+
+def _with_circuit_breaker(redis_conn, name: str):
+    if APP_SETTINGS.REDIS_CIRCUIT_BREAKER_ENABLED:
+        redis_conn.circuit_breaker = create_circuit_breaker(name)
+    return redis_conn
+
+
+async def create_async_redis_connection() -> Union[aioredis.Redis, aioredis.RedisCluster]:
+    """
+    Create the process wide async redis client, called once in lifespan.
+    """
+    if APP_SETTINGS.ENV == 'local':
+        # a burst over max_connections waits for a free connection instead of failing
+        pool = AsyncBlockingConnectionPool.from_url(
+            url=APP_SETTINGS.REDIS_URI,
+            socket_connect_timeout=APP_SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
+            socket_timeout=APP_SETTINGS.REDIS_SOCKET_TIMEOUT,
+            max_connections=APP_SETTINGS.REDIS_MAX_CONNECTIONS,
+            timeout=APP_SETTINGS.REDIS_POOL_TIMEOUT,
+            health_check_interval=APP_SETTINGS.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        return _with_circuit_breaker(await AsyncCircuitBreakerRedis.from_pool(pool), "async")
+
+    iam_cred_provider = get_iam_credential_provider()
+    # the node pools of the async cluster client can't block, they raise once max_connections are in use,
+    # so they are left unbounded (the redis-py default)
+    return _with_circuit_breaker(await AsyncCircuitBreakerRedisCluster.from_url(
+        url=APP_SETTINGS.REDIS_URI,
+        socket_connect_timeout=APP_SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
+        socket_timeout=APP_SETTINGS.REDIS_SOCKET_TIMEOUT,
+        decode_responses=APP_SETTINGS.REDIS_DECODE_RESPONSES,
+        health_check_interval=APP_SETTINGS.REDIS_HEALTH_CHECK_INTERVAL,
+        credential_provider=iam_cred_provider), "async")
+
+
+def create_redis_connection() -> Union[redis.Redis, redis.RedisCluster]:
+    """
+    Create the process wide sync redis client, called once in lifespan.
+    """
+    if APP_SETTINGS.ENV == 'local':
+        # a burst over max_connections waits for a free connection instead of failing
+        pool = BlockingConnectionPool.from_url(
+            url=APP_SETTINGS.REDIS_URI,
+            socket_connect_timeout=APP_SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
+            socket_timeout=APP_SETTINGS.REDIS_SOCKET_TIMEOUT,
+            max_connections=APP_SETTINGS.REDIS_MAX_CONNECTIONS,
+            timeout=APP_SETTINGS.REDIS_POOL_TIMEOUT,
+            health_check_interval=APP_SETTINGS.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        return _with_circuit_breaker(CircuitBreakerRedis.from_pool(pool), "sync")
+
+    iam_cred_provider = get_iam_credential_provider()
+    # the sync cluster client of redis-py does not pass health_check_interval to the node connections
+    return _with_circuit_breaker(CircuitBreakerRedisCluster.from_url(
+        url=APP_SETTINGS.REDIS_URI,
+        socket_connect_timeout=APP_SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
+        socket_timeout=APP_SETTINGS.REDIS_SOCKET_TIMEOUT,
+        decode_responses=APP_SETTINGS.REDIS_DECODE_RESPONSES,
+        max_connections=APP_SETTINGS.REDIS_MAX_CONNECTIONS,
+        connection_pool_class=functools.partial(BlockingConnectionPool,
+                                                timeout=APP_SETTINGS.REDIS_POOL_TIMEOUT),
+        credential_provider=iam_cred_provider), "sync")
+
+
+async def get_async_redis_connection_pool(request: Request) -> Union[aioredis.Redis, aioredis.RedisCluster]:
+    """
+    Get the process wide async redis client created in lifespan.
+    """
+    return request.app.state.async_redis
+
 
-async def get_async_redis_connection_pool():
-    redis_conn = None
-
-    try:
-        if APP_SETTINGS.ENV == 'local':
-            redis_conn = await aioredis.from_url(
-                url=APP_SETTINGS.REDIS_URI,
-                socket_connect_timeout=APP_SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
-                socket_timeout=APP_SETTINGS.REDIS_SOCKET_TIMEOUT,
-            )
-        else:
-            iam_cred_provider = ElastiCacheIAMProvider(user=APP_SETTINGS.REDIS_USERNAME,
-                                                       cluster_name=APP_SETTINGS.REDIS_CLUSTER_NAME)
-            redis_conn = await aioredis.RedisCluster.from_url(
-                url=APP_SETTINGS.REDIS_URI,
-                socket_connect_timeout=APP_SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
-                socket_timeout=APP_SETTINGS.REDIS_SOCKET_TIMEOUT,
-                decode_responses=APP_SETTINGS.REDIS_DECODE_RESPONSES,
-                credential_provider=iam_cred_provider)
-        yield redis_conn
-    except (aioredis.AuthenticationError, Exception) as e:
-        log.error(f"Having problems during connect Redis {e}")
-        raise e
-
-
-def get_redis_connection_pool():
-    redis_conn = None
-
-    try:
-        if APP_SETTINGS.ENV == 'local':
-            redis_conn = redis.from_url(
-                url=APP_SETTINGS.REDIS_URI,
-                socket_connect_timeout=APP_SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
-                socket_timeout=APP_SETTINGS.REDIS_SOCKET_TIMEOUT,
-            )
-        else:
-            iam_cred_provider = ElastiCacheIAMProvider(user=APP_SETTINGS.REDIS_USERNAME,
-                                                       cluster_name=APP_SETTINGS.REDIS_CLUSTER_NAME)
-            redis_conn = redis.RedisCluster.from_url(
-                url=APP_SETTINGS.REDIS_URI,
-                socket_connect_timeout=APP_SETTINGS.REDIS_SOCKET_CONNECT_TIMEOUT,
-                socket_timeout=APP_SETTINGS.REDIS_SOCKET_TIMEOUT,
-                decode_responses=APP_SETTINGS.REDIS_DECODE_RESPONSES,
-                credential_provider=iam_cred_provider)
-        yield redis_conn
-    except Exception as e:
-        log.error(f"Having problems during connect Redis {e}")
-        raise e
+def get_redis_connection_pool(request: Request) -> Union[redis.Redis, redis.RedisCluster]:
+    """
+    Get the process wide sync redis client created in lifespan.
+    """
+    return request.app.state.redis
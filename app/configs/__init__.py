@@ -2,10 +2,12 @@ import os
 
 from .aad import AADConfigs
 from .api_whitelist import APIWhitelistConfigs
+from .auth import AuthConfigs
 from .cache import RedisCacheConfigs
 from .cors import CORSConfigs
 from .database import DatabaseConfigs, ClickHouseConfigs, SACMySQLConfigs
 from .general import GeneralConfigs
+from .http_client import HTTPClientConfigs
 from .otel import OTELConfigs
 
 
@@ -14,7 +16,9 @@ class ENVConfigs(DatabaseConfigs,
                  SACMySQLConfigs,
                  RedisCacheConfigs,
                  OTELConfigs,
-                 AADConfigs
+                 AADConfigs,
+                 AuthConfigs,
+                 HTTPClientConfigs
                  ):
     """ Need read value from environment variables by env. """
     pass
@@ -11,3 +11,4 @@ class AADConfigs(BaseSettings):
     ENCRYPTION_KEY: str = Field(..., alias="AAD_ENCRYPTION_KEY")
     TENANT_ID: str = Field(..., alias="AAD_TENANT_ID")
     REDIRECT_URI: str = Field(..., alias="AAD_REDIRECT_URI")
+    GRAPH_API_URL: str = Field("https://graph.microsoft.com/v1.0", alias="AAD_GRAPH_API_URL")
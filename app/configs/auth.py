@@ -0,0 +1,19 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class AuthConfigs(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", case_sensitive=True)
+
+    # in-process cache of verified jwt tokens, used by CustomAuthMiddleware
+    AUTH_TOKEN_CACHE_MAX_SIZE: int = 10000
+    AUTH_TOKEN_CACHE_TTL: int = 60
+    AUTH_TOKEN_CACHE_NEGATIVE_TTL: int = 5
+
+    # dedicated thread pool for blocking msal calls, see AuthHandler
+    MSAL_EXECUTOR_MAX_WORKERS: int = 8
+    MSAL_EXECUTOR_MAX_QUEUE_SIZE: int = 32
+    MSAL_EXECUTOR_TIMEOUT: int = 15
+
+    # in-process cache of msal OBO access tokens, keyed by user and scopes
+    OBO_TOKEN_CACHE_MAX_SIZE: int = 10000
+    OBO_TOKEN_EXPIRY_MARGIN: int = 300
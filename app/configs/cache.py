@@ -1,4 +1,4 @@
-from typing import Any, Optional, Union
+from typing import Any, Literal, Optional, Union
 
 from pydantic import (RedisDsn, ValidationInfo, field_validator, model_validator)
 from pydantic_settings import (BaseSettings, SettingsConfigDict)
@@ -9,6 +9,14 @@ class RedisCacheConfigs(BaseSettings):
 
     ENV: Optional[str] = None
 
+    # redis, or memory for a single node without redis: the caches are in process, see MemoryStore.
+    # memory supports a single worker process only: the MSAL auth flows and token state are kept
+    # in process too, a login redirected to another worker would fail
+    CACHE_BACKEND: Literal["redis", "memory"] = "redis"
+    CACHE_MEMORY_MAX_BYTES: int = 64 * 1024 * 1024
+    # the worker processes of uvicorn (the default of --workers)
+    WEB_CONCURRENCY: int = 1
+
     REDIS_HOST: str = None
     REDIS_PORT: Optional[int] = 6379
     REDIS_USERNAME: Optional[str] = None
@@ -18,9 +26,40 @@ class RedisCacheConfigs(BaseSettings):
     REDIS_SSL: bool = False
     REDIS_SOCKET_CONNECT_TIMEOUT: int = 5
     REDIS_SOCKET_TIMEOUT: int = 5
+    # pool of the process wide clients, per node for cluster (unbounded for the async cluster client),
+    # a call waits up to REDIS_POOL_TIMEOUT seconds for a free connection once they are all in use
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: int = 5
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+
+    # fail fast while redis is down or slow instead of waiting for the socket timeouts, see CircuitBreaker
+    REDIS_CIRCUIT_BREAKER_ENABLED: bool = True
+    REDIS_CIRCUIT_BREAKER_WINDOW_SIZE: int = 50
+    REDIS_CIRCUIT_BREAKER_MIN_CALLS: int = 10
+    REDIS_CIRCUIT_BREAKER_FAILURE_RATE: float = 0.5
+    REDIS_CIRCUIT_BREAKER_SLOW_CALL_DURATION: float = 0.5
+    REDIS_CIRCUIT_BREAKER_SLOW_CALL_RATE: float = 0.5
+    REDIS_CIRCUIT_BREAKER_OPEN_DURATION: float = 10
+    REDIS_CIRCUIT_BREAKER_HALF_OPEN_CALLS: int = 3
+
+    # the IAM auth token expires after 15 minutes, it is presigned again in background before that
+    REDIS_IAM_TOKEN_REFRESH_INTERVAL: int = 600
 
-    REDIS_IAM_TOKEN_MAX_SIZE: int = 128
-    REDIS_IAM_TOKEN_TTL: int = 600
+    # serializer of RedisCache values: json, orjson or msgpack, compressed with zstd or lz4 above the threshold.
+    # json without compression stays readable by the previous versions, see CacheSerializer
+    CACHE_CODEC: str = "json"
+    CACHE_COMPRESSION: Optional[str] = None
+    CACHE_COMPRESSION_THRESHOLD: int = 1024
+
+    # results of the service functions decorated with @cached_async
+    SERVICE_CACHE_ENABLED: bool = True
+    # the in-process copy of a result is served for this many seconds more while redis is unavailable
+    SERVICE_CACHE_STALE_TTL: int = 300
+    # total counts of the list endpoints with count=cached, per query and filters
+    SERVICE_CACHE_COUNT_TTL: int = 30
+    # redis client side caching of the results cached with client_tracking=True, see ClientTracking,
+    # it relies on private apis of redis-py and refuses to start with an untested redis-py version
+    CACHE_CLIENT_TRACKING_ENABLED: bool = True
 
     @field_validator("REDIS_URI", mode="before")
     @classmethod
@@ -34,6 +73,14 @@ class RedisCacheConfigs(BaseSettings):
                               host=values.data.get("REDIS_HOST"),
                               port=values.data.get("REDIS_PORT")).unicode_string()
 
+    @model_validator(mode='after')
+    def check_memory_backend(self) -> "RedisCacheConfigs":
+        if self.CACHE_BACKEND == "memory" and self.WEB_CONCURRENCY > 1:
+            raise ValueError(f"CACHE_BACKEND=memory supports a single worker, WEB_CONCURRENCY is "
+                             f"{self.WEB_CONCURRENCY}: the auth flows and caches would differ "
+                             f"between workers")
+        return self
+
     @model_validator(mode='before')
     @classmethod
     def assemble_auth_config(cls, data: Any) -> Any:
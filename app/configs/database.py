@@ -19,6 +19,16 @@ class DatabaseConfigs(BaseSettings):
     POOL_RECYCLE: int = 3600
     POOL_TIMEOUT: int = 30
 
+    # audit logs are queued in memory and written in batches, see app/core/audit/sink.py
+    AUDIT_SINK_BATCH_SIZE: int = 500
+    AUDIT_SINK_FLUSH_INTERVAL: float = 1.0  # seconds
+    AUDIT_SINK_MAX_QUEUE_SIZE: int = 10000  # recording waits while the queue is full
+    AUDIT_SINK_SYNC: bool = False  # write every audit log right away, for tests
+    # audit_logs is partitioned by month, see app/core/audit/partitions.py
+    AUDIT_PARTITION_PREMAKE_MONTHS: int = 3  # partitions created ahead of the current month
+    AUDIT_PARTITION_MAINTENANCE_INTERVAL: int = 60 * 60 * 6  # seconds
+    AUDIT_RETENTION_MONTHS: int = 0  # partitions older than this are detached, 0 keeps everything
+    AUDIT_RETENTION_DROP: bool = False  # drop the detached partitions rather than keep them as plain tables
 
     @field_validator("POSTGRES_URI", mode="before")
     @classmethod
@@ -0,0 +1,15 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class HTTPClientConfigs(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", case_sensitive=True)
+
+    # app wide async http client for outbound integrations, e.g. Microsoft Graph API
+    HTTP_CLIENT_CONNECT_TIMEOUT: float = 5
+    HTTP_CLIENT_READ_TIMEOUT: float = 10
+    HTTP_CLIENT_WRITE_TIMEOUT: float = 10
+    HTTP_CLIENT_POOL_TIMEOUT: float = 5
+    HTTP_CLIENT_MAX_CONNECTIONS: int = 100
+    HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_CLIENT_KEEPALIVE_EXPIRY: float = 30
+    HTTP_CLIENT_MAX_CONCURRENCY: int = 50
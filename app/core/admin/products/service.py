@@ -1,29 +1,43 @@
+import json
+
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.cache.decorators import cached_async, invalidate_tags
 from app.core.admin.models import Products
 from app.log import logger
 from app.responses import PaginatedParams, PaginationData
-from app.utils.query import get_count
+from app.utils.query import get_total
 from .schemas import (ProductCreate,
                       ProductUpdate,
                       ProductResponse)
 
 
+@cached_async("products_page:",
+              key=lambda db, p, filters: f"{p.offset}:{p.limit}:{p.count.value}:"
+                                         f"{json.dumps(filters or {}, sort_keys=True)}",
+              model=PaginationData[ProductResponse], ttl=60 * 10, tags=["products"], local_ttl=30)
+async def get_products_page(db: AsyncSession, p: PaginatedParams,
+                            filters: dict) -> PaginationData[ProductResponse]:
+    query = select(Products)
+    if filters:
+        for key, value in filters.items():
+            if key == "name":
+                _name = getattr(Products, key)
+                query = query.where(_name.ilike(f"%{value}%"))
+                continue
+            query = query.where(getattr(Products, key) == value)
+    total = await get_total(db, query, p.count)
+    # one more row to know if there is a next page
+    paged_query = query.offset(p.offset).limit(p.limit + 1)
+    paged_products = (await db.exec(paged_query)).all()
+    return PaginationData[ProductResponse](total=total, items=paged_products[:p.limit],
+                                           has_more=len(paged_products) > p.limit)
+
+
 async def get_products(db: AsyncSession, p: PaginatedParams, filters: dict = None) -> PaginationData[ProductResponse]:
     try:
-        query = select(Products)
-        if filters:
-            for key, value in filters.items():
-                if key == "name":
-                    _name = getattr(Products, key)
-                    query = query.where(_name.ilike(f"%{value}%"))
-                    continue
-                query = query.where(getattr(Products, key) == value)
-        total = await get_count(db, query)
-        paged_query = query.offset(p.offset).limit(p.limit)
-        paged_products = (await db.exec(paged_query)).all()
-        return PaginationData(total=total, items=paged_products)
+        return await get_products_page(db, p, filters)
     except Exception as e:
         await db.rollback()
         msg = f"Failed to get products: {str(e)}"
@@ -48,6 +62,7 @@ async def create_product(db: AsyncSession, product: ProductCreate):
         new_product = Products(**product.model_dump())
         db.add(new_product)
         await db.commit()
+        await invalidate_tags("products")
         return new_product, None
     except Exception as e:
         await db.rollback()
@@ -65,6 +80,7 @@ async def update_product(db: AsyncSession, product_id: int, product: ProductUpda
 
         db.add(db_product)
         await db.commit()
+        await invalidate_tags("products")
         return db_product, None
 
     except Exception as e:
@@ -80,6 +96,7 @@ async def delete_product(db: AsyncSession, product_id: int):
 
         await db.delete(db_product)
         await db.commit()
+        await invalidate_tags("products")
         return None, None
     except Exception as e:
         await db.rollback()
@@ -1,15 +1,37 @@
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Column, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlmodel import SQLModel, Field
 
+# the text search configuration of detail_tsv, queries must use the same one to match it
+DETAIL_TS_CONFIG = "simple"
+
 
 class Audit(SQLModel, table=True):
+    """
+    Partitioned by month of audit_time, see app/core/audit/partitions.py,
+    the primary key includes audit_time since a unique index of a partitioned table must include the partition key.
+    """
     __tablename__ = "audit_logs"
-    id: Optional[int] = Field(default=None, primary_key=True, index=True)
-    username: str = Field(max_length=50, index=True)
+    __table_args__ = (
+        # the filters of get_audit_logs within a time range, and keyset pagination sorted by audit time
+        Index("ix_audit_logs_username_audit_time", "username", "audit_time"),
+        Index("ix_audit_logs_action_audit_time", "action", "audit_time"),
+        Index("ix_audit_logs_result_audit_time", "result", "audit_time"),
+        Index("ix_audit_logs_audit_time_id", "audit_time", "id"),
+        # full text search over detail (q of get_audit_logs), maintained by postgres and never loaded
+        Column("detail_tsv", TSVECTOR, Computed(f"to_tsvector('{DETAIL_TS_CONFIG}'::regconfig, (detail)::text)",
+                                                persisted=True)),
+        Index("ix_audit_logs_detail_tsv", "detail_tsv", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (audit_time)"},
+    )
+    __mapper_args__ = {"exclude_properties": ["detail_tsv"]}
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
+    username: str = Field(max_length=50)
     user_id: int = Field(max_length=8, index=True)
-    audit_time: datetime = Field(default_factory=datetime.utcnow)
+    audit_time: datetime = Field(default_factory=datetime.utcnow, primary_key=True)
     action: str = Field(max_length=16, description="The action type to audit")
     result: str = Field(max_length=16)
     detail: str = Field(max_length=255, description="The detail of the action")
@@ -0,0 +1,151 @@
+import asyncio
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.configs import APP_SETTINGS
+from app.log import logger
+
+PARENT_TABLE = "audit_logs"
+DEFAULT_PARTITION = "audit_logs_default"
+PARTITION_NAME = re.compile(r"^audit_logs_p(\d{4})(\d{2})$")
+
+
+def month_start(dt: datetime, months: int = 0) -> datetime:
+    """
+    First day of the month of dt, moved by `months` months.
+    """
+    year, month = divmod(dt.year * 12 + dt.month - 1 + months, 12)
+    return datetime(year, month + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PARENT_TABLE}_p{start:%Y%m}"
+
+
+async def _is_partitioned(conn: AsyncConnection) -> bool:
+    return (await conn.execute(text("SELECT EXISTS (SELECT FROM pg_class "
+                                    "WHERE oid = to_regclass(:table) AND relkind = 'p')"),
+                               {"table": PARENT_TABLE})).scalar()
+
+
+async def _lock(conn: AsyncConnection):
+    # serialize the maintenance of every worker, until the end of the transaction
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": PARENT_TABLE})
+
+
+async def get_partitions(conn: AsyncConnection) -> Dict[str, Optional[datetime]]:
+    """
+    The partitions of audit_logs by name, with the first day of their month (None for the default partition).
+    """
+    names = (await conn.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                                     "WHERE i.inhparent = to_regclass(:table)"), {"table": PARENT_TABLE})).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+    return partitions
+
+
+async def ensure_audit_partitions(conn: AsyncConnection, now: datetime = None,
+                                  months_ahead: int = APP_SETTINGS.AUDIT_PARTITION_PREMAKE_MONTHS) -> List[str]:
+    """
+    Create the monthly partitions of audit_logs from the current month to `months_ahead` months ahead,
+    and the default partition catching rows out of them. Return the partitions created.
+    A month can't be created while the default partition has rows of it, it stays empty as long as the
+    maintenance runs more often than every `months_ahead` months.
+    """
+    if not await _is_partitioned(conn):
+        logger.warning(f"{PARENT_TABLE} is not partitioned, run the migrations")
+        return []
+    await _lock(conn)
+    partitions = await get_partitions(conn)
+    created = []
+    now = now or datetime.utcnow()
+    for months in range(months_ahead + 1):
+        start = month_start(now, months)
+        name = partition_name(start)
+        if name in partitions:
+            continue
+        await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} "
+                                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{month_start(start, 1):%Y-%m-%d}')"))
+        created.append(name)
+    if DEFAULT_PARTITION not in partitions:
+        await conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"))
+        created.append(DEFAULT_PARTITION)
+    # the statistics targets of the parent (e.g. detail_tsv) are not inherited by a new partition
+    targets = (await conn.execute(text("SELECT attname, attstattarget FROM pg_attribute "
+                                       "WHERE attrelid = to_regclass(:table) AND attstattarget > 0"),
+                                  {"table": PARENT_TABLE})).all()
+    for name in created:
+        for column, target in targets:
+            await conn.execute(text(f"ALTER TABLE {name} ALTER COLUMN {column} SET STATISTICS {target}"))
+    if created:
+        logger.info(f"Created the partitions {created}")
+    return created
+
+
+async def apply_audit_retention(conn: AsyncConnection, now: datetime = None,
+                                retention_months: int = APP_SETTINGS.AUDIT_RETENTION_MONTHS,
+                                drop: bool = APP_SETTINGS.AUDIT_RETENTION_DROP) -> List[str]:
+    """
+    Detach, and drop if `drop`, the monthly partitions of audit_logs entirely older than `retention_months`
+    months before the current month, a metadata operation rather than a DELETE. Return the partitions detached.
+    """
+    if retention_months <= 0 or not await _is_partitioned(conn):
+        return []
+    await _lock(conn)
+    cutoff = month_start(now or datetime.utcnow(), -retention_months)
+    detached = []
+    for name, start in sorted((await get_partitions(conn)).items()):
+        if start is None or month_start(start, 1) > cutoff:
+            continue
+        await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+        if drop:
+            await conn.execute(text(f"DROP TABLE {name}"))
+        detached.append(name)
+    if detached:
+        logger.info(f"{'Dropped' if drop else 'Detached'} the partitions {detached}")
+    return detached
+
+
+class AuditPartitionMaintenance:
+    """
+    Creates the upcoming partitions of audit_logs and applies the retention every `interval` seconds,
+    one per process started in lifespan.
+    """
+
+    def __init__(self, engine: AsyncEngine, interval: float = APP_SETTINGS.AUDIT_PARTITION_MAINTENANCE_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self):
+        try:
+            async with self.engine.begin() as conn:
+                await ensure_audit_partitions(conn)
+                await apply_audit_retention(conn)
+        except Exception as e:
+            logger.error(f"Failed to maintain the partitions of {PARENT_TABLE}: {e}")
+
+    async def _run(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -1,3 +1,4 @@
+from datetime import datetime, timezone
 from typing import Optional
 
 from fastapi import APIRouter, Depends, Query
@@ -13,6 +14,10 @@ from . import service
 router = APIRouter()
 
 
+def to_naive_utc(dt: datetime) -> datetime:
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+
+
 @api_version(major=1)
 @router.get("/audit_logs",
             response_model=GeneralResponse[PaginationData[schemas.AuditResponse]],
@@ -21,6 +26,10 @@ async def get_audit_logs(db: AsyncSession = Depends(get_session),
                          username: Optional[str] = Query(None, description="Filter by user name"),
                          action: Optional[str] = Query(None, description="Filter by action type"),
                          result: Optional[str] = Query(None, description="Filter by result"),
+                         start: Optional[datetime] = Query(None, description="Filter by audit time from, included"),
+                         end: Optional[datetime] = Query(None, description="Filter by audit time to, excluded"),
+                         q: Optional[str] = Query(None, description="Search the words of the detail, with the "
+                                                                    "web search syntax: \"a phrase\", or, -word"),
                          p: PaginatedParams = Depends(PaginatedParams),
                          s: SortingParams = Depends(SortingParams)
                          ) -> GeneralResponse[PaginationData[schemas.AuditResponse]]:
@@ -32,6 +41,13 @@ async def get_audit_logs(db: AsyncSession = Depends(get_session),
         filters["action"] = action
     if result:
         filters["result"] = result
+    # audit times are stored in UTC without time zone
+    if start:
+        filters["start"] = to_naive_utc(start)
+    if end:
+        filters["end"] = to_naive_utc(end)
+    if q:
+        filters["q"] = q
 
     paged_audit_logs = await service.get_audit_logs(db, p, s, filters=filters)
     return GeneralResponse(code=0, message="Audit records retrieved successfully", data=paged_audit_logs)
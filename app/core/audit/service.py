@@ -1,14 +1,14 @@
-from datetime import datetime
-
+from sqlalchemy import cast, func
+from sqlalchemy.dialects.postgresql import REGCONFIG
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core.audit.models import Audit
-from app.core.auth.models import RUser
+from app.core.audit.models import DETAIL_TS_CONFIG, Audit
+from app.core.audit.sink import AUDIT_SINK
 from app.log import logger
 from app.responses import PaginatedParams, PaginationData
 from app.sorting import SortingParams
-from app.utils.query import get_count
+from app.utils.query import get_total
 
 
 async def get_audit_logs(db: AsyncSession, p: PaginatedParams, s: SortingParams, filters: dict = None):
@@ -16,21 +16,41 @@ async def get_audit_logs(db: AsyncSession, p: PaginatedParams, s: SortingParams,
         q = select(Audit)
         if filters:
             for key, value in filters.items():
+                if key == "start":
+                    q = q.where(Audit.audit_time >= value)
+                    continue
+                if key == "end":
+                    q = q.where(Audit.audit_time < value)
+                    continue
+                if key == "q":
+                    # words of the detail, with the web search syntax ("quoted phrase", or, -excluded)
+                    ts_query = func.websearch_to_tsquery(cast(DETAIL_TS_CONFIG, REGCONFIG), value)
+                    q = q.where(Audit.__table__.c.detail_tsv.bool_op("@@")(ts_query))
+                    continue
                 if key == "name":
                     _name = getattr(Audit, key)
                     q = q.where(_name.ilike(f"%{value}%"))
                     continue
                 q = q.where(getattr(Audit, key) == value)
 
-        total = await get_count(db, q)
-        # apply pagination and sorting
-        query = s.apply_sorting(q, Audit).offset(p.offset).limit(p.limit)
-        audit_logs = (await db.exec(query)).all()
+        total = await get_total(db, q, p.count)
+        # apply pagination and sorting, with one more row to know if there is a next page
+        next_cursor = None
+        if p.cursor is None:
+            query = s.apply_sorting(q, Audit).offset(p.offset).limit(p.limit + 1)
+            audit_logs = (await db.exec(query)).all()
+            has_more = len(audit_logs) > p.limit
+            audit_logs = audit_logs[:p.limit]
+        else:
+            query = s.apply_cursor(q, Audit, p.cursor, p.limit)
+            audit_logs = (await db.exec(query)).all()
+            has_more = len(audit_logs) > p.limit
+            audit_logs, next_cursor = s.page(audit_logs, Audit, p.limit)
 
         # construct the response data
         response_data = [audit_log.model_dump() for audit_log in audit_logs]
 
-        return PaginationData(total=total, items=response_data)
+        return PaginationData(total=total, items=response_data, next_cursor=next_cursor, has_more=has_more)
     except Exception as e:
         await db.rollback()
         msg = f"Failed to get audit logs: {str(e)}"
@@ -38,21 +58,8 @@ async def get_audit_logs(db: AsyncSession, p: PaginatedParams, s: SortingParams,
         return PaginationData(total=0, items=[])
 
 
-async def create_audit_log(db: AsyncSession, username: str, action: str, result: str, detail: str):
-    try:
-        user_id = (await db.exec(select(RUser.id).where(RUser.email == username))).one()
-        if user_id is None:
-            logger.error(f"User {username} not found")
-            return
-        new_audit_log = Audit(username=username,
-                              user_id=user_id,
-                              audit_time=datetime.utcnow(),
-                              action=action,
-                              result=result,
-                              detail=detail)
-        db.add(new_audit_log)
-        await db.commit()
-
-    except Exception as e:
-        await db.rollback()
-        logger.error(f"Failed to create audit log: {str(e)}")
+async def create_audit_log(username: str, action: str, result: str, detail: str):
+    """
+    Record an audit log, written in the background by AUDIT_SINK with its own session.
+    """
+    await AUDIT_SINK.record(username, action, result, detail)
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlmodel import select
+
+from app.configs import APP_SETTINGS
+from app.core.audit.models import Audit
+from app.core.auth.models import RUser
+from app.database.postgres.session import AsyncDatabaseSession
+from app.log import logger
+
+
+class AuditSink:
+    """
+    Writes the audit logs in the background, off the request path, one per process started in lifespan.
+
+    Recorded events are queued in memory and written with their own session in multi-row inserts,
+    once `batch_size` events are queued or `flush_interval` seconds after the first one.
+    The user ids of a batch are resolved with one query. Recording waits while `max_queue_size` events
+    are queued (backpressure), the queue is flushed on stop.
+    Until started, after stop and in sync mode every event is written right away.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 1.0, max_queue_size: int = 10000,
+                 sync: bool = False):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.sync = sync
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def record(self, username: str, action: str, result: str, detail: str):
+        event = {"username": username, "audit_time": datetime.utcnow(), "action": action,
+                 "result": result, "detail": detail}
+        if self.sync or self._task is None:
+            await self._write([event])
+            return
+        await self._queue.put(event)
+
+    async def _write(self, events: List[Dict]):
+        try:
+            async with AsyncDatabaseSession() as db:
+                usernames = {event["username"] for event in events}
+                query = select(RUser.email, RUser.id).where(RUser.email.in_(usernames))
+                user_ids = dict((await db.exec(query)).all())
+                rows = []
+                for event in events:
+                    user_id = user_ids.get(event["username"])
+                    if user_id is None:
+                        logger.error(f"User {event['username']} not found, audit log of {event['action']} dropped")
+                        continue
+                    rows.append({**event, "user_id": user_id})
+                if rows:
+                    await db.exec(insert(Audit), params=rows)
+        except Exception as e:
+            logger.error(f"Failed to write {len(events)} audit logs: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            events = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(events) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    events.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(events)
+            for _ in events:
+                self._queue.task_done()
+
+    def start(self):
+        if self._task is None and not self.sync:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self):
+        """
+        Wait until every recorded event is written.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # events recorded from now on are written right away
+        task, self._task = self._task, None
+        await self.flush()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        self._queue = None
+
+
+AUDIT_SINK = AuditSink(batch_size=APP_SETTINGS.AUDIT_SINK_BATCH_SIZE,
+                       flush_interval=APP_SETTINGS.AUDIT_SINK_FLUSH_INTERVAL,
+                       max_queue_size=APP_SETTINGS.AUDIT_SINK_MAX_QUEUE_SIZE,
+                       sync=APP_SETTINGS.AUDIT_SINK_SYNC)
@@ -1,69 +1,104 @@
+from contextvars import ContextVar
+from typing import Optional
+
 import redis
 from msal import SerializableTokenCache
 
+from app.cache.backend import create_async_cache
+from app.cache.module.base import BaseAsyncRedisCache
+from app.cache.module.codec import RAW_SERIALIZER
 from app.crypto import AESCipher
 from app.log import logger
 
 
-class RedisTokenCache(SerializableTokenCache):
-    def __init__(self, redis_conn, encryption_key: str):
+class AsyncRedisTokenCache(SerializableTokenCache):
+    """
+    msal token cache of one user persisted in Redis with the asyncio client.
+    msal reads and writes the cache synchronously in memory, the state is explicitly loaded with
+    `await load()` before and saved with `await persist()` after each msal call.
+    Every state is stored encrypted under a single key of `cache` (see create_token_state_cache),
+    so both Redis and RedisCluster clients, and the memory backend, are supported.
+    """
+
+    def __init__(self, cache: BaseAsyncRedisCache, encryption_key: str):
         super().__init__()
-        self._redis = redis_conn
-        self._prefix = "msal_token_cache:"
+        self._state_cache = cache
         self.username = None
         self.cipher = AESCipher(encryption_key.encode())
 
     def set_user(self, username):
         self.username = username
 
-    def load(self):
+    @property
+    def key(self) -> str:
+        return f"state:{self.username}"
+
+    async def load(self):
         logger.debug(f"load called, username: {self.username}")
         try:
-            key = f"{self._prefix}state:{self.username}"
-            cache_state = self._redis.get(f"{key}")
-            if cache_state:
-                decrypted_state = self.cipher.decrypt(cache_state)
-                logger.debug(f"Deserializing token cache from Redis: {key}")
-                self.deserialize(decrypted_state)
-            else:
-                logger.debug("No token cache found in Redis")
+            cache_state = await self._state_cache.get(self.key)
         except redis.RedisError as e:
             logger.error(f"Error loading cache from redis: {e}")
+            return
+        if cache_state:
+            logger.debug(f"Deserializing token cache from Redis: {self.key}")
+            try:
+                self.deserialize(self.cipher.decrypt(cache_state))
+            except Exception as e:
+                logger.error(f"Error deserializing cache from redis: {e}")
+        else:
+            logger.debug("No token cache found in Redis")
 
-    def save(self, username):
-        logger.debug(f"save called, username: {username}")
-        self.set_user(username)
-        self.serialize()
+    async def persist(self, username: str = None):
+        """
+        Save the cache state to Redis if it was changed by msal since the last load or persist.
+        """
+        logger.debug(f"persist called, username: {username or self.username}")
+        if username:
+            self.set_user(username)
+        if not self.has_state_changed:
+            return
+        encrypted_state = self.cipher.encrypt(self.serialize())
+        try:
+            logger.debug(f"Saving token cache to redis: {self.key}")
+            await self._state_cache.set(self.key, encrypted_state)
+            self.has_state_changed = False
+        except redis.RedisError as e:
+            logger.error(f"Error saving cache to redis: {e}")
 
-    def delete(self, username):
+    async def delete(self, username):
         logger.debug(f"remove called, username: {username}")
         self.set_user(username)
         try:
-            key = f"{self._prefix}state:{self.username}"
-            logger.debug(f"Deleting token cache from redis: {key}")
-            self._redis.delete(f"{key}")
+            logger.debug(f"Deleting token cache from redis: {self.key}")
+            await self._state_cache.delete(self.key)
         except redis.RedisError as e:
             logger.error(f"Error deleting cache from redis: {e}")
 
-    def serialize(self) -> str:
-        logger.debug("serialize called")
-        if not self.has_state_changed:
-            return ''
-        cache_state = super().serialize()
-        encrypted_state = self.cipher.encrypt(cache_state)
-        try:
-            key = f"{self._prefix}state:{self.username}"
-            logger.debug(f"Saving token cache to redis: {key}")
-            self._redis.set(f"{key}", encrypted_state, ex=60 * 60 * 12)
-            self.has_state_changed = False
-        except redis.RedisError as e:
-            logger.error(f"Error saving cache to redis: {e}")
-        return cache_state
-
     def deserialize(self, state):
-        logger.debug("deserialize called")
-        try:
-            super().deserialize(state)
-            self.has_state_changed = False
-        except Exception as e:
-            logger.error(f"Error deserializing cache from redis: {e}")
+        super().deserialize(state)
+        self.has_state_changed = False
+
+
+def create_token_state_cache(redis_conn) -> BaseAsyncRedisCache:
+    """
+    Cache of the encrypted token cache states, stored as they are for 12 hours.
+    """
+    return create_async_cache(redis_conn, "msal_token_cache:", 60 * 60 * 12, serializer=RAW_SERIALIZER)
+
+
+CURRENT_TOKEN_CACHE: ContextVar[Optional[AsyncRedisTokenCache]] = ContextVar("msal_token_cache", default=None)
+
+
+class RequestScopedTokenCache:
+    """
+    Token cache of the process wide msal application.
+    It delegates to the AsyncRedisTokenCache bound to the current request (see AuthHandler.user_token_cache),
+    so the cached tokens and the username of one request never leak to another one.
+    """
+
+    def __getattr__(self, name):
+        token_cache = CURRENT_TOKEN_CACHE.get()
+        if token_cache is None:
+            raise RuntimeError("No msal token cache is bound to the current request")
+        return getattr(token_cache, name)
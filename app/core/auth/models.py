@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional, List
 
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Column, LargeBinary, UniqueConstraint
 from sqlmodel import SQLModel, Field, Relationship
 
 
@@ -10,6 +10,8 @@ class AuthToken(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     name: str = Field(max_length=255, unique=True)
     token: str = Field(max_length=1024)  # jwt token generated by backend
+    # sha256 digest of token, used to look up a token instead of comparing the whole jwt string
+    token_digest: bytes = Field(sa_column=Column(LargeBinary(32), nullable=False, index=True))
     aad_user_id: str = Field(max_length=36)  # store aad auth user_id
     create_time: datetime = Field(default_factory=datetime.utcnow)
     update_time: datetime = Field(default_factory=datetime.utcnow)
@@ -1,3 +1,5 @@
 SUPER_ADMIN_LIST = ["felix_yang@gmail.com", "daniel_zhai@gmail.com", "loong_zhou@gmail.com",
                "test@gmail.com", "edon_tan@gmail.com", "eric_cai@gmail.com",
                "leo_hua@gmail.com", "regina_qian@gmail.com"]
+
+ADMIN_ROLE_NAMES = ["admin", "superAdmin"]
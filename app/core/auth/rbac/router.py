@@ -1,9 +1,11 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, Request, Header
+from fastapi import APIRouter, Depends, Request
 from fastapi_versionizer import api_version
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core.auth.schemas import Principal
+from app.core.auth.service import get_current_principal
 from app.database.postgres.session import get_session
 from app.responses import GeneralResponse, PaginatedParams, PaginationData
 from app.sorting import SortingParams
@@ -21,7 +23,7 @@ async def read_users(db: AsyncSession = Depends(get_session),
                      p: PaginatedParams = Depends(PaginatedParams),
                      s: SortingParams = Depends(SortingParams),
                      ):
-    result = await service.get_users(db, p.limit, p.offset, s)
+    result = await service.get_users(db, p.limit, p.offset, s, p.cursor, p.count)
     return GeneralResponse(code=0, message="Success", data=result)
 
 
@@ -174,11 +176,12 @@ async def assign_user_role(user_id: int, role_id: int, request: Request, db: Asy
 
 @api_version(major=1)
 @router.get("/my_role", response_model=GeneralResponse[schemas.Role])
-async def get_my_role(user: str = Header(...), db: AsyncSession = Depends(get_session)):
+async def get_my_role(principal: Principal = Depends(get_current_principal),
+                      db: AsyncSession = Depends(get_session)):
     """
     Get the role of current user.
     """
-    db_role = await service.get_my_role(db, user)
+    db_role = await service.get_my_role(db, principal)
     if db_role is None:
         return GeneralResponse(code=1, message="Role not found", data=None)
     return GeneralResponse(code=0, message="Success", data=db_role)
@@ -186,11 +189,12 @@ async def get_my_role(user: str = Header(...), db: AsyncSession = Depends(get_se
 
 @api_version(major=1)
 @router.get("/my_menus", response_model=GeneralResponse[List[schemas.MenuActions]])
-async def get_my_menus(db: AsyncSession = Depends(get_session), user: str = Header(...)):
+async def get_my_menus(db: AsyncSession = Depends(get_session),
+                       principal: Principal = Depends(get_current_principal)):
     """
     Get all menus for the user, including parent and children menus.
     """
-    menus = await service.get_my_menus(db, user)
+    menus = await service.get_my_menus(db, principal)
     if menus is None:
         return GeneralResponse(code=1, message="Menus not found", data=None)
     return GeneralResponse(code=0, message="Success", data=menus)
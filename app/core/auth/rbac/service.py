@@ -4,12 +4,17 @@ from sqlalchemy.orm import joinedload
 from sqlmodel import select, func, delete
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.cache.decorators import cached_async, invalidate_tags
 from app.core.auth import models
 from app.core.auth.models import RoleMenuActionLink
+from app.core.auth.schemas import Principal
+from app.core.auth.token_cache import VERIFIED_TOKEN_CACHE
+from app.enums import CountStrategyEnum
 from app.log import logger
 from app.sorting import SortingParams
+from app.utils.query import get_total
 from . import schemas
-from .constants import SUPER_ADMIN_LIST
+from .constants import ADMIN_ROLE_NAMES, SUPER_ADMIN_LIST
 from .schemas import UserCreate, UserUpdate, RoleCreate, RoleUpdate, MenuActions, MenuActionEnum
 
 
@@ -33,22 +38,29 @@ async def get_user(db: AsyncSession, user_id: int):
         return None
 
 
-async def get_users(db: AsyncSession, limit: int, offset: int, sorting: SortingParams) -> dict:
+async def get_users(db: AsyncSession, limit: int, offset: int, sorting: SortingParams, cursor: list = None,
+                    count_strategy: CountStrategyEnum = CountStrategyEnum.EXACT) -> dict:
     """
-    Get all users and their role with pagination.
+    Get all users and their role with pagination, by offset or by cursor if cursor is not None.
     """
     try:
         # Getting the count of users
-        count_result = await db.exec(select(func.count(models.RUser.id)))
-        count = count_result.one()
+        count = await get_total(db, select(models.RUser), count_strategy)
 
-        # Building the query
+        # Building the query, with one more row to know if there is a next page
         query = select(models.RUser).options(joinedload(models.RUser.roles))
-        query = sorting.apply_sorting(query, models.RUser)
-        query = query.offset(offset).limit(limit)
-
-        result = await db.exec(query)
-        users = result.unique().all()
+        next_cursor = None
+        if cursor is None:
+            query = sorting.apply_sorting(query, models.RUser)
+            query = query.offset(offset).limit(limit + 1)
+            users = (await db.exec(query)).unique().all()
+            has_more = len(users) > limit
+            users = users[:limit]
+        else:
+            query = sorting.apply_cursor(query, models.RUser, cursor, limit)
+            users = (await db.exec(query)).unique().all()
+            has_more = len(users) > limit
+            users, next_cursor = sorting.page(users, models.RUser, limit)
 
         # construct user data with role
         users_data = [
@@ -65,7 +77,7 @@ async def get_users(db: AsyncSession, limit: int, offset: int, sorting: SortingP
     except Exception as e:
         logger.error(f"Failed to get users: {e}")
         return {"total": 0, "items": []}
-    return {"total": count, "items": users_data}
+    return {"total": count, "items": users_data, "next_cursor": next_cursor, "has_more": has_more}
 
 
 async def create_user(db: AsyncSession, user: UserCreate):
@@ -115,7 +127,9 @@ async def assign_role_to_user(db: AsyncSession, user_id: int, role_id: int):
         if user and role:
             user.roles.clear()
             user.roles.append(role)
+            username = user.email
             await db.commit()
+            await VERIFIED_TOKEN_CACHE.evict_user(username)
             return True, None
         else:
             logger.error(f"Failed to assign role '{role.name}' to user '{user.name}'")
@@ -126,13 +140,18 @@ async def assign_role_to_user(db: AsyncSession, user_id: int, role_id: int):
         return False, f"Failed to assign role to user with error: {e}"
 
 
-async def get_my_role(db: AsyncSession, user_mail: str):
+async def get_my_role(db: AsyncSession, principal: Principal):
+    """
+    Get the role of the principal, the role id is already resolved by CustomAuthMiddleware.
+    """
     try:
-        user = (await db.exec(select(models.RUser).where(models.RUser.email == user_mail))).first()
-        if not user:
-            logger.error(f"User '{user_mail}' not found")
+        if principal.user_id is None:
+            logger.error(f"User '{principal.username}' not found")
+            return None
+        if principal.role_id is None:
+            logger.error(f"No role assigned for user '{principal.username}'")
             return None
-        return user.roles[0]
+        return await get_role(db, principal.role_id)
     except Exception as e:
         logger.error(f"Failed to get role for user: {e}")
         return None
@@ -142,9 +161,11 @@ async def update_user(db: AsyncSession, user_id: int, user: UserUpdate):
     try:
         db_user = (await db.exec(select(models.RUser).where(models.RUser.id == user_id))).first()
         if db_user:
+            old_username = db_user.email
             db_user.name = user.name
             db_user.email = user.email
             await db.commit()
+            await VERIFIED_TOKEN_CACHE.evict_user(old_username)
             await db.refresh(db_user)
     except Exception as e:
         logger.error(f"Failed to update user: {e}")
@@ -157,8 +178,10 @@ async def delete_user(db: AsyncSession, user_id: int):
     try:
         db_user = (await db.exec(select(models.RUser).where(models.RUser.id == user_id))).first()
         if db_user:
+            username = db_user.email
             await db.delete(db_user)
             await db.commit()
+            await VERIFIED_TOKEN_CACHE.evict_user(username)
     except Exception as e:
         logger.error(f"Failed to delete user: {e}")
         await db.rollback()
@@ -198,6 +221,7 @@ async def assign_menu_permissions_to_role(db: AsyncSession, role_id: int, action
                 db_role.actions.append(action)
 
             await db.commit()
+            await invalidate_tags(f"role_menus:{role_id}")
             return True
         else:
             logger.error(f"No menus found for role '{db_role.name}' in db")
@@ -231,6 +255,7 @@ async def update_role_menus(db: AsyncSession, role_id: int, menu_assignments: Li
             db_role.actions.append(action)
 
         await db.commit()
+        await invalidate_tags(f"role_menus:{role_id}")
         return db_role, None
 
     except Exception as e:
@@ -239,9 +264,11 @@ async def update_role_menus(db: AsyncSession, role_id: int, menu_assignments: Li
         return None, f"Failed to update role menus with error: {e}"
 
 
+@cached_async("rbac_role_menus:", key="{role_id}", model=List[MenuActions], ttl=60 * 10,
+              tags=["role_menus", "role_menus:{role_id}"], client_tracking=True)
 async def get_role_menus(db: AsyncSession, role_id: int):
     """
-    Get all menus for a role.
+    Get all menus for a role, cached until the role or the menus are changed.
     """
     try:
         # Fetch role with eager loading of actions and corresponding menus
@@ -303,8 +330,13 @@ async def update_role(db: AsyncSession, role_id: int, role: RoleUpdate):
         if db_role:
             db_role.name = role.name
             db_role.description = role.description
+            usernames = [db_user.email for db_user in db_role.users]
             await db.commit()
             await db.refresh(db_role)
+            # the role name is cached with the principal of its users
+            for username in usernames:
+                await VERIFIED_TOKEN_CACHE.evict_user(username)
+            await invalidate_tags(f"role_menus:{role_id}")
     except Exception as e:
         logger.error(f"Failed to update role: {e}")
         await db.rollback()
@@ -327,6 +359,7 @@ async def delete_role(db: AsyncSession, role_id: int):
             if not db_role.is_preset:
                 await db.delete(db_role)
                 await db.commit()
+                await invalidate_tags(f"role_menus:{role_id}")
             else:
                 err_msg = f"Role '{db_role.name}' is preset, cannot be deleted"
                 logger.error(err_msg)
@@ -365,9 +398,10 @@ async def create_menu(db: AsyncSession, menu: schemas.MenuCreate):
         # Find all roles and assign the new menu default action to them
         roles = (await db.exec(select(models.Role))).all()
         for role in roles:
-            default_action = MenuActionEnum.edit if role.name in ['admin', 'superAdmin'] else MenuActionEnum.view
+            default_action = MenuActionEnum.edit if role.name in ADMIN_ROLE_NAMES else MenuActionEnum.view
             role.actions.append(action_objects[default_action])
         await db.commit()
+        await invalidate_tags("role_menus")
 
         return db_menu, None
     except Exception as e:
@@ -402,6 +436,7 @@ async def update_menu(db: AsyncSession, menu_id: int, menu: schemas.MenuUpdate):
             db_menu.super_only = menu.super_only
             await db.commit()
             await db.refresh(db_menu)
+            await invalidate_tags("role_menus")
     except Exception as e:
         logger.error(f"Failed to update menu: {e}")
         await db.rollback()
@@ -442,6 +477,7 @@ async def delete_menu(db: AsyncSession, menu_id) -> tuple[bool, str]:
         # Delete the menu itself
         await db.exec(delete(models.Menu).where(models.Menu.id == menu_id))
         await db.commit()
+        await invalidate_tags("role_menus")
 
         return True, "Menu and related actions deleted successfully"
     except Exception as e:
@@ -450,15 +486,15 @@ async def delete_menu(db: AsyncSession, menu_id) -> tuple[bool, str]:
         return False, f"Failed to delete menu: {str(e)}"
 
 
-async def get_my_menus(db, user):
+async def get_my_menus(db: AsyncSession, principal: Principal):
     """
-    Get the role of current user, and then use get_role_menus to get all menus.
+    Get all menus of the principal's role with get_role_menus.
     """
     try:
-        role = await get_my_role(db, user)
-        if not role:
+        if principal.role_id is None:
+            logger.error(f"No role assigned for user '{principal.username}'")
             return None
-        return await get_role_menus(db, role.id)
+        return await get_role_menus(db, principal.role_id)
     except Exception as e:
         logger.error(f"Failed to get menus for user: {e}")
         return None
@@ -16,3 +16,14 @@ class JWTTokenResponse(SQLModel):
             }
         }
     )
+
+
+class Principal(SQLModel):
+    """
+    The authenticated user of the current request, resolved once by CustomAuthMiddleware.
+    """
+    username: str = Field(..., description="The email of the user as username")
+    user_id: Optional[int] = Field(None, description="The id of the rbac user")
+    role_id: Optional[int] = Field(None, description="The id of the role assigned to the user")
+    role_name: Optional[str] = Field(None, description="The name of the role assigned to the user")
+    is_admin: bool = Field(False, description="Whether any role of the user is an admin role")
@@ -1,29 +1,53 @@
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from typing import Iterator
 from urllib.parse import quote
 
+import httpx
 import jwt
-import requests
-from fastapi import Depends
+from fastapi import Request, status
 from msal import ConfidentialClientApplication
+from sqlalchemy import func, literal, union_all
+from sqlalchemy.dialects.postgresql import insert
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.responses import RedirectResponse
 
-from app.cache.module.base import RedisCache
-from app.cache.session import get_redis_connection_pool
-from app.configs import get_settings
+from app.cache.backend import create_cache
+from app.configs import APP_SETTINGS
+from app.core.audit.models import Audit
 from app.core.audit.service import create_audit_log
 from app.enums import AuditActionEnum
-from app.exceptions import NeedLoginException
+from app.exceptions import NeedLoginException, http_exception
+from app.http_client import OutboundHTTPClient
 from app.log import logger
+from app.utils.checksum import calculate_token_digest
+from app.utils.executor import BoundedExecutor
+from app.utils.singleflight import SingleFlight
 from . import models
-from .auth_cache import RedisTokenCache
-from .rbac import service as rbac_service
-from .rbac.schemas import UserCreate
+from .auth_cache import (CURRENT_TOKEN_CACHE, AsyncRedisTokenCache, RequestScopedTokenCache,
+                         create_token_state_cache)
+from .rbac.constants import SUPER_ADMIN_LIST
+from .schemas import Principal
+from .token_cache import VERIFIED_TOKEN_CACHE, AccessTokenCache
 
 
-async def get_auth_handler(config=Depends(get_settings), redis_conn=Depends(get_redis_connection_pool)):
-    return AuthHandler(config, redis_conn)
+async def get_auth_handler(request: Request) -> "AuthHandler":
+    """
+    Get the process wide AuthHandler created in lifespan.
+    """
+    return request.app.state.auth_handler
+
+
+async def get_current_principal(request: Request) -> Principal:
+    """
+    Get the principal resolved by CustomAuthMiddleware for the current request.
+    """
+    principal = getattr(request.state, 'principal', None)
+    if principal is None:
+        raise http_exception(status_code=status.HTTP_401_UNAUTHORIZED, message="No principal found in request")
+    return principal
 
 
 async def sync_token_to_sac(username: str, token: str, user_id, sac_db: AsyncSession):
@@ -48,27 +72,158 @@ async def sync_token_to_sac(username: str, token: str, user_id, sac_db: AsyncSes
         logger.error(f"Failed to sync token with sac: {e}")
 
 
+def _default_role_name(username: str) -> str:
+    """
+    The role assigned to a user on first login.
+    """
+    return 'superAdmin' if username in SUPER_ADMIN_LIST else 'admin'
+
+
+def _login_statement(username: str, display_name: str, token: str, token_digest: bytes, aad_user_id: str):
+    """
+    One statement writing everything of a login, with data-modifying CTEs:
+    the rbac user and its default role if new, the backend token and the audit log.
+    Returns the user id (NULL if a concurrent login inserted the user meanwhile), the digest of the
+    replaced token and the number of users and role links inserted.
+    """
+    now = datetime.utcnow()
+
+    new_user = (insert(models.RUser)
+                .values(name=display_name, email=username, is_active=True)
+                .on_conflict_do_nothing(index_elements=[models.RUser.email])
+                .returning(models.RUser.id)
+                .cte("new_user"))
+    # the existing user is not visible to the select if it was inserted by the statement itself
+    login_user = (union_all(select(new_user.c.id),
+                            select(models.RUser.id).where(models.RUser.email == username))
+                  .limit(1)
+                  .cte("login_user"))
+    role_id = (select(models.Role.id).where(models.Role.name == _default_role_name(username))
+               .order_by(models.Role.id).limit(1).scalar_subquery())
+    role_link = (insert(models.UserRoleLink)
+                 .from_select(["user_id", "role_id"], select(new_user.c.id, role_id).where(role_id.is_not(None)))
+                 .on_conflict_do_nothing()
+                 .returning(models.UserRoleLink.role_id)
+                 .cte("role_link"))
+    # all CTEs see the same snapshot, this is the digest before the upsert below
+    old_token = (select(models.AuthToken.token_digest)
+                 .where(models.AuthToken.name == username)
+                 .cte("old_token"))
+    token_insert = insert(models.AuthToken).values(name=username, token=token, token_digest=token_digest,
+                                                   aad_user_id=aad_user_id, create_time=now, update_time=now)
+    new_token = (token_insert
+                 .on_conflict_do_update(index_elements=[models.AuthToken.name],
+                                        set_={"token": token_insert.excluded.token,
+                                              "token_digest": token_insert.excluded.token_digest,
+                                              "aad_user_id": token_insert.excluded.aad_user_id,
+                                              "update_time": token_insert.excluded.update_time})
+                 .returning(models.AuthToken.id)
+                 .cte("new_token"))
+    audit = (insert(Audit)
+             .from_select(["username", "user_id", "audit_time", "action", "result", "detail"],
+                          select(literal(username), login_user.c.id, literal(now),
+                                 literal(AuditActionEnum.LOGIN.value), literal("success"),
+                                 literal("login success")))
+             .returning(Audit.id)
+             .cte("audit"))
+    # a CTE is only rendered if referenced, every one of them is part of the result
+    return select(select(login_user.c.id).scalar_subquery().label("user_id"),
+                  select(old_token.c.token_digest).scalar_subquery().label("old_token_digest"),
+                  select(func.count()).select_from(new_user).scalar_subquery().label("users"),
+                  select(func.count()).select_from(role_link).scalar_subquery().label("roles"),
+                  select(new_token.c.id).scalar_subquery().label("token_id"),
+                  select(audit.c.id).scalar_subquery().label("audit_id"))
+
+
+async def save_login(db: AsyncSession, username: str, display_name: str, token: str, aad_user_id: str):
+    """
+    Save the login of a user in one transaction and usually one round trip:
+    create the rbac user with its default role on first login, save the backend token, add the audit log.
+    Return the digest of the replaced token, if any.
+    """
+    token_digest = calculate_token_digest(token)
+    statement = _login_statement(username, display_name, token, token_digest, aad_user_id)
+    row = (await db.exec(statement)).one()
+    if row.user_id is None:
+        # the user was inserted by a concurrent login after our snapshot, it is visible to a new statement
+        await db.rollback()
+        row = (await db.exec(statement)).one()
+        if row.user_id is None:
+            await db.rollback()
+            raise Exception(f"Failed to save the login of {username}")
+    if row.users and not row.roles:
+        await db.rollback()
+        raise Exception(f"Role not found in db by name {_default_role_name(username)}, the rbac data is not seeded")
+    await db.commit()
+    return row.old_token_digest
+
+
 class AuthHandler:
-    def __init__(self, config, redis_conn):
-        self.token_cache = RedisTokenCache(redis_conn, encryption_key=config.ENCRYPTION_KEY)
-        self.app = ConfidentialClientApplication(
-            config.CLIENT_ID,
-            authority=config.AUTHORITY,
-            client_credential=config.CLIENT_SECRET,
-            token_cache=self.token_cache
-        )
-        self.config = config
+    """
+    Created once per process in lifespan and shared by all requests.
+    Per-user msal token cache state is bound to the current request with user_token_cache().
+    Blocking msal calls run in a dedicated bounded executor, so a slow AAD endpoint never blocks the event loop.
+    """
 
-        self.bc = RedisCache(redis_conn, "msal_auth:")
-        self.fc = RedisCache(redis_conn, "msal_auth_flow:", 60 * 10)  # flow cache for 10 minutes
+    def __init__(self, config, redis_conn, async_redis_conn, http_client: OutboundHTTPClient):
+        self.config = config
+        self.redis_conn = redis_conn
+        self.async_redis_conn = async_redis_conn
+        self.http_client = http_client
+        self.token_cache = RequestScopedTokenCache()
+        self._app = None
+        self._app_lock = threading.Lock()
+        self.executor = BoundedExecutor("msal",
+                                        max_workers=config.MSAL_EXECUTOR_MAX_WORKERS,
+                                        max_queue_size=config.MSAL_EXECUTOR_MAX_QUEUE_SIZE,
+                                        timeout=config.MSAL_EXECUTOR_TIMEOUT)
+        self.obo_token_cache = AccessTokenCache(maxsize=config.OBO_TOKEN_CACHE_MAX_SIZE,
+                                                expiry_margin=config.OBO_TOKEN_EXPIRY_MARGIN)
+        self._obo_refresh = SingleFlight()
+
+        self.bc = create_cache(redis_conn, "msal_auth:")
+        self.fc = create_cache(redis_conn, "msal_auth_flow:", 60 * 10)  # flow cache for 10 minutes
+        self.token_state_cache = create_token_state_cache(async_redis_conn)
+
+    @property
+    def app(self) -> ConfidentialClientApplication:
+        # built on first use instead of at startup, the construction fetches authority metadata from AAD
+        # accessed from the executor threads, so the construction is guarded by a lock
+        if self._app is None:
+            with self._app_lock:
+                if self._app is None:
+                    self._app = ConfidentialClientApplication(
+                        self.config.CLIENT_ID,
+                        authority=self.config.AUTHORITY,
+                        client_credential=self.config.CLIENT_SECRET,
+                        token_cache=self.token_cache
+                    )
+        return self._app
+
+    def close(self):
+        self.executor.shutdown()
+
+    @contextmanager
+    def user_token_cache(self, username: str = None) -> Iterator[AsyncRedisTokenCache]:
+        """
+        Bind an AsyncRedisTokenCache of the user to the msal application for the current request.
+        The caller loads and persists the cache state around the msal calls.
+        """
+        token_cache = AsyncRedisTokenCache(self.token_state_cache, encryption_key=self.config.ENCRYPTION_KEY)
+        token_cache.set_user(username)
+        reset_token = CURRENT_TOKEN_CACHE.set(token_cache)
+        try:
+            yield token_cache
+        finally:
+            CURRENT_TOKEN_CACHE.reset(reset_token)
 
     async def login_handler(self, frontend_host: str):
         try:
             self.bc.set('frontend_host', frontend_host)
-            flow = self.app.initiate_auth_code_flow(
+            flow = await self.executor.run(lambda: self.app.initiate_auth_code_flow(
                 scopes=['.default'],
                 redirect_uri=self.config.REDIRECT_URI,
-            )
+            ))
             self.fc.set(flow["state"], flow)
             return RedirectResponse(url=flow["auth_uri"])
         except Exception as e:
@@ -88,10 +243,11 @@ class AuthHandler:
             if flow is None:
                 return RedirectResponse(url=frontend_fail_url, status_code=302)
 
-            result = self.app.acquire_token_by_auth_code_flow(
-                flow,
-                {'code': code, 'state': state}
-            )
+            with self.user_token_cache() as token_cache:
+                result = await self.executor.run(lambda: self.app.acquire_token_by_auth_code_flow(
+                    flow,
+                    {'code': code, 'state': state}
+                ))
             if "error" in result:
                 logger.error(f"Failed to acquire a token: {result}")
                 return RedirectResponse(url=frontend_fail_url, status_code=302)
@@ -101,40 +257,18 @@ class AuthHandler:
                 logger.error("Access token is missing")
                 return RedirectResponse(url=frontend_fail_url, status_code=302)
 
-            user_info = await get_user_info(access_token)
+            user_info = await get_user_info(access_token, self.http_client)
             if user_info:
                 logger.debug(f"User info: {user_info}")
                 username = user_info.get('mail').lower()
                 user_id = user_info.get('id')
                 if username:
-                    self.token_cache.save(username)
-                    # rbac: create or update rbac_user
-                    db_user = (await db.exec(select(models.RUser).where(models.RUser.email == username))).first()
-                    if not db_user:
-                        user = UserCreate(name=user_info.get('displayName'), email=username)
-                        await rbac_service.create_user(db, user)
-                    # rbac end
+                    await token_cache.persist(username)
                     token = await create_jwt_access_token(username, 60 * 60 * 12)
-                    # save token to db
-                    logger.debug(f"save token to db: models.AuthToken")
-                    auth_token = (
-                        await db.exec(select(models.AuthToken).where(models.AuthToken.name == username))).first()
-                    if auth_token:
-                        auth_token.token = token
-                        auth_token.aad_user_id = user_id
-                    else:
-                        new_auth_token = models.AuthToken(
-                            name=username,
-                            token=token,
-                            aad_user_id=user_id,
-                        )
-                        db.add(new_auth_token)
-
-                    # audit log
-                    await create_audit_log(db, username, AuditActionEnum.LOGIN, "success", "login success")
-
-                    await db.commit()
-
+                    # rbac user, token and audit log in one statement
+                    old_token_digest = await save_login(db, username, user_info.get('displayName'), token, user_id)
+                    if old_token_digest:
+                        await VERIFIED_TOKEN_CACHE.evict(old_token_digest)
                 else:
                     logger.error("Username is missing")
                     return RedirectResponse(url=frontend_fail_url, status_code=302)
@@ -156,47 +290,70 @@ class AuthHandler:
             # remove token from db
             auth_token = (await db.exec(select(models.AuthToken).where(models.AuthToken.name == username))).first()
             if auth_token:
+                token_digest = auth_token.token_digest
                 await db.delete(auth_token)
-                self.token_cache.delete(username)
+                token_cache = AsyncRedisTokenCache(self.token_state_cache, encryption_key=self.config.ENCRYPTION_KEY)
+                await token_cache.delete(username)
                 await db.commit()
+                # after the commit, a concurrent request could otherwise cache the token again before it is deleted
+                await VERIFIED_TOKEN_CACHE.evict(token_digest)
+                self.obo_token_cache.evict_user(username)
                 # audit log
-                await create_audit_log(db, username, AuditActionEnum.LOGOUT, "success", "logout success")
+                await create_audit_log(username, AuditActionEnum.LOGOUT, "success", "logout success")
                 return True
             else:
                 raise Exception(f"Failed to logout: token not found for user {username}")
         except Exception as e:
             await db.rollback()
             msg = f"Failed to logout: {str(e)}"
-            await create_audit_log(db, username, AuditActionEnum.LOGOUT, "failure", msg)
+            await create_audit_log(username, AuditActionEnum.LOGOUT, "failure", msg)
             logger.error(msg)
             return False
 
-    def get_access_token_obo(self, username: str, scopes: list) -> str or None:
+    async def get_access_token_obo(self, username: str, scopes: list) -> str or None:
+        """
+        Get an access token of the user for the scopes, served from the in-process cache while it is fresh.
+        Concurrent cache misses of the same user and scopes share one msal refresh.
+        """
+        access_token = self.obo_token_cache.get(username, scopes)
+        if access_token:
+            return access_token
+        return await self._obo_refresh.do(self.obo_token_cache.key(username, scopes),
+                                          lambda: self._acquire_token_obo(username, scopes))
+
+    async def _acquire_token_obo(self, username: str, scopes: list) -> str:
         logger.debug(f"get_access_token_obo: {username}")
-        self.token_cache.set_user(username)
-        self.token_cache.load()
-        accounts = self.app.get_accounts()
-        if not accounts:
-            logger.debug(f"get_access_token_obo: no cache found for user: {username}")
-            raise NeedLoginException(detail=f"Need login user: {username}")
-
-        logger.debug("accounts found")
-        result = self.app.acquire_token_silent(scopes, account=accounts[0])
+        with self.user_token_cache(username) as token_cache:
+            await token_cache.load()
+            accounts = await self.executor.run(lambda: self.app.get_accounts())
+            if not accounts:
+                logger.debug(f"get_access_token_obo: no cache found for user: {username}")
+                raise NeedLoginException(detail=f"Need login user: {username}")
+
+            logger.debug("accounts found")
+            result = await self.executor.run(lambda: self.app.acquire_token_silent(scopes, account=accounts[0]))
+            # acquire_token_silent may have refreshed the tokens with the refresh token
+            await token_cache.persist()
         if result and "access_token" in result:
+            self.obo_token_cache.set(username, scopes, result['access_token'], result.get('expires_in', 0))
             return result['access_token']
         else:
             raise NeedLoginException(detail=f"Need login user: {username}")
 
 
-async def get_user_info(access_token) -> dict or None:
+async def get_user_info(access_token, http_client: OutboundHTTPClient) -> dict or None:
     """
     Get user info from Microsoft Graph API
     """
-    graph_api_url = 'https://graph.microsoft.com/v1.0/me'
+    graph_api_url = f'{APP_SETTINGS.GRAPH_API_URL}/me'
     headers = {
         'Authorization': f'Bearer {access_token}',
     }
-    response = requests.get(graph_api_url, headers=headers)
+    try:
+        response = await http_client.get(graph_api_url, headers=headers)
+    except httpx.HTTPError as e:
+        logger.error(f'Failed to get user info: {e!r}')
+        return None
     if response.status_code == 200:
         user_info = response.json()
         return user_info
@@ -219,8 +376,8 @@ async def get_jwt_access_token(username: str, db: AsyncSession) -> str or None:
     """
     try:
         logger.debug(f'Get access token for user {username}')
-        auth_token = (await db.exec(select(models.AuthToken).where(models.AuthToken.name == username))).first()
-        return auth_token.token if auth_token else None
+        # name is unique indexed, only fetch the token column instead of the whole row
+        return (await db.exec(select(models.AuthToken.token).where(models.AuthToken.name == username))).first()
     except Exception as e:
         logger.error(f'Failed to get access token for user {username}: {e}')
         return None
@@ -0,0 +1,149 @@
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+from cachetools import TLRUCache
+
+from app.cache.module.tiered import CacheInvalidationBus
+from app.configs import APP_SETTINGS
+
+from .schemas import Principal
+
+
+@dataclass(frozen=True)
+class VerifiedToken:
+    payload: dict  # decoded jwt payload
+    # the user and roles owning the token, None if the token is not stored in db
+    principal: Optional[Principal] = None
+
+    @property
+    def exists(self) -> bool:
+        return self.principal is not None
+
+
+class VerifiedTokenCache:
+    """
+    Bounded in-process LRU cache of verified jwt tokens, keyed by token digest
+    (see calculate_token_digest), with the principal resolved from db, so an authenticated request
+    costs no query while it is cached. An entry never outlives the jwt `exp`, and tokens not found
+    in db are kept for a shorter time.
+
+    Evictions (logout, role or user changes) are broadcast to the other workers by the
+    CacheInvalidationBus configured in lifespan, all entries are dropped when the bus reconnects,
+    since evictions may have been missed meanwhile. An entry resolved before an eviction is not
+    cached (see generation).
+    """
+    prefix = "verified_token:"
+
+    def __init__(self, maxsize: int, ttl: int, negative_ttl: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.invalidation_bus: Optional[CacheInvalidationBus] = None
+        self.generation = 0  # bumped by every eviction
+        self._cache = TLRUCache(maxsize=maxsize, ttu=self._ttu, timer=time.time)
+
+    def configure(self, invalidation_bus: Optional[CacheInvalidationBus]):
+        self.invalidation_bus = invalidation_bus
+        if invalidation_bus is not None:
+            invalidation_bus.register(self)
+
+    def _ttu(self, key: bytes, value: VerifiedToken, now: float) -> float:
+        expire_at = now + (self.ttl if value.exists else self.negative_ttl)
+        exp = value.payload.get('exp')
+        if isinstance(exp, (int, float)):
+            expire_at = min(expire_at, exp)
+        return expire_at
+
+    def get(self, digest: bytes) -> Optional[VerifiedToken]:
+        return self._cache.get(digest)
+
+    def set(self, digest: bytes, payload: dict, principal: Optional[Principal],
+            generation: Optional[int] = None) -> VerifiedToken:
+        """
+        Cache the verified token, unless something was evicted since `generation` was read
+        (the principal may have been resolved before the change).
+        """
+        verified = VerifiedToken(payload=payload, principal=principal)
+        if generation is None or generation == self.generation:
+            self._cache[digest] = verified
+        return verified
+
+    def invalidate_local(self, key: Optional[str] = None):
+        """
+        Evict a token ("digest:<hex>"), the tokens of a user ("user:<username>") or all tokens
+        (None) of this worker, called by the CacheInvalidationBus for the evictions of the other
+        workers.
+        """
+        self.generation += 1
+        if key is None:
+            self._cache.clear()
+        elif key.startswith("digest:"):
+            self._cache.pop(bytes.fromhex(key[len("digest:"):]), None)
+        elif key.startswith("user:"):
+            username = key[len("user:"):]
+            for digest, verified in list(self._cache.items()):
+                if verified.payload.get('user_id') == username:
+                    self._cache.pop(digest, None)
+
+    async def _evict(self, key: str):
+        self.invalidate_local(key)
+        if self.invalidation_bus is not None:
+            await self.invalidation_bus.publish(self.prefix, key)
+
+    async def evict(self, digest: bytes):
+        await self._evict(f"digest:{digest.hex()}")
+
+    async def evict_user(self, username: str):
+        """
+        Evict all tokens of a user on every worker, when the user or its roles change.
+        """
+        await self._evict(f"user:{username}")
+
+    def clear(self):
+        self._cache.clear()
+
+
+@dataclass(frozen=True)
+class CachedAccessToken:
+    access_token: str
+    expires_at: float  # unix timestamp
+
+
+class AccessTokenCache:
+    """
+    Bounded in-process LRU cache of msal access tokens, keyed by username and scopes.
+    An entry is dropped `expiry_margin` seconds before the access token expires,
+    so a returned token always has at least that much lifetime left.
+    """
+
+    def __init__(self, maxsize: int, expiry_margin: int):
+        self.expiry_margin = expiry_margin
+        self._cache = TLRUCache(maxsize=maxsize, ttu=self._ttu, timer=time.time)
+
+    def _ttu(self, key: Tuple[str, Tuple[str, ...]], value: CachedAccessToken, now: float) -> float:
+        return value.expires_at - self.expiry_margin
+
+    @staticmethod
+    def key(username: str, scopes: Iterable[str]) -> Tuple[str, Tuple[str, ...]]:
+        return username, tuple(sorted(set(scopes)))
+
+    def get(self, username: str, scopes: Iterable[str]) -> Optional[str]:
+        cached = self._cache.get(self.key(username, scopes))
+        return cached.access_token if cached else None
+
+    def set(self, username: str, scopes: Iterable[str], access_token: str, expires_in: float):
+        self._cache[self.key(username, scopes)] = CachedAccessToken(
+            access_token=access_token, expires_at=time.time() + expires_in)
+
+    def evict_user(self, username: str):
+        for key in list(self._cache.keys()):
+            if key[0] == username:
+                self._cache.pop(key, None)
+
+    def clear(self):
+        self._cache.clear()
+
+
+VERIFIED_TOKEN_CACHE = VerifiedTokenCache(maxsize=APP_SETTINGS.AUTH_TOKEN_CACHE_MAX_SIZE,
+                                          ttl=APP_SETTINGS.AUTH_TOKEN_CACHE_TTL,
+                                          negative_ttl=APP_SETTINGS.AUTH_TOKEN_CACHE_NEGATIVE_TTL)
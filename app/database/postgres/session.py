@@ -4,6 +4,7 @@ from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.configs import APP_SETTINGS
+from app.core.audit.partitions import ensure_audit_partitions
 from .products_seed import init_products_data
 from .seed import init_rbac_data
 
@@ -35,6 +36,7 @@ class AsyncDatabaseSession:
 async def init_db():
     async with ENGINE.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        await ensure_audit_partitions(conn)
     async with AsyncDatabaseSession() as session:
         await init_rbac_data(db_session=session)
         await init_products_data(db_session=session)
@@ -22,6 +22,13 @@ class AlertStatusEnum(str, Enum):
         return ",".join([f"{item.value}" for item in cls])
 
 
+class CountStrategyEnum(str, Enum):
+    EXACT = "exact"  # COUNT(*) of the filtered query
+    ESTIMATED = "estimated"  # row estimate of the planner
+    CACHED = "cached"  # exact count, cached for SERVICE_CACHE_COUNT_TTL seconds
+    NONE = "none"  # not counted, see has_more
+
+
 class HTTP_RESPONSE_CODE(Enum):
     # HTTP Response Code
     # confirm with frontend, they need a code to capture the error
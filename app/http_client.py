@@ -0,0 +1,67 @@
+import asyncio
+
+import httpx
+from fastapi import Request
+
+from app.configs import APP_SETTINGS
+
+
+class OutboundHTTPClient:
+    """
+    App wide async http client for outbound integrations, created in lifespan and closed at shutdown.
+    Connections are pooled and kept alive, every request has connect/read timeouts,
+    and the number of in-flight requests is bounded by max_concurrency.
+    """
+
+    def __init__(self,
+                 connect_timeout: float,
+                 read_timeout: float,
+                 write_timeout: float,
+                 pool_timeout: float,
+                 max_connections: int,
+                 max_keepalive_connections: int,
+                 keepalive_expiry: float,
+                 max_concurrency: int,
+                 transport: httpx.AsyncBaseTransport = None):
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(connect=connect_timeout,
+                                  read=read_timeout,
+                                  write=write_timeout,
+                                  pool=pool_timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections,
+                                keepalive_expiry=keepalive_expiry),
+            transport=transport,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        async with self._semaphore:
+            return await self._client.request(method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+def create_http_client() -> OutboundHTTPClient:
+    return OutboundHTTPClient(connect_timeout=APP_SETTINGS.HTTP_CLIENT_CONNECT_TIMEOUT,
+                              read_timeout=APP_SETTINGS.HTTP_CLIENT_READ_TIMEOUT,
+                              write_timeout=APP_SETTINGS.HTTP_CLIENT_WRITE_TIMEOUT,
+                              pool_timeout=APP_SETTINGS.HTTP_CLIENT_POOL_TIMEOUT,
+                              max_connections=APP_SETTINGS.HTTP_CLIENT_MAX_CONNECTIONS,
+                              max_keepalive_connections=APP_SETTINGS.HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+                              keepalive_expiry=APP_SETTINGS.HTTP_CLIENT_KEEPALIVE_EXPIRY,
+                              max_concurrency=APP_SETTINGS.HTTP_CLIENT_MAX_CONCURRENCY)
+
+
+async def get_http_client(request: Request) -> OutboundHTTPClient:
+    """
+    Get the app wide OutboundHTTPClient created in lifespan.
+    """
+    return request.app.state.http_client
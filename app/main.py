@@ -17,23 +17,86 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.apis import api_router
+from app.cache.backend import memory_backend
+from app.cache.decorators import SERVICE_CACHE
+from app.cache.metrics import REDIS_POOL_COLLECTOR
+from app.cache.module.tiered import CacheInvalidationBus
+from app.cache.module.tracking import ClientTracking
+from app.cache.session import (create_async_redis_connection,
+                               create_redis_connection,
+                               stop_iam_credential_provider)
 from app.configs import APP_SETTINGS
-from app.database.postgres.session import init_db
+from app.core.audit.partitions import AuditPartitionMaintenance
+from app.core.audit.sink import AUDIT_SINK
+from app.core.auth.service import AuthHandler
+from app.core.auth.token_cache import VERIFIED_TOKEN_CACHE
+from app.database.postgres.session import ENGINE, init_db
 from app.exceptions import (NeedLoginException,
                             need_login_exception_handler,
                             validate_exception_handler,
                             endpoint_not_found_exception_handler)
+from app.http_client import create_http_client
 from app.middlewares import CustomAuthMiddleware
 from app.otel import OTELInstrumentInitializer
 
 log = logging.getLogger(__name__)
 
 
+async def start_redis(app: FastAPI):
+    # one sync and one async redis client per process, shared by all requests
+    app.state.redis = create_redis_connection()
+    app.state.async_redis = await create_async_redis_connection()
+    REDIS_POOL_COLLECTOR.track("sync", app.state.redis)
+    REDIS_POOL_COLLECTOR.track("async", app.state.async_redis)
+    # broadcast invalidations of the in-process tier of TieredAsyncRedisCache to the other workers
+    app.state.cache_invalidation_bus = CacheInvalidationBus(app.state.async_redis)
+    app.state.cache_invalidation_bus.start()
+    if APP_SETTINGS.CACHE_CLIENT_TRACKING_ENABLED:
+        app.state.client_tracking = ClientTracking(app.state.async_redis,
+                                                   health_check_interval=APP_SETTINGS.REDIS_HEALTH_CHECK_INTERVAL)
+        app.state.client_tracking.start()
+
+
+async def stop_redis(app: FastAPI):
+    await app.state.cache_invalidation_bus.stop()
+    if app.state.client_tracking is not None:
+        await app.state.client_tracking.stop()
+    REDIS_POOL_COLLECTOR.untrack("sync")
+    REDIS_POOL_COLLECTOR.untrack("async")
+    app.state.redis.close()
+    await app.state.async_redis.aclose()
+    stop_iam_credential_provider()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     instrumentator.expose(app)
     await init_db()
+    AUDIT_SINK.start()
+    app.state.audit_partition_maintenance = AuditPartitionMaintenance(ENGINE)
+    app.state.audit_partition_maintenance.start()
+
+    app.state.http_client = create_http_client()
+    app.state.redis = app.state.async_redis = None
+    app.state.cache_invalidation_bus = app.state.client_tracking = None
+    # without redis (CACHE_BACKEND=memory) the caches are kept in process
+    if not memory_backend():
+        await start_redis(app)
+    SERVICE_CACHE.configure(app.state.async_redis, app.state.cache_invalidation_bus, app.state.client_tracking)
+    VERIFIED_TOKEN_CACHE.configure(app.state.cache_invalidation_bus)
+    app.state.auth_handler = AuthHandler(APP_SETTINGS,
+                                         app.state.redis,
+                                         app.state.async_redis,
+                                         app.state.http_client)
     yield
+    app.state.auth_handler.close()
+    SERVICE_CACHE.reset()
+    VERIFIED_TOKEN_CACHE.configure(None)
+    if not memory_backend():
+        await stop_redis(app)
+    await app.state.http_client.aclose()
+    await AUDIT_SINK.stop()
+    await app.state.audit_partition_maintenance.stop()
 
 
 app = FastAPI(
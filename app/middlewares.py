@@ -1,52 +1,105 @@
-from typing import List
+from typing import List, Optional, Union
 
 from fastapi import Response, status
 from sqlmodel import select
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from app.core.auth import models
+from app.core.auth.rbac.constants import ADMIN_ROLE_NAMES
+from app.core.auth.schemas import Principal
 from app.core.auth.service import decode_jwt_access_token
+from app.core.auth.token_cache import VERIFIED_TOKEN_CACHE
 from app.database.postgres.session import ASYNC_SESSION
 from app.log import logger
+from app.utils.checksum import calculate_token_digest
 
 
-class CustomAuthMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, whitelist: List[str]):
-        super().__init__(app)
+class CustomAuthMiddleware:
+    """
+    Pure ASGI middleware, receive and send channels are passed through to the app untouched,
+    so streaming responses are not buffered and no extra task is spawned per request.
+    """
+
+    def __init__(self, app: ASGIApp, whitelist: List[str]):
+        self.app = app
         self.whitelist = whitelist
 
-    async def dispatch(self, request, call_next):
-        if request.url.path in self.whitelist:
-            pass
-        else:
-            user = request.headers.get('user')
-            token = request.headers.get('Authorization')
-            if token is None or len(token) == 0:
-                logger.info('Authorization token is None')
-                return Response(status_code=status.HTTP_403_FORBIDDEN, content='Invalid token')
-            else:
-                try:
-                    payload = await decode_jwt_access_token(token)
-                    if payload is None:
-                        return Response(status_code=status.HTTP_403_FORBIDDEN,
-                                        content='Invalid token: decode failed')
-                except Exception as err:
-                    logger.info(f"Invalid token: {err}")
-                    return Response(status_code=status.HTTP_403_FORBIDDEN, content='Invalid token')
-
-                username: str = payload.get("user_id")
-
-                if user != username:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in self.whitelist:
+            await self.app(scope, receive, send)
+            return
+
+        result = await self.authenticate(Headers(scope=scope))
+        if isinstance(result, Response):
+            await result(scope, receive, send)
+            return
+
+        # share the principal with admin_required and get_current_principal through request.state
+        scope.setdefault("state", {})["principal"] = result
+        await self.app(scope, receive, send)
+
+    async def authenticate(self, headers: Headers) -> Union[Principal, Response]:
+        """
+        Check the user and Authorization headers, return the principal of the request,
+        or a forbidden response if the request is rejected.
+        """
+        user = headers.get('user')
+        token = headers.get('Authorization')
+        if token is None or len(token) == 0:
+            logger.info('Authorization token is None')
+            return Response(status_code=status.HTTP_403_FORBIDDEN, content='Invalid token')
+
+        digest = calculate_token_digest(token)
+        verified = VERIFIED_TOKEN_CACHE.get(digest)
+        if verified is None:
+            try:
+                payload = await decode_jwt_access_token(token)
+                if payload is None:
                     return Response(status_code=status.HTTP_403_FORBIDDEN,
-                                    content='Invalid token: username not match')
+                                    content='Invalid token: decode failed')
+            except Exception as err:
+                logger.info(f"Invalid token: {err}")
+                return Response(status_code=status.HTTP_403_FORBIDDEN, content='Invalid token')
+
+            if user != payload.get("user_id"):
+                return Response(status_code=status.HTTP_403_FORBIDDEN,
+                                content='Invalid token: username not match')
+
+            # read before the query, an eviction made meanwhile prevents caching a stale principal
+            generation = VERIFIED_TOKEN_CACHE.generation
+            principal = await self.resolve_principal(digest, user)
+            verified = VERIFIED_TOKEN_CACHE.set(digest, payload, principal, generation)
+        elif user != verified.payload.get("user_id"):
+            return Response(status_code=status.HTTP_403_FORBIDDEN,
+                            content='Invalid token: username not match')
+
+        # in the future, we may add app permission control, then we need to check username and app value...
 
-                # in the future, we may add app permission control, then we need to check username and app value...
+        # logouts and role changes evict the cached token on every worker (see VerifiedTokenCache)
+        if not verified.exists:
+            return Response(status_code=status.HTTP_403_FORBIDDEN,
+                            content='Invalid token: token not found in db')
 
-                async with ASYNC_SESSION() as db:
-                    token = (await db.exec(select(models.AuthToken).where(models.AuthToken.token == token))).first()
+        return verified.principal
 
-                    if token is None:
-                        return Response(status_code=status.HTTP_403_FORBIDDEN,
-                                        content='Invalid token: token not found in db')
+    @staticmethod
+    async def resolve_principal(digest: bytes, username: str) -> Optional[Principal]:
+        """
+        Load the token, its user and roles in one query, return None if the token is not found in db.
+        A user with several roles gets the one with the lowest id, and is admin if any role is.
+        """
+        query = (select(models.AuthToken.id, models.RUser.id, models.Role.id, models.Role.name)
+                 .outerjoin(models.RUser, models.RUser.email == models.AuthToken.name)
+                 .outerjoin(models.UserRoleLink, models.UserRoleLink.user_id == models.RUser.id)
+                 .outerjoin(models.Role, models.Role.id == models.UserRoleLink.role_id)
+                 .where(models.AuthToken.token_digest == digest)
+                 .order_by(models.Role.id))
+        async with ASYNC_SESSION() as db:
+            rows = (await db.exec(query)).all()
 
-        return await call_next(request)
+        if not rows:
+            return None
+        _, user_id, role_id, role_name = rows[0]
+        return Principal(username=username, user_id=user_id, role_id=role_id, role_name=role_name,
+                         is_admin=any(row[3] in ADMIN_ROLE_NAMES for row in rows))
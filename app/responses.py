@@ -1,20 +1,56 @@
+import base64
+import json
 from typing import TypeVar, Generic, Optional
 
 from fastapi import Query
+from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field, ConfigDict
 
+from app.enums import CountStrategyEnum
+
 DataType = TypeVar("DataType")
 
 
+def encode_cursor(value, id: int) -> str:
+    """
+    Encode the sort key and id of the last item of a page in an opaque cursor.
+    """
+    payload = json.dumps([value, id], default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return [value, int(id)]
+    except Exception:
+        # a validation error of the query parameter (422), a plain HTTPException would be reported as 404
+        raise RequestValidationError([{"type": "value_error", "loc": ("query", "cursor"),
+                                       "msg": "Invalid cursor", "input": cursor}])
+
+
 class PaginatedParams:
-    def __init__(self, page: int = Query(1, ge=1), size: int = Query(50, ge=0)):
+    def __init__(self, page: int = Query(1, ge=1), size: int = Query(50, ge=0),
+                 cursor: Optional[str] = Query(None, description="Opt in to cursor pagination: empty for the "
+                                                                 "first page, then the next_cursor of the "
+                                                                 "previous page. page is ignored"),
+                 count: CountStrategyEnum = Query(CountStrategyEnum.EXACT,
+                                                  description="How the total is counted: exact, estimated by "
+                                                              "the planner, cached for a few seconds, or none "
+                                                              "(total is null, see has_more)")):
         self.limit = size
+        self.count = count
         self.offset = (page - 1) * size
+        # None: page/size with offset, []: first page of cursor pagination, otherwise [sort key, id] to seek after
+        self.cursor = None if cursor is None else decode_cursor(cursor) if cursor else []
 
 
 class PaginationData(BaseModel, Generic[DataType]):
-    total: int = Field(0, description="The total number of items")
+    total: Optional[int] = Field(0, description="The total number of items, null if not counted")
     items: list[DataType] = Field([], description="The items in the current page")
+    has_more: bool = Field(False, description="Whether there are more items after the current page")
+    next_cursor: Optional[str] = Field(None, description="The cursor of the next page with cursor pagination, "
+                                                         "null on the last page")
 
 
 class GeneralResponse(BaseModel, Generic[DataType]):
@@ -1,5 +1,10 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
 from fastapi import Query
-from sqlalchemy import asc, desc
+from sqlalchemy import DateTime, asc, desc, tuple_
+
+from app.responses import encode_cursor
 
 
 class SortingParams:
@@ -20,3 +25,34 @@ class SortingParams:
             else:
                 query = query.order_by(asc(sort_field))
         return query
+
+    def _sort_key(self, model) -> str:
+        return self.sort_by if hasattr(model, self.sort_by) else "id"
+
+    def apply_cursor(self, query, model, cursor: list, limit: int):
+        """
+        Apply keyset pagination: sort by (sort field, id) and seek after the [sort key, id] of the cursor,
+        so every page is read from the index like the first one. Fetches one more row to know if there is
+        a next page, see page().
+        """
+        sort_field = getattr(model, self._sort_key(model))
+        direction = desc if self.order == "desc" else asc
+        key = (model.id,) if sort_field is model.id else (sort_field, model.id)
+        if cursor:
+            value, id = cursor
+            if value is not None and isinstance(sort_field.type, DateTime):
+                value = datetime.fromisoformat(value)
+            after = (id,) if len(key) == 1 else (value, id)
+            query = query.where(tuple_(*key) < tuple_(*after) if self.order == "desc"
+                                else tuple_(*key) > tuple_(*after))
+        return query.order_by(*(direction(column) for column in key)).limit(limit + 1)
+
+    def page(self, rows: List, model, limit: int) -> Tuple[List, Optional[str]]:
+        """
+        Split the rows fetched with apply_cursor() in the page and the cursor of the next page.
+        """
+        if len(rows) <= limit or not limit:
+            return rows[:limit], None
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, encode_cursor(getattr(last, self._sort_key(model)), last.id)
@@ -3,8 +3,10 @@ import os
 from datetime import datetime
 
 import pytest
+import redis.asyncio as aioredis
 from httpx import AsyncClient, ASGITransport
 
+from app.configs import APP_SETTINGS
 from app.database.postgres.session import AsyncDatabaseSession, get_session
 from app.main import app
 from .constants import BASE_API_PREFIX
@@ -64,3 +66,16 @@ async def client(base_client):
     })
 
     yield base_client
+
+
+# Use a local redis, tests depending on it are skipped if it is not available
+@pytest.fixture
+async def async_redis():
+    redis_conn = aioredis.from_url(APP_SETTINGS.REDIS_URI, socket_connect_timeout=5)
+    try:
+        await redis_conn.ping()
+    except (aioredis.ConnectionError, aioredis.TimeoutError, OSError):
+        await redis_conn.aclose()
+        pytest.skip(f"redis is not available at {APP_SETTINGS.REDIS_URI}")
+    yield redis_conn
+    await redis_conn.aclose()
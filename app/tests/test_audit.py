@@ -0,0 +1,186 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.exceptions import RequestValidationError
+from sqlalchemy import text
+from sqlmodel import select
+
+from app.cache.decorators import SERVICE_CACHE
+from app.core.audit import service
+from app.core.audit.models import Audit
+from app.core.audit.partitions import apply_audit_retention, ensure_audit_partitions, get_partitions
+from app.core.audit.sink import AuditSink
+from app.core.auth import models
+from app.database.postgres.session import AsyncDatabaseSession
+from app.enums import CountStrategyEnum
+from app.responses import PaginatedParams
+from app.sorting import SortingParams
+
+from .constants import BASE_API_PREFIX
+
+
+@pytest.fixture
+async def username(test_db_session):
+    username = f"test_audit_{uuid.uuid4().hex[:8]}@gmail.com"
+    test_db_session.add(models.RUser(name="Test Audit", email=username))
+    await test_db_session.commit()
+    return username
+
+
+async def get_audit_logs(username: str):
+    async with AsyncDatabaseSession() as db:
+        return (await db.exec(select(Audit).where(Audit.username == username).order_by(Audit.id))).all()
+
+
+@pytest.mark.anyio
+async def test_audit_sink_batches(username, monkeypatch):
+    sink = AuditSink(batch_size=3, flush_interval=0.2)
+    batches = []
+    write = sink._write
+
+    async def count_batches(events):
+        batches.append(len(events))
+        await write(events)
+
+    monkeypatch.setattr(sink, "_write", count_batches)
+    sink.start()
+    for i in range(4):
+        await sink.record(username, "login", "success", f"login {i}")
+    await sink.record("unknown@gmail.com", "login", "success", "dropped")
+    await sink.flush()
+    assert batches == [3, 2]
+    audit_logs = await get_audit_logs(username)
+    assert [log.detail for log in audit_logs] == [f"login {i}" for i in range(4)]
+
+    await sink.record(username, "logout", "success", "flushed on stop")
+    await sink.stop()
+    assert (await get_audit_logs(username))[-1].detail == "flushed on stop"
+
+
+@pytest.mark.anyio
+async def test_audit_sink_sync(username):
+    sink = AuditSink(sync=True)
+    sink.start()
+    await sink.record(username, "logout", "success", "logout success")
+    assert [log.action for log in await get_audit_logs(username)] == ["logout"]
+    await sink.stop()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("sort_by,order", [("id", "asc"), ("audit_time", "desc"), ("action", "asc")])
+async def test_get_audit_logs_cursor(test_db_session, username, sort_by, order):
+    audit_time = datetime.utcnow()
+    for i in range(5):
+        # audit_time and action are not unique, the id breaks the ties
+        test_db_session.add(Audit(username=username, user_id=1, audit_time=audit_time + timedelta(seconds=i // 2),
+                                  action=f"action{i % 2}", result="success", detail=f"detail {i}"))
+    await test_db_session.commit()
+    s = SortingParams(sort_by=sort_by, order=order)
+    filters = {"username": username}
+    audit_logs = await get_audit_logs(username)
+    expected = sorted(audit_logs, key=lambda log: (getattr(log, sort_by), log.id), reverse=order == "desc")
+
+    ids, cursor = [], ""
+    for _ in range(3):
+        data = await service.get_audit_logs(test_db_session, PaginatedParams(page=1, size=2, cursor=cursor), s, filters)
+        ids += [item["id"] for item in data.items]
+        cursor = data.next_cursor
+    assert cursor is None
+    assert ids == [log.id for log in expected]
+    assert len(ids) == 5
+
+
+@pytest.mark.anyio
+async def test_get_audit_logs_count_strategy(test_db_session, username):
+    for i in range(5):
+        test_db_session.add(Audit(username=username, user_id=1, action="login", result="success", detail=f"{i}"))
+    await test_db_session.commit()
+    s = SortingParams(sort_by="id", order="asc")
+
+    async def get_page(count: CountStrategyEnum, page: int = 1):
+        p = PaginatedParams(page=page, size=2, cursor=None, count=count)
+        return await service.get_audit_logs(test_db_session, p, s, {"username": username})
+
+    data = await get_page(CountStrategyEnum.EXACT)
+    assert (data.total, data.has_more) == (5, True)
+    assert (await get_page(CountStrategyEnum.EXACT, page=3)).has_more is False
+    assert (await get_page(CountStrategyEnum.ESTIMATED)).total >= 1
+    data = await get_page(CountStrategyEnum.NONE)
+    assert (data.total, data.has_more, len(data.items)) == (None, True, 2)
+
+    SERVICE_CACHE.configure(None)  # memory backend
+    try:
+        assert (await get_page(CountStrategyEnum.CACHED)).total == 5
+        test_db_session.add(Audit(username=username, user_id=1, action="login", result="success", detail="5"))
+        await test_db_session.commit()
+        assert (await get_page(CountStrategyEnum.CACHED)).total == 5
+        assert (await get_page(CountStrategyEnum.EXACT)).total == 6
+    finally:
+        SERVICE_CACHE.reset()
+
+
+@pytest.mark.anyio
+async def test_get_audit_logs_time_and_search_filters(test_db_session, username):
+    now = datetime.utcnow()
+    details = ["login success", "logout success", "Failed to logout: token not found for user"]
+    for i, detail in enumerate(details):
+        test_db_session.add(Audit(username=username, user_id=1, audit_time=now - timedelta(hours=i), action="login",
+                                  result="success", detail=detail))
+    await test_db_session.commit()
+
+    async def get_details(**filters):
+        p = PaginatedParams(page=1, size=10, cursor=None, count=CountStrategyEnum.EXACT)
+        data = await service.get_audit_logs(test_db_session, p, SortingParams(sort_by="id", order="asc"),
+                                            {"username": username, **filters})
+        assert data.total == len(data.items)
+        return [item["detail"] for item in data.items]
+
+    assert await get_details(start=now - timedelta(minutes=90)) == details[:2]
+    assert await get_details(start=now - timedelta(hours=3), end=now - timedelta(minutes=30)) == details[1:]
+    assert await get_details(q="logout") == details[1:]
+    assert await get_details(q="logout -success") == details[2:]
+    assert await get_details(q='"token not found"', start=now - timedelta(hours=3)) == details[2:]
+    assert await get_details(q="nothing") == []
+
+
+@pytest.mark.anyio
+async def test_audit_partitions(test_db_session, username):
+    conn = await test_db_session.connection()
+    # months long gone, out of the range of the partitions of the other tests
+    created = await ensure_audit_partitions(conn, now=datetime(2000, 1, 15), months_ahead=2)
+    assert created == ["audit_logs_p200001", "audit_logs_p200002", "audit_logs_p200003"]
+    assert await ensure_audit_partitions(conn, now=datetime(2000, 1, 15), months_ahead=2) == []
+
+    test_db_session.add(Audit(username=username, user_id=1, audit_time=datetime(2000, 2, 10), action="login",
+                              result="success", detail="partitioned"))
+    await test_db_session.flush()
+    assert (await conn.execute(text("SELECT tableoid::regclass::text FROM audit_logs WHERE username = :username"),
+                               {"username": username})).scalar() == "audit_logs_p200002"
+
+    detached = await apply_audit_retention(conn, now=datetime(2001, 3, 1), retention_months=12, drop=False)
+    assert detached == ["audit_logs_p200001", "audit_logs_p200002"]
+    assert "audit_logs_p200003" in await get_partitions(conn)
+    assert (await conn.execute(text("SELECT count(*) FROM audit_logs WHERE username = :username"),
+                               {"username": username})).scalar() == 0
+    # a detached partition is kept as a plain table
+    assert (await conn.execute(text("SELECT count(*) FROM audit_logs_p200002"))).scalar() == 1
+
+    assert await apply_audit_retention(conn, now=datetime(2001, 4, 1), retention_months=12,
+                                       drop=True) == ["audit_logs_p200003"]
+    await conn.execute(text("DROP TABLE audit_logs_p200001, audit_logs_p200002"))
+    await test_db_session.commit()
+
+
+def test_invalid_cursor():
+    with pytest.raises(RequestValidationError) as e:
+        PaginatedParams(page=1, size=2, cursor="not a cursor")
+    assert e.value.errors()[0]["loc"] == ("query", "cursor")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/audit/audit_logs", "/auth/users"])
+async def test_invalid_cursor_response(client, path):
+    response = await client.get(f"{BASE_API_PREFIX}{path}", params={"cursor": "not a cursor"})
+    assert response.status_code == 422
+    assert response.json()["code"] == 10000422
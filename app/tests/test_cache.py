@@ -0,0 +1,584 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+import redis
+import redis.asyncio as aioredis
+from prometheus_client import REGISTRY
+from redis.asyncio.cluster import ClusterNode
+from redis.crc import key_slot
+from redis.credentials import CredentialProvider
+from sqlalchemy import literal
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.cache.circuit_breaker import (CLOSED, HALF_OPEN, OPEN, AsyncBlockingConnectionPool, AsyncCircuitBreakerRedis,
+                                      BlockingConnectionPool, CircuitBreaker, CircuitBreakerRedis, CircuitOpenError,
+                                      PoolExhaustedError)
+from app.cache.decorators import SERVICE_CACHE, cached_async, invalidate_tags
+from app.cache.metrics import REDIS_POOL_COLLECTOR
+from app.cache.module.base import AsyncRedisCache, RedisCache
+from app.cache.module.codec import COMPRESSORS, CacheSerializer
+from app.cache.module.memory import AsyncMemoryCache, MemoryStore
+from app.cache.module.tiered import CacheInvalidationBus, LocalCache, TieredAsyncRedisCache
+from app.cache.module.tracking import ClientTracking, TrackedAsyncRedisCache
+from app.cache.session import ElastiCacheIAMProvider, create_async_redis_connection, create_redis_connection
+from app.configs import APP_SETTINGS
+from app.core.auth.rbac.schemas import MenuActions
+from app.database.postgres.session import AsyncDatabaseSession
+
+
+def test_redis_pool_metrics():
+    sync_conn = redis.Redis(host="127.0.0.1", port=6379, max_connections=5)
+    async_conn = aioredis.Redis(host="127.0.0.1", port=6379, max_connections=7)
+    REDIS_POOL_COLLECTOR.track("test-sync", sync_conn)
+    REDIS_POOL_COLLECTOR.track("test-async", async_conn)
+    try:
+        labels = {"client": "test-sync", "node": "127.0.0.1:6379"}
+        assert REGISTRY.get_sample_value("portal_backend_backend_redis_pool_max_connections", labels) == 5
+        assert REGISTRY.get_sample_value("portal_backend_backend_redis_pool_connections_in_use", labels) == 0
+        labels = {"client": "test-async", "node": "127.0.0.1:6379"}
+        assert REGISTRY.get_sample_value("portal_backend_backend_redis_pool_max_connections", labels) == 7
+    finally:
+        REDIS_POOL_COLLECTOR.untrack("test-sync")
+        REDIS_POOL_COLLECTOR.untrack("test-async")
+    assert REGISTRY.get_sample_value("portal_backend_backend_redis_pool_max_connections", labels) is None
+
+
+@pytest.mark.anyio
+async def test_redis_pool_waits_for_free_connection(async_redis, monkeypatch):
+    monkeypatch.setattr(APP_SETTINGS, "REDIS_MAX_CONNECTIONS", 2)
+    async_conn = await create_async_redis_connection()
+    sync_conn = create_redis_connection()
+    REDIS_POOL_COLLECTOR.track("test-blocking", sync_conn)
+    try:
+        # each call holds its connection for 50ms, 10 of them wait for the 2 connections of the pool
+        results = await asyncio.gather(*[async_conn.blpop("test_pool:missing", 0.05) for _ in range(10)])
+        assert results == [None] * 10
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda _: sync_conn.blpop("test_pool:missing", 0.05), range(10)))
+        assert results == [None] * 10
+        assert async_conn.circuit_breaker.state == sync_conn.circuit_breaker.state == CLOSED
+        labels = {"client": "test-blocking", "node": "localhost:6379"}
+        assert REGISTRY.get_sample_value("portal_backend_backend_redis_pool_connections_idle", labels) == 2
+        assert REGISTRY.get_sample_value("portal_backend_backend_redis_pool_connections_in_use", labels) == 0
+    finally:
+        REDIS_POOL_COLLECTOR.untrack("test-blocking")
+        sync_conn.close()
+        await async_conn.aclose()
+
+
+def test_iam_credential_provider_refreshes_in_background(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test-access-key")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test-secret-key")
+    provider = ElastiCacheIAMProvider(user="test-user", cluster_name="test-cluster", refresh_interval=0.1)
+    presign = provider._presign
+    calls = []
+
+    def counting_presign():
+        calls.append(time.monotonic())
+        return presign()
+
+    monkeypatch.setattr(provider, "_presign", counting_presign)
+    provider.start()
+    try:
+        user, token = provider.get_credentials()
+        assert user == "test-user"
+        assert token.startswith("test-cluster/?Action=connect&User=test-user")
+        assert "X-Amz-Expires=900" in token
+        for _ in range(10):
+            provider.get_credentials()
+        assert len(calls) == 1  # served from the cached token
+
+        time.sleep(0.35)
+        assert len(calls) >= 3  # refreshed by the background thread
+    finally:
+        provider.stop()
+
+
+def test_local_cache_evictions():
+    cache = LocalCache("test_local:", maxsize=2, ttl=60)
+    evictions = REGISTRY.get_sample_value("portal_backend_backend_tiered_cache_evictions_total",
+                                          {"prefix": "test_local:"}) or 0
+    for key in ("a", "b", "c"):
+        cache[key] = key
+    assert "a" not in cache
+    assert REGISTRY.get_sample_value("portal_backend_backend_tiered_cache_evictions_total",
+                                     {"prefix": "test_local:"}) == evictions + 1
+
+
+@pytest.mark.anyio
+async def test_tiered_cache_invalidation(async_redis):
+    # two workers, each with its own in-process tier and invalidation bus
+    buses = [CacheInvalidationBus(async_redis, channel="test_cache_invalidation") for _ in range(2)]
+    caches = [TieredAsyncRedisCache(async_redis, "test_tiered:", 60, local_ttl=60, invalidation_bus=bus)
+              for bus in buses]
+    for bus in buses:
+        bus.start()
+        assert await bus.wait_subscribed()
+    try:
+        await caches[0].set("menus", ["home"])
+        assert await caches[1].get("menus") == ["home"]  # l2 hit, kept in l1 of worker 2
+        assert "test_tiered:menus" in caches[1].local
+
+        await caches[0].set("menus", ["home", "audit"])
+        for _ in range(50):
+            if "test_tiered:menus" not in caches[1].local:
+                break
+            await asyncio.sleep(0.02)
+        assert await caches[1].get("menus") == ["home", "audit"]
+
+        value = await caches[1].get("menus")
+        value.append("mutated")
+        assert await caches[1].get("menus") == ["home", "audit"]
+
+        await caches[1].delete("menus")
+        await asyncio.sleep(0.1)
+        assert await caches[0].get("menus") is None
+    finally:
+        for bus in buses:
+            await bus.stop()
+
+
+class _FailoverCluster(aioredis.RedisCluster):
+    """
+    A cluster client whose default node moves to the next one on every topology refresh.
+    """
+
+    def __init__(self, nodes: List[ClusterNode], credential_provider: CredentialProvider):
+        self.connection_kwargs = {"credential_provider": credential_provider}
+        self.nodes_manager = self
+        self.default_node = nodes[0]
+        self._next_nodes = iter(nodes[1:])
+        self.refreshes = 0
+
+    async def initialize(self):
+        self.refreshes += 1
+        self.default_node = next(self._next_nodes)
+
+
+@pytest.mark.anyio
+async def test_cache_invalidation_bus_cluster_subscriber(async_redis):
+    class Credentials(CredentialProvider):
+        calls = 0
+
+        def get_credentials(self):
+            Credentials.calls += 1
+            return "default", "any"
+
+    # the first node has failed over, the refreshed topology has the live one
+    cluster = _FailoverCluster([ClusterNode("127.0.0.1", 1, socket_connect_timeout=0.1),
+                                ClusterNode("127.0.0.1", 6379)], Credentials())
+    subscriber = CacheInvalidationBus(cluster, channel="test_cluster_invalidation")
+    cache = TieredAsyncRedisCache(async_redis, "test_cluster_tiered:", 60, local_ttl=60)
+    subscriber.register(cache)
+    publisher = CacheInvalidationBus(async_redis, channel="test_cluster_invalidation")
+    subscriber.start()
+    try:
+        assert await subscriber.wait_subscribed(timeout=5)
+        assert cluster.refreshes == 1 and Credentials.calls == 1
+
+        await cache.set("menus", ["home"])
+        assert "test_cluster_tiered:menus" in cache.local
+        await publisher.publish("test_cluster_tiered:", "test_cluster_tiered:menus")
+        for _ in range(50):
+            if "test_cluster_tiered:menus" not in cache.local:
+                break
+            await asyncio.sleep(0.02)
+        assert "test_cluster_tiered:menus" not in cache.local
+    finally:
+        await subscriber.stop()
+
+
+@pytest.mark.parametrize("codec", ["json", "orjson", "msgpack"])
+@pytest.mark.parametrize("compression", [None, "zstd", "lz4"])
+def test_cache_serializer_roundtrip(codec, compression):
+    serializer = CacheSerializer(codec=codec, compression=compression, compression_threshold=64)
+    small = {"name": "Test", "menus": [1, 2]}
+    large = {"menus": [{"name": f"Menu {i}", "path": f"/menu/{i}", "superOnly": False} for i in range(50)]}
+    for value in (small, large, None, "text", [1.5, True]):
+        assert CacheSerializer.loads(serializer.dumps(value)) == value
+
+    encoded = serializer.dumps(large)
+    if compression:
+        assert encoded[1] & 0x0F == COMPRESSORS[compression].id
+        assert len(encoded) < len(json.dumps(large))
+
+
+def test_cache_serializer_reads_plain_json():
+    # written by the previous versions or by the default json codec without compression
+    assert CacheSerializer().dumps({"a": 1}) == '{"a": 1}'
+    assert CacheSerializer.loads(b'{"a": 1}') == {"a": 1}
+    assert CacheSerializer.loads('["a"]') == ["a"]
+
+
+def test_hash_tag_keys_share_slot():
+    cache = AsyncRedisCache(None, "msal_auth:", hash_tag=True)
+    assert cache._full_key("a") == "{msal_auth:}a"
+    assert len({key_slot(cache._full_key(key).encode()) for key in ("a", "b", "frontend_host")}) == 1
+
+
+@pytest.mark.anyio
+async def test_batch_operations(async_redis):
+    cache = AsyncRedisCache(async_redis, "test_batch:", 60)
+    await cache.set_many({"a": {"id": 1}, "b": [1, 2], "c": "text"})
+    assert await cache.get("b") == [1, 2]
+    assert await cache.get_many(["a", "b", "c", "missing"]) == {"a": {"id": 1}, "b": [1, 2], "c": "text"}
+    await cache.delete_many(["a", "b"])
+    assert await cache.get_many(["a", "b", "c"]) == {"c": "text"}
+
+    sync_redis = redis.from_url(APP_SETTINGS.REDIS_URI)
+    sync_cache = RedisCache(sync_redis, "test_batch:", 60)
+    sync_cache.set_many({"a": 1, "d": {"x": None}})
+    assert sync_cache.get_many(["a", "c", "d", "missing"]) == {"a": 1, "c": "text", "d": {"x": None}}
+    sync_cache.delete_many(["a", "c", "d"])
+    assert sync_cache.get_many(["a", "c", "d"]) == {}
+    sync_redis.close()
+
+    tiered = TieredAsyncRedisCache(async_redis, "test_batch:", 60)
+    await tiered.set_many({"a": 1, "b": 2})
+    await cache.set("b", 3)  # not seen by the l1 tier without an invalidation bus
+    assert await tiered.get_many(["a", "b", "c"]) == {"a": 1, "b": 2}
+    await tiered.delete_many(["a", "b"])
+    assert await tiered.get_many(["a", "b"]) == {}
+
+
+@pytest.fixture
+def service_cache(async_redis):
+    SERVICE_CACHE.configure(async_redis)
+    yield SERVICE_CACHE
+    SERVICE_CACHE.reset()
+
+
+@pytest.mark.anyio
+async def test_cached_async(service_cache):
+    calls = []
+
+    @cached_async("test_cached_async:", key="{role_id}", model=List[MenuActions], ttl=60,
+                  tags=["test_menus", "test_menus:{role_id}"])
+    async def get_menus(db, role_id: int):
+        calls.append(role_id)
+        await asyncio.sleep(0.05)
+        if role_id < 0:
+            return None
+        return [MenuActions(id=role_id, name="Audit Logs", path="/audit-logs", action="view")]
+
+    await invalidate_tags("test_menus")
+    results = await asyncio.gather(*[get_menus(None, 1) for _ in range(10)])
+    assert calls == [1]  # concurrent misses coalesced into one load
+    assert all(result == results[0] and result[0].name == "Audit Logs" for result in results)
+
+    assert (await get_menus(None, role_id=1))[0].path == "/audit-logs"
+    assert calls == [1]
+
+    await get_menus(None, 2)
+    await invalidate_tags("test_menus:1")
+    await get_menus(None, 1)
+    await get_menus(None, 2)
+    assert calls == [1, 2, 1]
+
+    await invalidate_tags("test_menus")
+    await get_menus(None, 1)
+    await get_menus(None, 2)
+    assert calls == [1, 2, 1, 1, 2]
+
+    await get_menus(None, -1)
+    await get_menus(None, -1)
+    assert calls[-2:] == [-1, -1]  # None is not cached
+
+    SERVICE_CACHE.reset()
+    await get_menus(None, 1)
+    assert calls[-1] == 1  # called directly without redis
+
+
+@pytest.mark.anyio
+async def test_cached_async_shared_load_own_session(service_cache):
+    sessions = []
+    loading = asyncio.Event()
+
+    @cached_async("test_shared_session:", key="{role_id}", ttl=60)
+    async def get_role_name(db: AsyncSession, role_id: int):
+        sessions.append(db)
+        loading.set()
+        await asyncio.sleep(0.05)
+        return (await db.exec(select(literal("admin")))).one()
+
+    await service_cache.cache("test_shared_session:", 60, 0).delete("1")
+    async with AsyncDatabaseSession() as first_db, AsyncDatabaseSession() as second_db:
+        first = asyncio.ensure_future(get_role_name(first_db, 1))
+        await loading.wait()
+        second = asyncio.ensure_future(get_role_name(second_db, 1))
+        first.cancel()  # e.g. the client of the first request went away
+        assert await second == "admin"
+        assert first.cancelled()
+    assert len(sessions) == 1 and sessions[0] not in (first_db, second_db)
+
+
+@pytest.mark.anyio
+async def test_cached_async_invalid_cached_value(service_cache):
+    calls = 0
+
+    @cached_async("test_invalid_cached:", key="{role_id}", model=List[MenuActions], ttl=60)
+    async def get_menus(role_id: int):
+        nonlocal calls
+        calls += 1
+        return [MenuActions(id=role_id, name="Audit Logs", path="/audit-logs", action="view")]
+
+    # cached by a previous version with another model
+    cache = service_cache.cache("test_invalid_cached:", 60, 0)
+    await cache.set("1", {"value": [{"id": 1, "title": "Audit Logs"}], "delta": 0.01, "expires_at": time.time() + 60})
+    assert (await get_menus(1))[0].name == "Audit Logs"
+    assert calls == 1
+    assert (await cache.get("1"))["value"][0]["name"] == "Audit Logs"
+    assert (await get_menus(1))[0].name == "Audit Logs"
+    assert calls == 1
+
+
+@pytest.mark.anyio
+async def test_cached_async_early_refresh(service_cache):
+    calls = 0
+
+    @cached_async("test_early_refresh:", key="key", ttl=60, beta=1e6)
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    await invalidate_tags()
+    await service_cache.cache("test_early_refresh:", 60, 0).delete("key")
+    assert await load() == 1
+    # a huge beta makes the slow load always recomputed ahead of the expiration
+    assert await load() == 2
+
+
+def test_circuit_breaker_states():
+    breaker = CircuitBreaker("test_states", window_size=4, min_calls=4, slow_call_duration=0.05,
+                             open_duration=0.1, half_open_calls=2)
+
+    def fail():
+        raise redis.ConnectionError("down")
+
+    def slow():
+        time.sleep(0.06)
+
+    def wrong_type():
+        raise redis.ResponseError("WRONGTYPE")
+
+    for _ in range(3):
+        breaker.call(lambda: None)
+    with pytest.raises(redis.ConnectionError):
+        breaker.call(fail)
+    with pytest.raises(redis.ResponseError):
+        breaker.call(wrong_type)  # an error reply, not a failure of redis
+    assert breaker.state == CLOSED
+
+    breaker.call(slow)
+    breaker.call(slow)  # half of the last 4 calls are slow
+    assert breaker.state == OPEN
+    assert REGISTRY.get_sample_value("portal_backend_backend_redis_circuit_breaker_state",
+                                     {"breaker": "test_states"}) == 2
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: calls.append(1))
+    assert calls == []
+    assert REGISTRY.get_sample_value("portal_backend_backend_redis_circuit_breaker_rejected_calls_total",
+                                     {"breaker": "test_states"}) == 1
+
+    time.sleep(0.1)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(redis.ConnectionError):
+        breaker.call(fail)  # a failed trial opens it again
+    assert breaker.state == OPEN
+
+    time.sleep(0.1)
+    breaker.call(lambda: None)
+    breaker.call(lambda: None)
+    assert breaker.state == CLOSED
+    assert REGISTRY.get_sample_value("portal_backend_backend_redis_circuit_breaker_state",
+                                     {"breaker": "test_states"}) == 0
+
+
+@pytest.mark.anyio
+async def test_circuit_breaker_ignores_pool_checkout(async_redis):
+    # one slow call opens the circuit, the wait for the single connection of the pool must not count
+    def one_connection_client(client_class, pool_class, pool_timeout):
+        client = client_class.from_pool(pool_class.from_url(APP_SETTINGS.REDIS_URI, max_connections=1,
+                                                            timeout=pool_timeout))
+        client.circuit_breaker = CircuitBreaker("test_checkout", window_size=1, min_calls=1,
+                                                slow_call_duration=0.5)
+        return client
+
+    async_conn = one_connection_client(AsyncCircuitBreakerRedis, AsyncBlockingConnectionPool, 1)
+    try:
+        assert await asyncio.gather(*[async_conn.blpop("test_pool:missing", 0.2) for _ in range(3)]) == [None] * 3
+        assert async_conn.circuit_breaker.state == CLOSED
+    finally:
+        await async_conn.aclose()
+    async_conn = one_connection_client(AsyncCircuitBreakerRedis, AsyncBlockingConnectionPool, 0.05)
+    try:
+        results = await asyncio.gather(async_conn.blpop("test_pool:missing", 0.2),
+                                       async_conn.get("test_pool:missing"), return_exceptions=True)
+        assert results[0] is None and isinstance(results[1], PoolExhaustedError)
+        assert async_conn.circuit_breaker.state == CLOSED
+    finally:
+        await async_conn.aclose()
+
+    sync_conn = one_connection_client(CircuitBreakerRedis, BlockingConnectionPool, 1)
+    try:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(lambda _: sync_conn.blpop("test_pool:missing", 0.2), range(3)))
+        assert results == [None] * 3 and sync_conn.circuit_breaker.state == CLOSED
+    finally:
+        sync_conn.close()
+    sync_conn = one_connection_client(CircuitBreakerRedis, BlockingConnectionPool, 0.05)
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            blocked = executor.submit(sync_conn.blpop, "test_pool:missing", 0.2)
+            time.sleep(0.02)
+            with pytest.raises(PoolExhaustedError):
+                sync_conn.get("test_pool:missing")
+            assert blocked.result() is None
+        assert sync_conn.circuit_breaker.state == CLOSED
+    finally:
+        sync_conn.close()
+
+
+@pytest.mark.anyio
+async def test_circuit_breaker_releases_half_open_trials():
+    breaker = CircuitBreaker("test_trials", window_size=2, min_calls=2, open_duration=0.1, half_open_calls=2)
+
+    async def fail():
+        raise redis.ConnectionError("down")
+
+    async def wrong_type():
+        raise redis.ResponseError("WRONGTYPE")
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def ok():
+        pass
+
+    for _ in range(2):
+        with pytest.raises(redis.ConnectionError):
+            await breaker.call_async(fail)
+    assert breaker.state == OPEN
+
+    await asyncio.sleep(0.1)
+    with pytest.raises(redis.ResponseError):
+        await breaker.call_async(wrong_type)  # redis answered, a successful trial
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(breaker.call_async(hang), 0.01)  # cancelled, its trial is released
+    assert breaker.state == HALF_OPEN
+    await breaker.call_async(ok)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.anyio
+async def test_circuit_breaker_fails_fast_to_stale_local_cache():
+    # nothing listens on port 1, every call fails until the circuit opens
+    redis_conn = AsyncCircuitBreakerRedis(host="127.0.0.1", port=1)
+    redis_conn.circuit_breaker = CircuitBreaker("test_stale", window_size=4, min_calls=4, open_duration=60)
+    cache = TieredAsyncRedisCache(redis_conn, "test_stale:", 60, local_ttl=0, stale_ttl=60)
+    cache._set_local("test_stale:menus", json.dumps(["home"]))
+    try:
+        for _ in range(4):
+            assert await cache.get("menus") == ["home"]  # l1 is expired, served stale
+        assert redis_conn.circuit_breaker.state == OPEN
+
+        start = time.monotonic()
+        assert await cache.get_many(["menus"]) == {"menus": ["home"]}
+        with pytest.raises(CircuitOpenError):
+            await cache.get("roles")  # nothing to fall back to
+        with pytest.raises(CircuitOpenError):
+            await cache.set("menus", ["home", "audit"])
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.get("test_stale:menus")
+            with pytest.raises(CircuitOpenError):
+                await pipe.execute()
+        assert time.monotonic() - start < 0.05
+    finally:
+        await redis_conn.aclose()
+
+
+@pytest.mark.anyio
+async def test_client_tracking(async_redis):
+    try:
+        await async_redis.execute_command("CLIENT", "TRACKING", "OFF")
+    except redis.ResponseError:
+        pytest.skip("redis server without client tracking")
+
+    tracking = ClientTracking(async_redis)
+    cache = TrackedAsyncRedisCache(async_redis, tracking, "test_tracked:", 60)
+    other_worker = AsyncRedisCache(async_redis, "test_tracked:", 60)
+    await other_worker.set("menus", ["home"])
+    tracking.start()
+    try:
+        assert await tracking.wait_active()
+        hits = REGISTRY.get_sample_value("portal_backend_backend_tiered_cache_hits_total",
+                                         {"prefix": "test_tracked:", "tier": "tracked"}) or 0
+        assert await cache.get("menus") == ["home"]  # from redis, kept locally
+        assert "test_tracked:menus" in cache.local
+        assert await cache.get_many(["menus"]) == {"menus": ["home"]}
+        assert REGISTRY.get_sample_value("portal_backend_backend_tiered_cache_hits_total",
+                                         {"prefix": "test_tracked:", "tier": "tracked"}) == hits + 1
+
+        await other_worker.set("menus", ["home", "audit"])  # redis pushes the invalidation
+        for _ in range(50):
+            if "test_tracked:menus" not in cache.local:
+                break
+            await asyncio.sleep(0.02)
+        assert await cache.get("menus") == ["home", "audit"]
+
+        await other_worker.delete("menus")
+        for _ in range(50):
+            if "test_tracked:menus" not in cache.local:
+                break
+            await asyncio.sleep(0.02)
+        assert await cache.get("menus") is None
+    finally:
+        await tracking.stop()
+    assert not tracking.tracks(cache)
+
+
+def test_client_tracking_unsupported_redis_version(monkeypatch):
+    monkeypatch.setattr(redis, "__version__", "6.0.0")
+    with pytest.raises(RuntimeError, match="CACHE_CLIENT_TRACKING_ENABLED=false"):
+        ClientTracking(None)
+
+
+def _cache_metric(name: str, prefix: str, operation: str) -> float:
+    return REGISTRY.get_sample_value(f"portal_backend_backend_{name}",
+                                     {"prefix": prefix, "operation": operation}) or 0
+
+
+@pytest.mark.anyio
+async def test_cache_metrics():
+    cache = AsyncMemoryCache(MemoryStore(max_bytes=1024), "test_metrics:")
+    await cache.set("flow", {"state": "abc"})
+    await cache.get("flow")
+    await cache.get("missing")
+    await cache.get_many(["flow", "missing", "other"])
+
+    assert _cache_metric("cache_hits_total", "test_metrics:", "get") == 1
+    assert _cache_metric("cache_misses_total", "test_metrics:", "get") == 1
+    assert _cache_metric("cache_hits_total", "test_metrics:", "get_many") == 1
+    assert _cache_metric("cache_misses_total", "test_metrics:", "get_many") == 2
+    assert _cache_metric("cache_operation_seconds_count", "test_metrics:", "get") == 2
+    assert _cache_metric("cache_payload_bytes_count", "test_metrics:", "set") == 1
+    assert _cache_metric("cache_payload_bytes_sum", "test_metrics:", "set") == len('{"state": "abc"}')
+
+    # nothing listens on port 1
+    redis_conn = aioredis.Redis(host="127.0.0.1", port=1)
+    cache = AsyncRedisCache(redis_conn, "test_metrics_errors:")
+    try:
+        with pytest.raises(redis.ConnectionError):
+            await cache.get("flow")
+    finally:
+        await redis_conn.aclose()
+    assert _cache_metric("cache_errors_total", "test_metrics_errors:", "get") == 1
+    assert _cache_metric("cache_operation_seconds_count", "test_metrics_errors:", "get") == 1
@@ -0,0 +1,160 @@
+"""
+Contract of the cache backends: every implementation of BaseRedisCache / BaseAsyncRedisCache
+must behave the same, the redis ones are skipped if redis is not available.
+"""
+import asyncio
+import time
+import uuid
+
+import pytest
+import redis
+from pydantic import ValidationError
+
+from app.cache.module.base import AsyncRedisCache, RedisCache
+from app.cache.module.codec import RAW_SERIALIZER
+from app.cache.module.memory import AsyncMemoryCache, MemoryCache, MemoryStore
+from app.cache.module.tiered import TieredAsyncRedisCache
+from app.configs import APP_SETTINGS
+from app.configs.cache import RedisCacheConfigs
+from app.core.auth.auth_cache import AsyncRedisTokenCache
+
+ASYNC_BACKENDS = ["memory", "redis", "tiered"]
+
+
+@pytest.fixture
+def prefix():
+    return f"test_contract_{uuid.uuid4().hex[:8]}:"
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache_factory(request, prefix):
+    if request.param == "memory":
+        store = MemoryStore(max_bytes=1024 * 1024)
+        yield lambda expiration=60: MemoryCache(store, prefix, expiration)
+        return
+
+    redis_conn = redis.from_url(APP_SETTINGS.REDIS_URI, socket_connect_timeout=5)
+    try:
+        redis_conn.ping()
+    except (redis.ConnectionError, redis.TimeoutError):
+        pytest.skip(f"redis is not available at {APP_SETTINGS.REDIS_URI}")
+    yield lambda expiration=60: RedisCache(redis_conn, prefix, expiration)
+    redis_conn.close()
+
+
+@pytest.fixture(params=ASYNC_BACKENDS)
+def async_cache_factory(request, prefix):
+    if request.param == "memory":
+        store = MemoryStore(max_bytes=1024 * 1024)
+        return lambda expiration=60, **kwargs: AsyncMemoryCache(store, prefix, expiration, **kwargs)
+
+    redis_conn = request.getfixturevalue("async_redis")
+    if request.param == "tiered":
+        return lambda expiration=60, **kwargs: TieredAsyncRedisCache(redis_conn, prefix, expiration,
+                                                                     local_ttl=60, **kwargs)
+    return lambda expiration=60, **kwargs: AsyncRedisCache(redis_conn, prefix, expiration, **kwargs)
+
+
+def test_cache_contract(cache_factory):
+    cache = cache_factory()
+    value = {"state": "abc", "scope": ["openid", "profile"]}
+    assert cache.get("flow") is None
+    cache.set("flow", value)
+    assert cache.get("flow") == value
+    cache.get("flow")["state"] = "mutated"
+    assert cache.get("flow") == value  # every get returns a new object
+
+    cache.set("flow", "replaced")
+    assert cache.get("flow") == "replaced"
+    cache.delete("flow")
+    cache.delete("flow")  # deleting a missing key is fine
+    assert cache.get("flow") is None
+
+    cache.set_many({"a": 1, "b": [2]})
+    assert cache.get_many(["a", "b", "c"]) == {"a": 1, "b": [2]}
+    cache.delete_many(["a", "b", "c"])
+    assert cache.get_many(["a", "b"]) == {}
+
+
+def test_cache_contract_expiration(cache_factory):
+    cache = cache_factory(expiration=1)
+    cache.set("flow", {"state": "abc"})
+    assert cache.get("flow") == {"state": "abc"}
+    time.sleep(1.1)
+    assert cache.get("flow") is None
+
+
+@pytest.mark.anyio
+async def test_async_cache_contract(async_cache_factory):
+    cache = async_cache_factory()
+    other = async_cache_factory()  # another instance sharing the same storage and prefix
+    value = {"id": 1, "menus": ["home", "audit"]}
+    assert await cache.get("menus") is None
+    await cache.set("menus", value)
+    assert await cache.get("menus") == value
+    assert await other.get("menus") == value
+    (await cache.get("menus"))["id"] = 2
+    assert await cache.get("menus") == value
+
+    await cache.delete("menus")
+    await cache.delete("menus")
+    assert await cache.get("menus") is None
+
+    await cache.set_many({"a": 1, "b": [2]})
+    assert await cache.get_many(["a", "b", "c"]) == {"a": 1, "b": [2]}
+    assert await cache.get_many([]) == {}
+    await cache.delete_many(["a", "b", "c"])
+    assert await cache.get_many(["a", "b"]) == {}
+
+
+@pytest.mark.anyio
+async def test_async_cache_contract_expiration(async_cache_factory):
+    cache = async_cache_factory(expiration=1)
+    await cache.set("menus", ["home"])
+    assert await cache.get("menus") == ["home"]
+    await asyncio.sleep(1.1)
+    assert await cache.get("menus") is None
+
+
+@pytest.mark.anyio
+async def test_token_cache_contract(async_cache_factory):
+    token_cache = AsyncRedisTokenCache(async_cache_factory(serializer=RAW_SERIALIZER),
+                                       encryption_key=APP_SETTINGS.ENCRYPTION_KEY)
+    token_cache.set_user("test@gmail.com")
+    token_cache.add({"client_id": "client", "scope": ["openid"], "token_endpoint": "https://login/token",
+                     "response": {"access_token": "access", "refresh_token": "refresh", "expires_in": 3600}})
+    await token_cache.persist()
+
+    loaded = AsyncRedisTokenCache(async_cache_factory(serializer=RAW_SERIALIZER),
+                                  encryption_key=APP_SETTINGS.ENCRYPTION_KEY)
+    loaded.set_user("test@gmail.com")
+    await loaded.load()
+    assert loaded.serialize() == token_cache.serialize()
+    await loaded.delete("test@gmail.com")
+
+
+def test_memory_store_lru_eviction():
+    store = MemoryStore(max_bytes=30)
+    store.set("a", "x" * 9, 60)  # 10 bytes with the key
+    store.set("b", "x" * 9, 60)
+    store.set("c", "x" * 9, 60)
+    assert store.get("a") is not None  # a is now the most recently used
+    store.set("d", "x" * 9, 60)
+    assert store.get("b") is None
+    assert [store.get(key) is not None for key in "acd"] == [True, True, True]
+    assert store.size == 30
+
+    store.set("e", "x" * 100, 60)  # larger than the store, not kept
+    assert store.get("e") is None
+    assert store.size == 30
+    store.delete("a", "c", "d")
+    assert store.size == 0
+
+
+def test_memory_backend_single_worker():
+    configs = RedisCacheConfigs(CACHE_BACKEND="memory", REDIS_HOST="localhost", WEB_CONCURRENCY=1)
+    assert configs.CACHE_BACKEND == "memory"
+    with pytest.raises(ValidationError, match="single worker"):
+        RedisCacheConfigs(CACHE_BACKEND="memory", REDIS_HOST="localhost", WEB_CONCURRENCY=4)
+    configs = RedisCacheConfigs(CACHE_BACKEND="redis", REDIS_HOST="localhost", WEB_CONCURRENCY=4)
+    assert configs.WEB_CONCURRENCY == 4
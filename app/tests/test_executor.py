@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from contextvars import ContextVar
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.utils.executor import BoundedExecutor, ExecutorBusyError
+
+CURRENT_USER: ContextVar[str] = ContextVar("current_user", default=None)
+
+
+@pytest.fixture
+def executor():
+    executor = BoundedExecutor("test", max_workers=1, max_queue_size=1, timeout=0.5)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.anyio
+async def test_run_propagates_context(executor):
+    CURRENT_USER.set("test@gmail.com")
+    result = await executor.run(lambda: (CURRENT_USER.get(), threading.current_thread().name))
+    assert result[0] == "test@gmail.com"
+    assert result[1].startswith("test")
+
+
+@pytest.mark.anyio
+async def test_run_timeout(executor):
+    release = threading.Event()
+    with pytest.raises(asyncio.TimeoutError):
+        await executor.run(release.wait, 5)
+    release.set()
+
+
+@pytest.mark.anyio
+async def test_run_timeout_while_queued(executor):
+    labels = {"executor": "test"}
+    depth = REGISTRY.get_sample_value("portal_backend_backend_executor_queue_depth", labels)
+    release = threading.Event()
+    # the second call waits for the worker running the first one until both time out
+    calls = [asyncio.ensure_future(executor.run(release.wait, 5)) for _ in range(2)]
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+    assert REGISTRY.get_sample_value("portal_backend_backend_executor_queue_depth", labels) == depth
+    release.set()
+    assert await executor.run(lambda: 1) == 1
+
+
+@pytest.mark.anyio
+async def test_run_rejects_when_busy(executor):
+    release = threading.Event()
+    calls = [asyncio.ensure_future(executor.run(release.wait, 5)) for _ in range(2)]
+    await asyncio.sleep(0.05)
+    with pytest.raises(ExecutorBusyError):
+        await executor.run(lambda: None)
+    release.set()
+    assert await asyncio.gather(*calls) == [True, True]
+    assert await executor.run(lambda: 1) == 1
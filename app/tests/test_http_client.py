@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.configs import APP_SETTINGS
+from app.core.auth.service import get_user_info
+from app.http_client import OutboundHTTPClient
+
+USER_INFO = {"id": "aad-user-id", "mail": "Test@gmail.com", "displayName": "Test"}
+
+
+class GraphStubHandler(BaseHTTPRequestHandler):
+    """ Local stub of Microsoft Graph API /me endpoint. """
+
+    def do_GET(self):
+        if self.path == "/slow/me":
+            time.sleep(1)  # never answers within the client read timeout
+            return
+        if self.headers.get("Authorization") != "Bearer valid-token":
+            self.send_response(401)
+            self.end_headers()
+            self.wfile.write(b'{"error": "InvalidAuthenticationToken"}')
+            return
+        body = json.dumps(USER_INFO).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def graph_stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GraphStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+async def http_client():
+    client = OutboundHTTPClient(connect_timeout=1,
+                                read_timeout=0.5,
+                                write_timeout=1,
+                                pool_timeout=1,
+                                max_connections=10,
+                                max_keepalive_connections=5,
+                                keepalive_expiry=5,
+                                max_concurrency=5)
+    yield client
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_get_user_info(http_client, graph_stub_url, monkeypatch):
+    monkeypatch.setattr(APP_SETTINGS, "GRAPH_API_URL", graph_stub_url)
+    user_info = await get_user_info("valid-token", http_client)
+    assert user_info == USER_INFO
+
+
+@pytest.mark.anyio
+async def test_get_user_info_unauthorized(http_client, graph_stub_url, monkeypatch):
+    monkeypatch.setattr(APP_SETTINGS, "GRAPH_API_URL", graph_stub_url)
+    user_info = await get_user_info("invalid-token", http_client)
+    assert user_info is None
+
+
+@pytest.mark.anyio
+async def test_get_user_info_read_timeout(http_client, graph_stub_url, monkeypatch):
+    monkeypatch.setattr(APP_SETTINGS, "GRAPH_API_URL", f"{graph_stub_url}/slow")
+    start = time.perf_counter()
+    user_info = await get_user_info("valid-token", http_client)
+    assert user_info is None
+    assert time.perf_counter() - start < 1
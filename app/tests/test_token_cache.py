@@ -0,0 +1,291 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+from fastapi import Response
+from sqlalchemy import event
+from sqlmodel import select
+from starlette.datastructures import Headers
+
+from app import middlewares
+from app.cache.module.tiered import CacheInvalidationBus
+from app.configs import APP_SETTINGS
+from app.core.audit.models import Audit
+from app.core.auth import models
+from app.core.auth import service as auth_service
+from app.core.auth.schemas import Principal
+from app.core.auth.service import AuthHandler, create_jwt_access_token, save_login
+from app.core.auth.token_cache import VERIFIED_TOKEN_CACHE, AccessTokenCache, VerifiedTokenCache
+from app.database.postgres.session import ENGINE, AsyncDatabaseSession
+from app.exceptions import NeedLoginException
+from app.middlewares import CustomAuthMiddleware
+from app.utils.checksum import calculate_token_digest
+from app.utils.singleflight import SingleFlight
+
+
+@pytest.mark.anyio
+async def test_verified_token_cache():
+    cache = VerifiedTokenCache(maxsize=10, ttl=60, negative_ttl=0)
+    principal = Principal(username="test@gmail.com", user_id=1)
+    digest = calculate_token_digest("token")
+    assert digest == calculate_token_digest("token") and len(digest) == 32
+    cache.set(digest, {"user_id": "test@gmail.com", "exp": time.time() + 600}, principal)
+    assert cache.get(digest).principal == principal
+    assert cache.get(calculate_token_digest("other-token")) is None
+
+    cache.set(calculate_token_digest("expired-token"), {"user_id": "test@gmail.com", "exp": time.time() - 1},
+              principal)
+    assert cache.get(calculate_token_digest("expired-token")) is None  # never outlives the jwt exp
+    cache.set(calculate_token_digest("unknown-token"), {"user_id": "test@gmail.com"}, None)
+    assert cache.get(calculate_token_digest("unknown-token")) is None  # negative ttl
+
+    # resolved before an eviction, not cached
+    generation = cache.generation
+    await cache.evict_user("other@gmail.com")
+    assert cache.get(digest) is not None
+    cache.set(calculate_token_digest("stale-token"), {"user_id": "test@gmail.com"}, principal, generation)
+    assert cache.get(calculate_token_digest("stale-token")) is None
+
+    await cache.evict_user("test@gmail.com")
+    assert cache.get(digest) is None
+    cache.set(digest, {"user_id": "test@gmail.com"}, principal)
+    await cache.evict(digest)
+    assert cache.get(digest) is None
+
+
+@pytest.mark.anyio
+async def test_verified_token_cache_broadcast_evictions(async_redis):
+    # two workers, each with its own verified token cache and invalidation bus
+    buses = [CacheInvalidationBus(async_redis, channel="test_token_invalidation") for _ in range(2)]
+    caches = [VerifiedTokenCache(maxsize=10, ttl=60, negative_ttl=5) for _ in buses]
+    for cache, bus in zip(caches, buses):
+        cache.configure(bus)
+        bus.start()
+        assert await bus.wait_subscribed()
+    digest = calculate_token_digest("token")
+    try:
+        caches[1].set(digest, {"user_id": "test@gmail.com"}, Principal(username="test@gmail.com", user_id=1))
+        await caches[0].evict_user("test@gmail.com")
+        for _ in range(50):
+            if caches[1].get(digest) is None:
+                break
+            await asyncio.sleep(0.02)
+        assert caches[1].get(digest) is None
+
+        caches[1].set(digest, {"user_id": "test@gmail.com"}, Principal(username="test@gmail.com", user_id=1))
+        await caches[0].evict(digest)
+        for _ in range(50):
+            if caches[1].get(digest) is None:
+                break
+            await asyncio.sleep(0.02)
+        assert caches[1].get(digest) is None
+    finally:
+        for bus in buses:
+            await bus.stop()
+
+
+def test_access_token_cache_expiry_margin():
+    cache = AccessTokenCache(maxsize=10, expiry_margin=300)
+    cache.set("test@gmail.com", ["b", "a"], "fresh-token", expires_in=3600)
+    cache.set("test@gmail.com", ["c"], "stale-token", expires_in=200)
+    assert cache.get("test@gmail.com", ["a", "b"]) == "fresh-token"
+    assert cache.get("test@gmail.com", ["c"]) is None
+
+    cache.evict_user("test@gmail.com")
+    assert cache.get("test@gmail.com", ["a", "b"]) is None
+
+
+@pytest.mark.anyio
+async def test_single_flight_shares_result_and_exception():
+    single_flight = SingleFlight()
+    calls = 0
+
+    async def refresh():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    assert await asyncio.gather(*[single_flight.do("key", refresh) for _ in range(10)]) == [1] * 10
+    assert not single_flight.in_flight("key")
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise NeedLoginException(detail="Need login")
+
+    results = await asyncio.gather(*[single_flight.do("key", fail) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(result, NeedLoginException) for result in results)
+
+
+@pytest.mark.anyio
+async def test_get_access_token_obo_single_flight(monkeypatch):
+    handler = AuthHandler(APP_SETTINGS, None, None, None)
+    calls = 0
+
+    async def acquire_token_obo(username, scopes):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        handler.obo_token_cache.set(username, scopes, f"token-{calls}", expires_in=3600)
+        return f"token-{calls}"
+
+    monkeypatch.setattr(handler, "_acquire_token_obo", acquire_token_obo)
+    start = time.perf_counter()
+    tokens = await asyncio.gather(*[handler.get_access_token_obo("test@gmail.com", ["User.Read"])
+                                    for _ in range(20)])
+    assert tokens == ["token-1"] * 20
+    assert await handler.get_access_token_obo("test@gmail.com", ["User.Read"]) == "token-1"
+    assert calls == 1
+    assert time.perf_counter() - start < 1
+    handler.close()
+
+
+@pytest.fixture
+async def login_roles(test_db_session):
+    """
+    The roles assigned on first login, added like the rbac seed does if missing.
+    """
+    for name in ("superAdmin", "admin"):
+        if (await test_db_session.exec(select(models.Role).where(models.Role.name == name))).first() is None:
+            test_db_session.add(models.Role(name=name, is_preset=True))
+    await test_db_session.commit()
+
+
+@pytest.mark.anyio
+async def test_save_login(test_db_session, login_roles):
+    username = f"test_login_{uuid.uuid4().hex[:8]}@gmail.com"
+    assert await save_login(test_db_session, username, "Test Login", "first-token", "aad-user") is None
+    first_digest = (await test_db_session.exec(
+        select(models.AuthToken.token_digest).where(models.AuthToken.name == username))).one()
+    assert await save_login(test_db_session, username, "Test Login", "second-token", "aad-user") == first_digest
+
+    user = (await test_db_session.exec(select(models.RUser).where(models.RUser.email == username))).one()
+    assert [role.name for role in user.roles] == ["admin"]
+    audit_logs = (await test_db_session.exec(select(Audit).where(Audit.username == username))).all()
+    assert [(log.user_id, log.action) for log in audit_logs] == [(user.id, "login")] * 2
+
+
+@pytest.mark.anyio
+async def test_save_login_role_not_found(test_db_session, monkeypatch):
+    username = f"test_login_{uuid.uuid4().hex[:8]}@gmail.com"
+    monkeypatch.setattr(auth_service, "_default_role_name", lambda _: "test_missing_role")
+    with pytest.raises(Exception, match="Role not found"):
+        await save_login(test_db_session, username, "Test Login", "first-token", "aad-user")
+    assert (await test_db_session.exec(select(models.RUser).where(models.RUser.email == username))).first() is None
+
+
+@pytest.mark.anyio
+async def test_save_login_concurrent_first_login(login_roles):
+    username = f"test_login_{uuid.uuid4().hex[:8]}@gmail.com"
+
+    async def login(token: str):
+        async with AsyncDatabaseSession() as db:
+            await save_login(db, username, "Test Login", token, "aad-user")
+
+    await asyncio.gather(*[login(f"token-{i}") for i in range(5)])
+    async with AsyncDatabaseSession() as db:
+        user_ids = (await db.exec(select(Audit.user_id).where(Audit.username == username))).all()
+        assert len(user_ids) == 5 and len(set(user_ids)) == 1
+
+
+@pytest.mark.anyio
+async def test_auth_middleware_caches_principal(test_db_session, monkeypatch):
+    username = f"test_principal_{uuid.uuid4().hex[:8]}@gmail.com"
+    admin, viewer = models.Role(name=f"test_admin_{uuid.uuid4().hex[:8]}"), models.Role(name="test_viewer")
+    user = models.RUser(name="Test Principal", email=username, roles=[admin])
+    token = await create_jwt_access_token(username, 60)
+    auth_token = models.AuthToken(name=username, token=token, token_digest=calculate_token_digest(token),
+                                  aad_user_id="aad-user")
+    test_db_session.add_all([viewer, user, auth_token])
+    await test_db_session.commit()
+
+    decoded = []
+
+    async def decode(token: str):
+        decoded.append(token)
+        return await auth_service.decode_jwt_access_token(token)
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    monkeypatch.setattr(middlewares, "decode_jwt_access_token", decode)
+    middleware = CustomAuthMiddleware(None, whitelist=[])
+    headers = Headers({"user": username, "authorization": token})
+    assert (await middleware.authenticate(headers)).role_name == admin.name
+    assert VERIFIED_TOKEN_CACHE.get(calculate_token_digest(token)) is not None
+    event.listen(ENGINE.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        assert (await middleware.authenticate(headers)).role_name == admin.name
+    finally:
+        event.remove(ENGINE.sync_engine, "before_cursor_execute", count_statement)
+    assert decoded == [token]  # verified once, then looked up by digest
+    assert statements == []  # and no query on a cache hit
+
+    # demoted, then logged out, each change evicts the cached token
+    user.roles = [viewer]
+    await test_db_session.commit()
+    await VERIFIED_TOKEN_CACHE.evict_user(username)
+    assert (await middleware.authenticate(headers)).role_name == "test_viewer"
+    await test_db_session.delete(auth_token)
+    await test_db_session.commit()
+    await VERIFIED_TOKEN_CACHE.evict(calculate_token_digest(token))
+    response = await middleware.authenticate(headers)
+    assert isinstance(response, Response) and response.status_code == 403
+
+    for row in (user, admin, viewer):
+        await test_db_session.delete(row)
+    await test_db_session.commit()
+
+
+@pytest.mark.anyio
+async def test_resolve_principal_multiple_roles(test_db_session):
+    username = f"test_roles_{uuid.uuid4().hex[:8]}@gmail.com"
+    viewer = models.Role(name="test_viewer")
+    test_db_session.add(viewer)
+    await test_db_session.commit()
+    admin = models.Role(name="admin")  # created after the viewer, the role with the higher id
+    user = models.RUser(name="Test Roles", email=username, roles=[admin, viewer])
+    token = await create_jwt_access_token(username, 60)
+    digest = calculate_token_digest(token)
+    auth_token = models.AuthToken(name=username, token=token, token_digest=digest, aad_user_id="aad-user")
+    test_db_session.add_all([user, auth_token])
+    await test_db_session.commit()
+
+    for _ in range(3):
+        principal = await CustomAuthMiddleware.resolve_principal(digest, username)
+        assert (principal.role_id, principal.role_name) == (viewer.id, "test_viewer")
+        assert principal.is_admin
+
+    for row in (auth_token, user, admin, viewer):
+        await test_db_session.delete(row)
+    await test_db_session.commit()
+
+
+@pytest.mark.anyio
+async def test_logout_evicts_verified_token_after_commit(test_db_session, async_redis, monkeypatch):
+    username = f"test_logout_{uuid.uuid4().hex[:8]}@gmail.com"
+    token = await create_jwt_access_token(username, 60)
+    digest = calculate_token_digest(token)
+    test_db_session.add(models.AuthToken(name=username, token=token, token_digest=digest, aad_user_id="aad-user"))
+    await test_db_session.commit()
+    VERIFIED_TOKEN_CACHE.set(digest, {"user_id": username}, Principal(username=username))
+
+    evicted = []
+    evict = VERIFIED_TOKEN_CACHE.evict
+
+    async def record_evict(token_digest: bytes):
+        # the delete of the token must be committed, a concurrent request would cache it again otherwise
+        evicted.append((token_digest, test_db_session.in_transaction()))
+        await evict(token_digest)
+
+    monkeypatch.setattr(VERIFIED_TOKEN_CACHE, "evict", record_evict)
+    handler = AuthHandler(APP_SETTINGS, None, async_redis, None)
+    try:
+        assert await handler.logout_handler(username, test_db_session) is True
+    finally:
+        handler.close()
+    assert evicted == [(digest, False)]
+    assert VERIFIED_TOKEN_CACHE.get(digest) is None
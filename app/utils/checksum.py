@@ -8,3 +8,8 @@ def calculate_file_hash(file_path: str) -> str:
         for byte_block in iter(lambda: f.read(4096), b""):
             sha256_hash.update(byte_block)
     return sha256_hash.hexdigest()
+
+
+def calculate_token_digest(token: str) -> bytes:
+    """Calculate the SHA-256 digest of a token."""
+    return hashlib.sha256(token.encode()).digest()
@@ -0,0 +1,91 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from prometheus_client import Counter, Gauge
+
+from app.log import logger
+
+EXECUTOR_QUEUE_DEPTH = Gauge("executor_queue_depth",
+                             "Blocking calls waiting for a worker thread",
+                             ["executor"], namespace="portal_backend", subsystem="backend")
+EXECUTOR_ACTIVE_CALLS = Gauge("executor_active_calls",
+                              "Blocking calls running in a worker thread",
+                              ["executor"], namespace="portal_backend", subsystem="backend")
+EXECUTOR_REJECTED_CALLS = Counter("executor_rejected_calls",
+                                  "Blocking calls rejected because the executor queue is full",
+                                  ["executor"], namespace="portal_backend", subsystem="backend")
+EXECUTOR_TIMEOUT_CALLS = Counter("executor_timeout_calls",
+                                 "Blocking calls which did not finish within the executor timeout",
+                                 ["executor"], namespace="portal_backend", subsystem="backend")
+
+
+class ExecutorBusyError(Exception):
+    pass
+
+
+class BoundedExecutor:
+    """
+    Dedicated thread pool for blocking calls made from async code.
+    At most max_workers calls run at once and max_queue_size calls wait for a worker,
+    further calls are rejected with ExecutorBusyError instead of piling up.
+    Callers stop waiting after `timeout` seconds, a timed out call keeps its slot until its thread finishes.
+    The context of the caller (e.g. ContextVar values) is propagated to the worker thread.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue_size: int, timeout: float):
+        self.name = name
+        self.timeout = timeout
+        self.capacity = max_workers + max_queue_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._queue_depth = EXECUTOR_QUEUE_DEPTH.labels(executor=name)
+        self._active_calls = EXECUTOR_ACTIVE_CALLS.labels(executor=name)
+
+    def _acquire_slot(self) -> bool:
+        with self._lock:
+            if self._submitted >= self.capacity:
+                return False
+            self._submitted += 1
+            return True
+
+    def _release_slot(self, future: Future):
+        with self._lock:
+            self._submitted -= 1
+        if future.cancelled():
+            # cancelled while queued (timed out or shut down), _call never took it off the queue
+            self._queue_depth.dec()
+
+    def _call(self, fn: Callable) -> Any:
+        self._queue_depth.dec()
+        self._active_calls.inc()
+        try:
+            return fn()
+        finally:
+            self._active_calls.dec()
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) in the pool and wait for its result at most `timeout` seconds.
+        """
+        if not self._acquire_slot():
+            EXECUTOR_REJECTED_CALLS.labels(executor=self.name).inc()
+            raise ExecutorBusyError(f"Executor {self.name} is busy, {self.capacity} calls already submitted")
+
+        context = contextvars.copy_context()
+        self._queue_depth.inc()
+        future = self._executor.submit(self._call, functools.partial(context.run, fn, *args, **kwargs))
+        future.add_done_callback(self._release_slot)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            EXECUTOR_TIMEOUT_CALLS.labels(executor=self.name).inc()
+            logger.error(f"Executor {self.name} call {getattr(fn, '__name__', fn)} timed out after {self.timeout}s")
+            raise
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
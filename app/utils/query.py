@@ -1,18 +1,85 @@
-from sqlmodel import func
+import hashlib
+import json
+from typing import Optional
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlmodel import func, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.sql.expression import SelectOfScalar
 
+from app.cache.decorators import SERVICE_CACHE
+from app.configs import APP_SETTINGS
+from app.enums import CountStrategyEnum
 from app.log import logger
 
 
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN (FORMAT JSON) of a statement, keeping its bound parameters.
+    """
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.statement, **kw)}"
+
+
 async def get_count(db: AsyncSession, q: SelectOfScalar) -> int:
     """
-    Get the count of the query.
-    Note: This function will cause duplicated join on related tables if the query contains join.
+    Get the count of the query, counted over the query as a subquery so the joins are kept as they are.
     """
-    count_q = q.with_only_columns(func.count()).order_by(None).select_from(q.get_final_froms()[0])
+    count_q = select(func.count()).select_from(q.order_by(None).subquery())
     logger.debug(f"\nCount Query:\n{count_q}")
-    iterator = await db.exec(count_q)
-    for count in iterator:
-        return count
-    return 0
+    return (await db.exec(count_q)).one()
+
+
+async def get_estimated_count(db: AsyncSession, q: SelectOfScalar) -> int:
+    """
+    Get the row estimate of the planner for the query, from the table statistics (reltuples) and the
+    selectivity of the filters. Nothing is read but the statistics, the estimate is as fresh as the last ANALYZE.
+    """
+    plan = (await db.exec(Explain(q.order_by(None)))).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def get_cached_count(db: AsyncSession, q: SelectOfScalar) -> int:
+    """
+    Get the count of the query, cached for SERVICE_CACHE_COUNT_TTL seconds per query and parameters.
+    """
+    if not SERVICE_CACHE.enabled:
+        return await get_count(db, q)
+    compiled = q.compile()
+    key = hashlib.sha256(f"{compiled}|{sorted(compiled.params.items())}".encode()).hexdigest()
+    cache = SERVICE_CACHE.cache("query_count:", APP_SETTINGS.SERVICE_CACHE_COUNT_TTL, local_ttl=0)
+    try:
+        count = await cache.get(key)
+    except Exception as e:
+        logger.error(f"Failed to get the cached count: {e}")
+        return await get_count(db, q)
+    if count is None:
+        count = await get_count(db, q)
+        try:
+            await cache.set(key, count)
+        except Exception as e:
+            logger.error(f"Failed to cache the count: {e}")
+    return count
+
+
+async def get_total(db: AsyncSession, q: SelectOfScalar, strategy: CountStrategyEnum) -> Optional[int]:
+    """
+    Get the total of a list endpoint with the count strategy requested, None if not counted.
+    """
+    if strategy == CountStrategyEnum.NONE:
+        return None
+    if strategy == CountStrategyEnum.ESTIMATED:
+        return await get_estimated_count(db, q)
+    if strategy == CountStrategyEnum.CACHED:
+        return await get_cached_count(db, q)
+    return await get_count(db, q)
@@ -0,0 +1,113 @@
+"""
+Benchmark the audit log filters of GET /audit/audit_logs on a seeded table: the time range (start/end)
+on the partitions and the (audit_time, id) index, and the detail search (q) on the detail_tsv GIN index,
+against the ILIKE scan it replaces.
+
+The rows are seeded into audit_logs of the database at POSTGRES_URI (migrated to head) in one transaction,
+rolled back at the end, nothing is kept.
+
+Usage: python benchmarks/audit_logs_search.py [--rows 2000000] [--days 180] [--repeat 5]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlmodel import select
+
+from app import models  # noqa: F401, all the tables of the metadata
+from app.core.audit import service
+from app.core.audit.models import Audit
+from app.core.audit.partitions import ensure_audit_partitions, month_start
+from app.database.postgres.session import ASYNC_SESSION
+from app.enums import CountStrategyEnum
+from app.log import logger
+from app.responses import PaginatedParams
+from app.sorting import SortingParams
+from app.utils.query import get_count
+
+SEED = """
+INSERT INTO audit_logs (username, user_id, audit_time, action, result, detail)
+SELECT 'bench_' || (i % 1000) || '@gmail.com', i % 1000,
+       CAST(:now AS timestamp) - (CAST(:days AS integer) * interval '1 day') * random(),
+       (ARRAY['login', 'logout'])[1 + i % 2],
+       (ARRAY['success', 'success', 'success', 'failure'])[1 + i % 4],
+       (ARRAY['login success', 'logout success', 'Failed to logout: token not found for user',
+              'role changed to admin', 'menu action updated'])[1 + i % 5] || ' ref' || (i % 100000)
+FROM generate_series(1, CAST(:rows AS integer)) AS i
+"""
+
+MERGE_GIN_PENDING_LISTS = """
+SELECT gin_clean_pending_list(i.indexrelid::regclass)
+FROM pg_inherits p JOIN pg_index i ON i.indrelid = p.inhrelid JOIN pg_am a ON a.oid = (
+    SELECT relam FROM pg_class WHERE oid = i.indexrelid)
+WHERE p.inhparent = 'audit_logs'::regclass AND a.amname = 'gin'
+"""
+
+
+async def timed(repeat: int, call) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await call()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)  # keep the debug logs of the queries out of the numbers
+
+    now = datetime.utcnow()
+    db = ASYNC_SESSION()
+    try:
+        conn = await db.connection()
+        months = args.days // 28 + 1
+        await ensure_audit_partitions(conn, now=month_start(now, -months), months_ahead=months)
+        start = time.perf_counter()
+        await conn.execute(text(SEED), {"now": now, "days": args.days, "rows": args.rows})
+        # what autovacuum does after a bulk insert, the rows are only in the pending list of the GIN indexes until then
+        await conn.execute(text(MERGE_GIN_PENDING_LISTS))
+        await conn.execute(text("ANALYZE audit_logs"))
+        print(f"seeded {args.rows} audit logs over {args.days} days in {time.perf_counter() - start:.1f}s")
+
+        sorting = SortingParams(sort_by="audit_time", order="desc")
+        scenarios = {
+            "no filter": {},
+            "last 24h": {"start": now - timedelta(hours=24)},
+            "user, last 7 days": {"username": "bench_42@gmail.com", "start": now - timedelta(days=7)},
+            "q rare word": {"q": "ref12345"},
+            "q common phrase": {"q": '"token not found"'},
+            "q + last 24h": {"q": '"token not found"', "start": now - timedelta(hours=24)},
+        }
+        print(f"{'filters':<20}{'count':<11}{'total':>9}{'page ms':>10}")
+        for name, filters in scenarios.items():
+            for count in (CountStrategyEnum.EXACT, CountStrategyEnum.NONE):
+                p = PaginatedParams(page=1, size=50, cursor=None, count=count)
+                data = await service.get_audit_logs(db, p, sorting, filters)
+                elapsed = await timed(args.repeat, lambda: service.get_audit_logs(db, p, sorting, filters))
+                print(f"{name:<20}{count.value:<11}{str(data.total):>9}{elapsed * 1000:>10.1f}")
+
+        # the search before detail_tsv: a sequential scan of every partition
+        query = select(Audit).where(Audit.detail.ilike("%ref12345%"))
+        total = await get_count(db, query)
+        elapsed = await timed(args.repeat, lambda: get_count(db, query))
+        print(f"{'ilike rare word':<20}{'exact':<11}{total:>9}{elapsed * 1000:>10.1f}")
+    finally:
+        await db.rollback()
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,147 @@
+"""
+Benchmark CustomAuthMiddleware (pure ASGI) against the previous BaseHTTPMiddleware based implementation.
+
+Both variants share the same authentication logic, a warm verified-token cache and a stubbed principal
+query, so the numbers only reflect the per-request cost of the middleware plumbing.
+
+Usage: python benchmarks/auth_middleware.py [--requests 20000] [--concurrency 50] [--chunks 1]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app.core.auth.schemas import Principal
+from app.core.auth.service import create_jwt_access_token
+from app.core.auth.token_cache import VERIFIED_TOKEN_CACHE
+from app.middlewares import CustomAuthMiddleware
+from app.utils.checksum import calculate_token_digest
+
+USER = "bench@gmail.com"
+
+
+class LegacyAuthMiddleware(BaseHTTPMiddleware):
+    """ The previous BaseHTTPMiddleware flavour, kept here for comparison only. """
+
+    def __init__(self, app, whitelist):
+        super().__init__(app)
+        self.whitelist = whitelist
+        self.auth = CustomAuthMiddleware(app, whitelist)
+
+    async def dispatch(self, request, call_next):
+        if request.url.path not in self.whitelist:
+            result = await self.auth.authenticate(request.headers)
+            if isinstance(result, Response):
+                return result
+            request.state.principal = result
+        return await call_next(request)
+
+
+def build_app(middleware_class, chunks: int):
+    async def plain(request):
+        return PlainTextResponse("ok")
+
+    async def stream(request):
+        async def body():
+            for _ in range(chunks):
+                yield b"x" * 1024
+
+        return StreamingResponse(body())
+
+    app = Starlette(routes=[Route("/plain", plain), Route("/stream", stream)])
+    app.add_middleware(middleware_class, whitelist=["/"])
+    return app
+
+
+async def call(app, path: str, headers: list) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 8000),
+    }
+
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and not message.get("more_body", False):
+            response_done.set()
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return time.perf_counter() - start
+
+
+async def run(app, path: str, headers: list, requests: int, concurrency: int) -> list:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            latencies.append(await call(app, path, headers))
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies
+
+
+def report(name: str, path: str, latencies: list, elapsed: float):
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<22} {path:<8} {len(latencies) / elapsed:>10.0f} req/s "
+          f"p50 {statistics.median(latencies) * 1e6:>8.1f} us  p99 {p99 * 1e6:>8.1f} us")
+
+
+async def main(args):
+    token = await create_jwt_access_token(USER, 60 * 60)
+    principal = Principal(username=USER, user_id=1, role_id=1, role_name="admin")
+    VERIFIED_TOKEN_CACHE.set(calculate_token_digest(token), {"user_id": USER, "exp": time.time() + 60 * 60})
+
+    async def resolve_principal(digest, username):
+        return principal
+
+    # keep the database out of the numbers, the principal query is the same for both variants
+    CustomAuthMiddleware.resolve_principal = staticmethod(resolve_principal)
+    headers = [(b"user", USER.encode()), (b"authorization", token.encode())]
+
+    for name, middleware_class in (("BaseHTTPMiddleware", LegacyAuthMiddleware),
+                                   ("pure ASGI", CustomAuthMiddleware)):
+        app = build_app(middleware_class, args.chunks)
+        for path in ("/plain", "/stream"):
+            await run(app, path, headers, min(args.requests, 1000), args.concurrency)  # warm up
+            start = time.perf_counter()
+            latencies = await run(app, path, headers, args.requests, args.concurrency)
+            report(name, path, latencies, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=1, help="chunks of 1KB in the streaming response")
+    asyncio.run(main(parser.parse_args()))
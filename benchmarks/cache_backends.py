@@ -0,0 +1,91 @@
+"""
+Benchmark the cache backends (see CACHE_BACKEND) on the payloads we cache: the memory backend,
+and the redis backend if a redis is available at REDIS_URI.
+
+For every backend and payload it reports the set/get round trip time per call,
+with the sync caches of the msal flows and the async caches of the service functions.
+
+Usage: python benchmarks/cache_backends.py [--iterations 5000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+import redis.asyncio as aioredis
+from cache_codecs import msal_flow, products, role_menus
+
+from app.cache.module.base import AsyncRedisCache, RedisCache
+from app.cache.module.memory import AsyncMemoryCache, MemoryCache, MemoryStore
+from app.configs import APP_SETTINGS
+from app.log import logger
+
+
+def sync_caches():
+    yield "memory", MemoryCache(MemoryStore(64 * 1024 * 1024), "bench:")
+    redis_conn = redis.from_url(APP_SETTINGS.REDIS_URI, socket_connect_timeout=1)
+    try:
+        redis_conn.ping()
+    except redis.RedisError:
+        print(f"skip redis, it is not available at {APP_SETTINGS.REDIS_URI}")
+        return
+    yield "redis", RedisCache(redis_conn, "bench:")
+    redis_conn.close()
+
+
+async def async_caches():
+    yield "memory", AsyncMemoryCache(MemoryStore(64 * 1024 * 1024), "bench:")
+    redis_conn = aioredis.from_url(APP_SETTINGS.REDIS_URI, socket_connect_timeout=1)
+    try:
+        await redis_conn.ping()
+    except redis.RedisError:
+        return
+    yield "redis", AsyncRedisCache(redis_conn, "bench:")
+    await redis_conn.aclose()
+
+
+def bench_sync(cache, payload, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        cache.set(f"key:{i % 100}", payload)
+        cache.get(f"key:{i % 100}")
+    return time.perf_counter() - start
+
+
+async def bench_async(cache, payload, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        await cache.set(f"key:{i % 100}", payload)
+        await cache.get(f"key:{i % 100}")
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)  # keep the debug logs of the caches out of the numbers
+
+    payloads = {
+        "msal_flow": msal_flow(),
+        "role_menus": role_menus(),
+        "products": products(),
+    }
+    print(f"{'client':<8}{'backend':<10}{'payload':<14}{'set+get us':>12}")
+    for name, cache in sync_caches():
+        for payload_name, payload in payloads.items():
+            elapsed_us = bench_sync(cache, payload, args.iterations) / args.iterations * 1e6
+            print(f"{'sync':<8}{name:<10}{payload_name:<14}{elapsed_us:>12.2f}")
+    async for name, cache in async_caches():
+        for payload_name, payload in payloads.items():
+            elapsed_us = await bench_async(cache, payload, args.iterations) / args.iterations * 1e6
+            print(f"{'async':<8}{name:<10}{payload_name:<14}{elapsed_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
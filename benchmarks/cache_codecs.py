@@ -0,0 +1,119 @@
+"""
+Benchmark the cache codecs and compressors (see app/cache/module/codec.py) on the payloads we cache:
+msal auth code flows, role menu lists and the product list.
+
+For every payload and serializer it reports the encoded size and the encode/decode time per call.
+
+Usage: python benchmarks/cache_codecs.py [--iterations 20000] [--threshold 1024]
+"""
+import argparse
+import csv
+import json
+import os
+import secrets
+import sys
+import timeit
+from urllib.parse import urlencode
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.cache.module.codec import CODECS, COMPRESSORS, CacheSerializer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_DIR = os.path.join(ROOT_DIR, "app/database/postgres/seed")
+
+
+def msal_flow() -> dict:
+    """
+    Same shape as ConfidentialClientApplication.initiate_auth_code_flow(),
+    cached in msal_auth_flow:
+    """
+    state = secrets.token_urlsafe(16)
+    nonce = secrets.token_urlsafe(32)
+    redirect_uri = "https://portal.example.com/api/v1/auth/redirect"
+    query = urlencode({
+        "client_id": "00000000-0000-0000-0000-000000000000",
+        "response_type": "code",
+        "redirect_uri": redirect_uri,
+        "scope": ".default offline_access openid profile",
+        "state": state,
+        "code_challenge": secrets.token_urlsafe(32),
+        "code_challenge_method": "S256",
+        "nonce": nonce,
+        "client_info": 1,
+    })
+    return {
+        "state": state,
+        "redirect_uri": redirect_uri,
+        "scope": [".default", "offline_access", "openid", "profile"],
+        "auth_uri": f"https://login.microsoftonline.com/00000000-0000-0000-0000-000000000000"
+                    f"/oauth2/v2.0/authorize?{query}",
+        "code_verifier": secrets.token_urlsafe(32),
+        "nonce": nonce,
+        "claims_challenge": None,
+    }
+
+
+def role_menus(repeat: int = 1) -> list:
+    """ Same shape as rbac get_role_menus(), built from the menus seed. """
+    with open(os.path.join(SEED_DIR, "menus.json")) as f:
+        menus = json.load(f)["menus"]
+
+    result = []
+    for _ in range(repeat):
+        for parent in menus:
+            parent_id = len(result) + 1
+            for menu in [parent] + parent.get("children", []):
+                for action in ("read", "write"):
+                    result.append({"id": len(result) + 1,
+                                   "name": menu["name"],
+                                   "path": menu["path"],
+                                   "parent_id": None if menu is parent else parent_id,
+                                   "super_only": menu.get("superOnly", False),
+                                   "action": action})
+    return result
+
+
+def products() -> list:
+    """ Same shape as the product list, built from the products seed. """
+    with open(os.path.join(SEED_DIR, "products.csv")) as f:
+        return [{"id": i, "group": row["Group"], "name": row["Name"], "code": row["Code"],
+                 "status": "active"}
+                for i, row in enumerate(csv.DictReader(f), start=1)]
+
+
+def serializers(threshold: int):
+    for codec in CODECS:
+        for compression in [None] + list(COMPRESSORS):
+            name = f"{codec}+{compression}" if compression else codec
+            yield name, CacheSerializer(codec=codec, compression=compression,
+                                        compression_threshold=threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--threshold", type=int, default=1024,
+                        help="compression threshold in bytes")
+    args = parser.parse_args()
+
+    payloads = {
+        "msal_flow": msal_flow(),
+        "role_menus": role_menus(),
+        "role_menus_x20": role_menus(repeat=20),
+        "products": products(),
+    }
+    print(f"{'payload':<16}{'serializer':<16}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for payload_name, payload in payloads.items():
+        for name, serializer in serializers(args.threshold):
+            encoded = serializer.dumps(payload)
+            assert serializer.loads(encoded) == payload
+            encode = timeit.timeit(lambda: serializer.dumps(payload), number=args.iterations)
+            decode = timeit.timeit(lambda: serializer.loads(encoded), number=args.iterations)
+            print(f"{payload_name:<16}{name:<16}{len(encoded):>8}"
+                  f"{encode / args.iterations * 1e6:>12.2f}{decode / args.iterations * 1e6:>12.2f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 from logging.config import fileConfig
 
@@ -44,6 +45,14 @@ target_metadata = None
 # comment line above and instead of that write
 target_metadata = SQLModel.metadata
 
+
+def include_name(name, type_, parent_names):
+    # the partitions of audit_logs are managed by app/core/audit/partitions.py, not by the models
+    if type_ == "table":
+        return not (name == "audit_logs_default" or re.match(r"^audit_logs_p\d{6}$", name))
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -66,6 +75,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_name=include_name,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -89,7 +99,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_name=include_name
         )
 
         with context.begin_transaction():
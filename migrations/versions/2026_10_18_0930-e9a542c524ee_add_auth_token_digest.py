@@ -0,0 +1,30 @@
+"""add auth token digest
+
+Revision ID: e9a542c524ee
+Revises: 9130a591cbac
+Create Date: 2026-10-18 09:30:12.417305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9a542c524ee'
+down_revision = '9130a591cbac'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('auth_token', sa.Column('token_digest', sa.LargeBinary(length=32), nullable=True))
+    # backfill with the same sha256 digest as app.utils.checksum.calculate_token_digest
+    op.execute("UPDATE auth_token SET token_digest = sha256(convert_to(token, 'UTF8'))")
+    op.alter_column('auth_token', 'token_digest', nullable=False)
+    op.create_index(op.f('ix_auth_token_token_digest'), 'auth_token', ['token_digest'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_auth_token_token_digest'), table_name='auth_token')
+    op.drop_column('auth_token', 'token_digest')
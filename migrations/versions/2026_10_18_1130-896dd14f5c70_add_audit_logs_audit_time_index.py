@@ -0,0 +1,25 @@
+"""add audit logs audit time index
+
+Revision ID: 896dd14f5c70
+Revises: e9a542c524ee
+Create Date: 2026-10-18 11:30:41.208113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '896dd14f5c70'
+down_revision = 'e9a542c524ee'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_audit_logs_audit_time_id', 'audit_logs', ['audit_time', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_audit_logs_audit_time_id', table_name='audit_logs')
@@ -0,0 +1,92 @@
+"""partition audit logs by audit time
+
+Revision ID: d3577f80cfe2
+Revises: 896dd14f5c70
+Create Date: 2026-10-18 14:00:27.530962
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3577f80cfe2'
+down_revision = '896dd14f5c70'
+branch_labels = None
+depends_on = None
+
+# same as AUDIT_PARTITION_PREMAKE_MONTHS, later months are created by app/core/audit/partitions.py
+PREMAKE_MONTHS = 3
+
+
+def _month_start(dt: datetime, months: int = 0) -> datetime:
+    year, month = divmod(dt.year * 12 + dt.month - 1 + months, 12)
+    return datetime(year, month + 1, 1)
+
+
+def upgrade() -> None:
+    op.rename_table('audit_logs', 'audit_logs_legacy')
+    op.execute("ALTER TABLE audit_logs_legacy RENAME CONSTRAINT audit_logs_pkey TO audit_logs_legacy_pkey")
+    for index in ('ix_audit_logs_id', 'ix_audit_logs_user_id', 'ix_audit_logs_username', 'ix_audit_logs_audit_time_id'):
+        op.drop_index(index, table_name='audit_logs_legacy')
+
+    # the primary key of a partitioned table must include the partition key
+    op.create_table('audit_logs',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('audit_logs_id_seq'::regclass)"), nullable=False),
+    sa.Column('username', sqlmodel.sql.sqltypes.AutoString(length=50), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('audit_time', sa.DateTime(), nullable=False),
+    sa.Column('action', sqlmodel.sql.sqltypes.AutoString(length=16), nullable=False),
+    sa.Column('result', sqlmodel.sql.sqltypes.AutoString(length=16), nullable=False),
+    sa.Column('detail', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id', 'audit_time'),
+    postgresql_partition_by='RANGE (audit_time)'
+    )
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id")
+    op.create_index('ix_audit_logs_user_id', 'audit_logs', ['user_id'], unique=False)
+    op.create_index('ix_audit_logs_username_audit_time', 'audit_logs', ['username', 'audit_time'], unique=False)
+    op.create_index('ix_audit_logs_action_audit_time', 'audit_logs', ['action', 'audit_time'], unique=False)
+    op.create_index('ix_audit_logs_result_audit_time', 'audit_logs', ['result', 'audit_time'], unique=False)
+    op.create_index('ix_audit_logs_audit_time_id', 'audit_logs', ['audit_time', 'id'], unique=False)
+
+    # one partition per month, from the oldest audit log to a few months ahead
+    now = datetime.utcnow()
+    oldest = op.get_bind().execute(sa.text("SELECT min(audit_time) FROM audit_logs_legacy")).scalar() or now
+    start = _month_start(min(oldest, now))
+    while start <= _month_start(now, PREMAKE_MONTHS):
+        end = _month_start(start, 1)
+        op.execute(f"CREATE TABLE audit_logs_p{start:%Y%m} PARTITION OF audit_logs "
+                   f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')")
+        start = end
+    op.execute("CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT")
+
+    op.execute("INSERT INTO audit_logs (id, username, user_id, audit_time, action, result, detail) "
+               "SELECT id, username, user_id, audit_time, action, result, detail FROM audit_logs_legacy")
+    op.drop_table('audit_logs_legacy')
+
+
+def downgrade() -> None:
+    op.rename_table('audit_logs', 'audit_logs_partitioned')
+    op.execute("ALTER TABLE audit_logs_partitioned RENAME CONSTRAINT audit_logs_pkey TO audit_logs_partitioned_pkey")
+    op.create_table('audit_logs',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('audit_logs_id_seq'::regclass)"), nullable=False),
+    sa.Column('username', sqlmodel.sql.sqltypes.AutoString(length=50), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('audit_time', sa.DateTime(), nullable=False),
+    sa.Column('action', sqlmodel.sql.sqltypes.AutoString(length=16), nullable=False),
+    sa.Column('result', sqlmodel.sql.sqltypes.AutoString(length=16), nullable=False),
+    sa.Column('detail', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id")
+    op.execute("INSERT INTO audit_logs (id, username, user_id, audit_time, action, result, detail) "
+               "SELECT id, username, user_id, audit_time, action, result, detail FROM audit_logs_partitioned")
+    # the partitions are dropped with the partitioned table
+    op.drop_table('audit_logs_partitioned')
+    op.create_index('ix_audit_logs_id', 'audit_logs', ['id'], unique=False)
+    op.create_index('ix_audit_logs_user_id', 'audit_logs', ['user_id'], unique=False)
+    op.create_index('ix_audit_logs_username', 'audit_logs', ['username'], unique=False)
+    op.create_index('ix_audit_logs_audit_time_id', 'audit_logs', ['audit_time', 'id'], unique=False)
@@ -0,0 +1,36 @@
+"""add audit logs detail search
+
+Revision ID: 4e7c25279cb6
+Revises: d3577f80cfe2
+Create Date: 2026-10-18 16:30:05.871240
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7c25279cb6'
+down_revision = 'd3577f80cfe2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # generated for the existing rows too, every partition is rewritten
+    op.add_column('audit_logs', sa.Column('detail_tsv', postgresql.TSVECTOR(),
+                                          sa.Computed("to_tsvector('simple'::regconfig, (detail)::text)",
+                                                      persisted=True), nullable=True))
+    # the words of the details are many and mostly rare, with the default statistics every word not in the
+    # most common ones is estimated to match 0.5% of the rows, and a rare word search sorted by audit time
+    # walks the whole audit_time index rather than the few rows of the GIN index.
+    # Set on the existing partitions too, app/core/audit/partitions.py copies it to the new ones.
+    op.execute("ALTER TABLE audit_logs ALTER COLUMN detail_tsv SET STATISTICS 1000")
+    op.create_index('ix_audit_logs_detail_tsv', 'audit_logs', ['detail_tsv'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_audit_logs_detail_tsv', table_name='audit_logs', postgresql_using='gin')
+    op.drop_column('audit_logs', 'detail_tsv')